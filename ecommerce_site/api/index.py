@@ -1,14 +1,20 @@
 import os
 import sys
 
-from django.core.wsgi import get_wsgi_application
-
 # Add your Django project path
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 # Set the settings module (replace 'your_project_name' with your actual project folder name)
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ecommerce_site.settings")
 
-app = get_wsgi_application()
+# Vercel's Python runtime serves `app` as WSGI or ASGI, whichever it is. Set
+# DJANGO_ASGI=1 in the project's environment to serve the async catalog views
+# (see ecommerce_site/asgi.py); the default stays WSGI.
+if os.environ.get("DJANGO_ASGI") == "1":
+    from django.core.asgi import get_asgi_application
 
+    app = get_asgi_application()
+else:
+    from django.core.wsgi import get_wsgi_application
 
+    app = get_wsgi_application()
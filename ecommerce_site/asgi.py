@@ -3,6 +3,19 @@ ASGI config for ecommerce_site project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Run it with uvicorn (in requirements.txt) instead of gunicorn + wsgi.py:
+
+    python manage.py collectstatic --noinput
+    uvicorn ecommerce_site.asgi:application --host 0.0.0.0 --port 8000 --workers 4
+
+Loading this module sets DJANGO_ASGI=1, which serves the catalog pages
+(product list, product detail, category, cart) from the async views in
+store/async_views.py and turns off persistent database connections. Set
+ASYNC_CATALOG_VIEWS=0 to keep the sync views under ASGI. Compare the two
+deployments with `python manage.py benchmark_servers`. On Vercel,
+ecommerce_site/api/index.py serves this application when DJANGO_ASGI=1 is
+set in the project's environment.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -12,5 +25,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_site.settings')
+os.environ.setdefault('DJANGO_ASGI', '1')
 
 application = get_asgi_application()
@@ -37,8 +37,9 @@ INSTALLED_APPS = [
 # Middleware
 # ----------------------------
 MIDDLEWARE = [
+    "store.middleware.QueryMetricsMiddleware",  # first, so it sees every query
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",  # <--- handles static files
+    "store.middleware.StaticFilesMiddleware",  # <--- handles static files (WhiteNoise, async-capable)
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -47,6 +48,10 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Per-view query/latency metrics (store/middleware.py), off unless asked for; log requests over N queries
+QUERY_METRICS_ENABLED = os.environ.get("QUERY_METRICS_ENABLED", "0") == "1"
+QUERY_METRICS_LOG_THRESHOLD = int(os.environ["QUERY_METRICS_LOG_THRESHOLD"]) if os.environ.get("QUERY_METRICS_LOG_THRESHOLD") else None
+
 ROOT_URLCONF = "ecommerce_site.urls"
 
 # ----------------------------
@@ -63,6 +68,8 @@ TEMPLATES = [
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
                 "store.views.cart_count",
+                "store.views.wishlist_count",
+                "store.views.category_menu",
             ],
         },
     },
@@ -70,6 +77,13 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "ecommerce_site.wsgi.application"
 
+# Set to 1 by ecommerce_site/asgi.py (see there for running under uvicorn).
+# ASYNC_CATALOG_VIEWS routes the catalog pages to store/async_views.py; it
+# defaults to on under ASGI and off under WSGI, where async views would only
+# add a thread hop.
+ASGI = os.environ.get("DJANGO_ASGI", "0") == "1"
+ASYNC_CATALOG_VIEWS = os.environ.get("ASYNC_CATALOG_VIEWS", "1" if ASGI else "0") == "1"
+
 # ----------------------------
 # Database
 # ----------------------------
@@ -77,11 +91,49 @@ DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///" + str(BASE_DIR / "db.
 DATABASES = {
     "default": dj_database_url.config(
         default=DATABASE_URL,
-        conn_max_age=600,
+        # Under ASGI every request has its own connection, so don't keep them open
+        conn_max_age=0 if ASGI else 600,
         ssl_require=True if "postgres" in DATABASE_URL else False,
     )
 }
 
+# ----------------------------
+# Cache
+# ----------------------------
+# In-process LRU by default; set REDIS_URL (shared, LRU via maxmemory-policy)
+# or CACHE_DIR (file-based) to share cached catalog pages between workers.
+REDIS_URL = os.environ.get("REDIS_URL")
+CACHE_DIR = os.environ.get("CACHE_DIR")
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "5000"))
+# Seconds a cached catalog entry lives; bounds how long a worker whose
+# in-process cache missed a version bump keeps serving the old one
+CATALOG_CACHE_TIMEOUT = int(os.environ.get("CATALOG_CACHE_TIMEOUT", "300"))
+
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+            "KEY_PREFIX": "store",
+        }
+    }
+elif CACHE_DIR:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": CACHE_DIR,
+            "OPTIONS": {"MAX_ENTRIES": CACHE_MAX_ENTRIES},
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "store-catalog",
+            "OPTIONS": {"MAX_ENTRIES": CACHE_MAX_ENTRIES},
+        }
+    }
+
 # ----------------------------
 # Password Validation
 # ----------------------------
@@ -120,3 +172,19 @@ APPEND_SLASH = True
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 
+
+# ----------------------------
+# Email
+# ----------------------------
+# Order emails are sent by the task worker (`manage.py runworker`), not in the request.
+# The console backend prints them; point EMAIL_BACKEND/EMAIL_HOST at a real server in production.
+EMAIL_BACKEND = os.environ.get("EMAIL_BACKEND", "django.core.mail.backends.console.EmailBackend")
+EMAIL_HOST = os.environ.get("EMAIL_HOST", "localhost")
+EMAIL_PORT = int(os.environ.get("EMAIL_PORT", "25"))
+DEFAULT_FROM_EMAIL = os.environ.get("DEFAULT_FROM_EMAIL", "orders@localhost")
+
+# Per-unit GST used when no TaxRule exists (store/pricing.py)
+PRICING_DEFAULT_FLAT_TAX = os.environ.get("PRICING_DEFAULT_FLAT_TAX", "50.00")
+
+# Orders older than this (and finished) are moved to the archive by `manage.py archive_orders` (store/orders.py)
+ORDER_HOT_MONTHS = int(os.environ.get("ORDER_HOT_MONTHS", "12"))
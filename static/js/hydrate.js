@@ -0,0 +1,107 @@
+/* hydrate.js - fill the per-user parts into a catalog shell (see store/shell.py): sign-in state,
+   badge counts, wishlist hearts, cart quantities, CSRF tokens and flash messages, all from one
+   request to the user_fragments endpoint. Without JS the shell reads as the guest view, but its
+   forms have no CSRF token until this fills one in. */
+(function () {
+    var script = document.currentScript;
+    var url = script && script.dataset.url;
+    var state = null;
+
+    function productIds(root) {
+        var ids = {};
+        Array.prototype.forEach.call(root.querySelectorAll('[data-product-id]'), function (el) {
+            ids[el.dataset.productId] = true;
+        });
+        return Object.keys(ids);
+    }
+
+    function each(root, selector, fn) {
+        Array.prototype.forEach.call(root.querySelectorAll(selector), fn);
+    }
+
+    function fillProducts(root) {
+        each(root, 'input[name="csrfmiddlewaretoken"]', function (input) {
+            input.value = state.csrf_token;
+        });
+        each(root, '.wishlist-btn[data-product-id]', function (button) {
+            var saved = state.wishlist.indexOf(Number(button.dataset.productId)) !== -1;
+            var icon = button.querySelector('i');
+            button.classList.toggle('in-wishlist', saved);
+            if (icon) {
+                icon.classList.toggle('fas', saved);
+                icon.classList.toggle('far', !saved);
+            }
+        });
+        each(root, '[data-cart-quantity]', function (el) {
+            var quantity = state.cart[el.dataset.productId];
+            el.textContent = quantity ? quantity + ' in cart' : '';
+            el.hidden = !quantity;
+        });
+    }
+
+    function fillPage() {
+        each(document, '[data-auth]', function (el) {
+            el.hidden = (el.dataset.auth === 'user') !== state.authenticated;
+        });
+        each(document, '[data-username]', function (el) {
+            el.textContent = state.username || '';
+        });
+        each(document, '[data-count]', function (el) {
+            var count = state.counts[el.dataset.count] || 0;
+            el.textContent = count;
+            if (el.dataset.count === 'wishlist') {
+                el.hidden = !count;
+            }
+        });
+        var box = document.querySelector('[data-messages]');
+        if (box) {
+            state.messages.forEach(function (message) {
+                var alert = document.createElement('div');
+                alert.className = 'alert alert-' + message.tags;
+                alert.setAttribute('role', 'alert');
+                alert.textContent = message.text;
+                box.appendChild(alert);
+            });
+        }
+        fillProducts(document);
+    }
+
+    function load(ids) {
+        return fetch(url + '?products=' + ids.join(','), { credentials: 'same-origin' })
+            .then(function (response) {
+                if (!response.ok) {
+                    throw new Error(response.statusText);
+                }
+                return response.json();
+            });
+    }
+
+    if (!url || !window.fetch) {
+        return;
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        load(productIds(document))
+            .then(function (data) {
+                state = data;
+                fillPage();
+            })
+            .catch(function () {
+                // The page stays as rendered: the guest view
+            });
+    });
+
+    // Cards added by infinite-scroll.js: fetch state for the new products only
+    document.addEventListener('infinite-scroll:loaded', function (event) {
+        if (!state) {
+            return;
+        }
+        load(productIds(event.target))
+            .then(function (data) {
+                state.cart = data.cart;
+                state.wishlist = data.wishlist;
+                fillProducts(event.target);
+            })
+            .catch(function () {});
+    });
+})();
@@ -0,0 +1,46 @@
+/* infinite-scroll.js - load the next batch of a [data-infinite-scroll] container (product cards,
+   reviews) as the user scrolls. Each batch ends with a .load-more link; without JS it is a plain
+   "next page" link. */
+document.addEventListener('DOMContentLoaded', function () {
+    var containers = document.querySelectorAll('[data-infinite-scroll]');
+    if (!containers.length || !('IntersectionObserver' in window) || !window.fetch) {
+        return;
+    }
+
+    var observer = new IntersectionObserver(function (entries) {
+        entries.forEach(function (entry) {
+            if (!entry.isIntersecting) {
+                return;
+            }
+            var link = entry.target;
+            var container = link.parentNode;
+            observer.unobserve(link);
+            fetch(link.dataset.fragmentUrl, { credentials: 'same-origin' })
+                .then(function (response) {
+                    if (!response.ok) {
+                        throw new Error(response.statusText);
+                    }
+                    return response.text();
+                })
+                .then(function (html) {
+                    link.insertAdjacentHTML('beforebegin', html);
+                    link.remove();
+                    watch(container);
+                    // hydrate.js fills the per-user bits of the new cards in
+                    container.dispatchEvent(new CustomEvent('infinite-scroll:loaded', { bubbles: true }));
+                })
+                .catch(function () {
+                    // Leave the link in place so the user can still click through
+                });
+        });
+    }, { rootMargin: '400px' });
+
+    function watch(container) {
+        var next = container.querySelector('.load-more');
+        if (next) {
+            observer.observe(next);
+        }
+    }
+
+    Array.prototype.forEach.call(containers, watch);
+});
@@ -1,5 +1,14 @@
-from django.contrib import admin
-from .models import Product, Cart, Registerpage, Feedback
+import io
+
+from django.contrib import admin, messages
+from django.http import StreamingHttpResponse
+from django.shortcuts import redirect, render
+from django.urls import path
+from django.utils import timezone
+from .catalog_io import ImportFormatError, export_rows, guess_format, import_products
+from .fulfilment import TRANSITIONS, transition
+from .models import (ArchivedOrder, Category, Product, Cart, Registerpage, Feedback, TaxRule, Promotion, Task, Order,
+                     OrderEvent)
 
 # @admin.register(Product)
 # class ProductAdmin(admin.ModelAdmin):
@@ -13,7 +22,114 @@ from .models import Product, Cart, Registerpage, Feedback
 #     list_filter = ('user', 'product', 'added_at')
 #     search_fields = ('user__username', 'product__name')
 
-admin.site.register(Product)
 admin.site.register(Cart)
 admin.site.register(Registerpage)
 admin.site.register(Feedback)
+admin.site.register(TaxRule)
+admin.site.register(Promotion)
+
+
+@admin.register(Category)
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ('name', 'slug', 'icon', 'product_count')
+    prepopulated_fields = {'slug': ('name',)}
+    search_fields = ('name',)
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'max_attempts', 'run_at', 'finished_at')
+    list_filter = ('status', 'name')
+    search_fields = ('idempotency_key',)
+    readonly_fields = ('attempts', 'last_error', 'locked_by', 'locked_at', 'created_at', 'finished_at')
+    actions = ['retry_now']
+
+    @admin.action(description="Run again now")
+    def retry_now(self, request, queryset):
+        updated = queryset.exclude(status=Task.RUNNING).update(
+            status=Task.QUEUED, run_at=timezone.now(), attempts=0, locked_by='', locked_at=None)
+        messages.success(request, f"Queued {updated} task(s).")
+
+
+def _status_action(status):
+    def move(modeladmin, request, queryset):
+        result = transition(queryset.values_list('pk', flat=True), status, actor=request.user, note='admin')
+        messages.success(request, f"Marked {result.moved} order(s) as {status}.")
+        if result.skipped:
+            messages.warning(request, f"Skipped {len(result.skipped)} order(s) that can't move to {status}.")
+    move.__name__ = f'mark_{status.lower()}'
+    return admin.action(description=f"Mark selected orders as {status}")(move)
+
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'customer_name', 'order_status', 'quantity', 'total_amount', 'created_at')
+    list_filter = ('order_status',)
+    search_fields = ('=id', 'customer_name', 'email', 'user__username')
+    raw_id_fields = ('user', 'product')
+    # Statuses only change through the actions, so every change is checked and logged (see fulfilment.py)
+    readonly_fields = ('order_status', 'created_at', 'updated_at')
+    actions = [_status_action(status) for status in TRANSITIONS if status != Order.PENDING]
+
+
+@admin.register(OrderEvent)
+class OrderEventAdmin(admin.ModelAdmin):
+    list_display = ('order_id', 'from_status', 'to_status', 'actor', 'note', 'created_at')
+    list_filter = ('to_status',)
+    search_fields = ('=order_id',)
+
+    # Append-only
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'customer_name', 'order_status', 'total_amount', 'created_at', 'archived_at')
+    list_filter = ('order_status',)
+    search_fields = ('=id', 'customer_name', 'user__username')
+    raw_id_fields = ('user',)
+
+
+@admin.register(Product)
+class ProductAdmin(admin.ModelAdmin):
+    change_list_template = 'admin/store/product/change_list.html'
+    actions = ['export_csv']
+
+    def get_urls(self):
+        urls = [path('import/', self.admin_site.admin_view(self.import_view), name='store_product_import')]
+        return urls + super().get_urls()
+
+    @admin.action(description="Export selected products as CSV")
+    def export_csv(self, request, queryset):
+        response = StreamingHttpResponse(export_rows('csv', queryset), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="products.csv"'
+        return response
+
+    def import_view(self, request):
+        """Upload a CSV/JSONL file and upsert its rows on sku"""
+        if not self.has_add_permission(request) or not self.has_change_permission(request):
+            return redirect('admin:store_product_changelist')
+        if request.method == 'POST' and request.FILES.get('file'):
+            upload = request.FILES['file']
+            try:
+                stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+                result = import_products(stream, guess_format(upload.name))
+            except (ImportFormatError, UnicodeDecodeError) as exc:
+                messages.error(request, f"Import failed: {exc}")
+            else:
+                for line, sku, message in result.errors[:20]:
+                    messages.warning(request, f"Line {line} (sku {sku or '?'}): {message}")
+                if result.failed > 20:
+                    messages.warning(request, f"... and {result.failed - 20} more rejected row(s)")
+                messages.success(request, f"Created {result.created}, updated {result.updated}, "
+                                          f"skipped {result.failed} product(s).")
+                return redirect('admin:store_product_changelist')
+        context = {**self.admin_site.each_context(request), 'opts': self.model._meta, 'title': 'Import products'}
+        return render(request, 'admin/store/product/import.html', context)
@@ -0,0 +1,237 @@
+"""
+Sales analytics from daily rollups.
+
+`manage.py rollup_sales` (from cron, every few minutes) folds order lines into
+DailyProductSales and DailyCategorySales, filed under the day the order was
+placed and the product's category at rollup time. It is incremental: three
+watermarks record how far it has read.
+
+- 'sales:items', on OrderItem ids. Lines past it are added. Lines of orders
+  younger than SETTLE_TIME wait for the next run, so a checkout still
+  committing with a lower id isn't skipped (see watermarks.py).
+- 'sales:legacy-orders', on Order ids, the same for orders without lines
+  (orders.legacy_orders()), which count as one line for their own product.
+- 'sales:cancellations', on OrderEvent ids. A cancelled order's lines are
+  taken back out, or never added if the cancellation is read first.
+
+The staff dashboard and the sales_report JSON only read the rollups: a year
+of history is at most 365 rows per product, whatever the order volume.
+
+moving_average() and rank() use NumPy when it is installed and plain Python
+otherwise, with the same results.
+"""
+from dataclasses import dataclass, field
+from itertools import chain
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import watermarks
+from .models import DailyCategorySales, DailyProductSales, Order, OrderEvent, OrderItem
+from .orders import legacy_orders
+
+try:
+    import numpy
+except ImportError:  # optional, see moving_average() and rank()
+    numpy = None
+
+ITEMS_WATERMARK = 'sales:items'
+LEGACY_WATERMARK = 'sales:legacy-orders'
+CANCELLATIONS_WATERMARK = 'sales:cancellations'
+BATCH_SIZE = 5000
+MAX_REPORT_DAYS = 365
+
+
+@dataclass
+class _Fact:
+    units: int = 0
+    revenue: Decimal = Decimal('0.00')
+    orders: set = field(default_factory=set)
+    ratings: dict = field(default_factory=dict)  # product id -> average rating
+
+
+# ---------------- ROLLUP ----------------
+def _facts(items, orders):
+    """
+    Sums per (date, product id) and per (date, category id) for an OrderItem
+    queryset and the legacy orders among an Order queryset, in two queries
+    """
+    products, categories, count = {}, {}, 0
+    measures = ('product_id', 'product__category_id')
+    rows = chain(
+        items.annotate(day=TruncDate('order__created_at')).values_list(
+            'day', *measures, 'order_id', 'quantity', 'line_total', 'product__average_rating'),
+        legacy_orders(orders).annotate(day=TruncDate('created_at')).values_list(
+            'day', *measures, 'pk', 'quantity', 'total_amount', 'product__average_rating'),
+    )
+    for day, product_id, category_id, order_id, quantity, line_total, rating in rows:
+        for facts, key in ((products, (day, product_id)), (categories, (day, category_id))):
+            fact = facts.setdefault(key, _Fact())
+            fact.units += quantity
+            fact.revenue += line_total
+            fact.orders.add(order_id)
+            fact.ratings[product_id] = rating
+        count += 1
+    return products, categories, count
+
+
+def _apply(model, key_field, facts, sign):
+    """Add (sign=1) or take out (sign=-1) `facts` from the rollup rows, creating missing ones"""
+    if not facts:
+        return
+    keys = {key for _, key in facts}
+    rows = model.objects.filter(date__in={day for day, _ in facts})
+    if None in keys:
+        rows = rows.filter(Q(**{f'{key_field}__in': keys - {None}}) | Q(**{f'{key_field}__isnull': True}))
+    else:
+        rows = rows.filter(**{f'{key_field}__in': keys})
+    existing = {(row.date, getattr(row, key_field)): row for row in rows}
+    created, updated = [], []
+    for (day, key), fact in facts.items():
+        row = existing.get((day, key))
+        if row is None:
+            row = model(date=day, **{key_field: key})
+            created.append(row)
+        else:
+            updated.append(row)
+        row.units += sign * fact.units
+        row.revenue += sign * fact.revenue
+        row.order_count += sign * len(fact.orders)
+        rated = [rating for rating in fact.ratings.values() if rating]
+        if rated:
+            row.average_rating = round(sum(rated) / len(rated), 2)
+    model.objects.bulk_create(created)
+    model.objects.bulk_update(updated, ['units', 'revenue', 'order_count', 'average_rating'])
+
+
+def _roll(items, orders, sign):
+    """Add or take out order lines (see _facts()); returns how many"""
+    products, categories, count = _facts(items, orders)
+    _apply(DailyProductSales, 'product_id', products, sign)
+    _apply(DailyCategorySales, 'category_id', categories, sign)
+    return count
+
+
+def _marks():
+    """The three watermarks, locked until the end of the transaction"""
+    return watermarks.lock(ITEMS_WATERMARK, LEGACY_WATERMARK, CANCELLATIONS_WATERMARK)
+
+
+def _roll_cancellations():
+    """Take out the lines of orders cancelled since the last run, if they were added. Returns how many."""
+    with transaction.atomic():
+        items, legacy, cancellations = _marks()
+        upto = OrderEvent.objects.aggregate(last=Max('pk'))['last'] or cancellations.last_id
+        order_ids = list(OrderEvent.objects.filter(pk__gt=cancellations.last_id, pk__lte=upto,
+                                                   to_status=Order.CANCELLED).values_list('order_id', flat=True))
+        # Lines past the watermarks were never added; the next step skips them
+        taken_out = _roll(OrderItem.objects.filter(order_id__in=order_ids, pk__lte=items.last_id),
+                          Order.objects.filter(pk__in=order_ids, pk__lte=legacy.last_id), -1)
+        cancellations.last_id = upto
+        cancellations.save()
+    return taken_out
+
+
+def _roll_orders(batch_size, now):
+    """Add the next batch of settled order lines and legacy orders. Returns how many, or None once caught up."""
+    with transaction.atomic():
+        items, legacy, cancellations = _marks()
+        batch = watermarks.next_batch(items, legacy, batch_size, now)
+        if batch is None:
+            return None
+        items_upto, orders_upto = batch
+
+        def handled(order_id):
+            # Cancellations already handled by _roll_cancellations() found nothing to take out
+            return Exists(OrderEvent.objects.filter(order_id=OuterRef(order_id), to_status=Order.CANCELLED,
+                                                    pk__lte=cancellations.last_id))
+
+        added = _roll(OrderItem.objects.filter(pk__gt=items.last_id, pk__lte=items_upto).exclude(handled('order_id')),
+                      Order.objects.filter(pk__gt=legacy.last_id, pk__lte=orders_upto).exclude(handled('pk')), 1)
+        watermarks.advance(items, legacy, batch)
+    return added
+
+
+def rollup_sales(batch_size=BATCH_SIZE, now=None):
+    """Bring the daily rollups up to date. Returns (order lines added, order lines taken out)."""
+    now = now or timezone.now()
+    taken_out = _roll_cancellations()
+    added = 0
+    while True:
+        batch = _roll_orders(batch_size, now)
+        if batch is None:
+            return added, taken_out
+        added += batch
+
+
+# ---------------- SERIES ----------------
+def moving_average(values, window=7):
+    """The mean of each value and the (window - 1) before it, fewer at the start"""
+    if numpy is not None and values:
+        series = numpy.asarray(values, dtype=float)
+        sums = numpy.cumsum(series)
+        sums[window:] = sums[window:] - sums[:-window]
+        counts = numpy.minimum(numpy.arange(1, len(series) + 1), window)
+        return [round(float(value), 2) for value in sums / counts]
+    averages, total = [], 0.0
+    for i, value in enumerate(values):
+        total += float(value)
+        if i >= window:
+            total -= float(values[i - window])
+        averages.append(round(total / min(i + 1, window), 2))
+    return averages
+
+
+def rank(values):
+    """1 for the largest value, ties sharing a rank (1, 2, 2, 4)"""
+    if numpy is not None and values:
+        series = -numpy.asarray(values, dtype=float)
+        return (numpy.searchsorted(numpy.sort(series), series, side='left') + 1).tolist()
+    first = {}
+    for position, value in enumerate(sorted((float(value) for value in values), reverse=True), 1):
+        first.setdefault(value, position)
+    return [first[float(value)] for value in values]
+
+
+# ---------------- REPORTS ----------------
+def _top(model, name_field, start, end, limit):
+    rows = list(model.objects.filter(date__range=(start, end)).values(name_field).annotate(
+        units=Sum('units'), revenue=Sum('revenue'), orders=Sum('order_count')).order_by('-revenue')[:limit])
+    for row, position in zip(rows, rank([row['revenue'] for row in rows])):
+        row['name'] = row.pop(name_field) or 'Uncategorized'
+        row['rank'] = position
+    return rows
+
+
+def sales_report(days=30, today=None, limit=10):
+    """
+    Daily revenue with its 7-day moving average, and the top products and
+    categories, for the last `days` days. Reads the rollups only.
+    """
+    days = max(1, min(days, MAX_REPORT_DAYS))
+    end = today or timezone.localdate()
+    start = end - timedelta(days=days - 1)
+    totals = {row['date']: row for row in DailyCategorySales.objects.filter(date__range=(start, end))
+              .values('date').annotate(units=Sum('units'), revenue=Sum('revenue'), orders=Sum('order_count'))}
+    series = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        row = totals.get(day, {})
+        series.append({'date': day, 'units': row.get('units', 0), 'orders': row.get('orders', 0),
+                       'revenue': row.get('revenue') or Decimal('0.00')})
+    for row, average in zip(series, moving_average([row['revenue'] for row in series])):
+        row['revenue_7d'] = average
+    return {
+        'start': start,
+        'end': end,
+        'revenue': sum((row['revenue'] for row in series), Decimal('0.00')),
+        'units': sum(row['units'] for row in series),
+        'orders': sum(row['orders'] for row in series),
+        'days': series,
+        'top_products': _top(DailyProductSales, 'product__name', start, end, limit),
+        'top_categories': _top(DailyCategorySales, 'category__name', start, end, limit),
+    }
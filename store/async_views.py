@@ -0,0 +1,131 @@
+"""
+Async versions of the read-heavy catalog views, served when
+settings.ASYNC_CATALOG_VIEWS is on (the default under ASGI, see
+ecommerce_site/asgi.py).
+
+They reuse the filtering and context code in views.py and only swap the I/O
+for Django's async ORM and async cache API, so a request waiting on the
+database or on a slow client doesn't hold a worker thread. The lookups are
+awaited one after another: Django runs async ORM calls on the request's one
+sync thread, so gathering them wouldn't make them overlap. Ratings are
+denormalized onto Product (see ratings.py), so the detail page needs no
+query for them.
+
+Templates are still rendered in a thread with sync_to_async: the template
+engine is sync, and on the cart page so are the context processors that read
+the session (header counts, messages). The catalog pages are shells (see
+shell.py) that never look at the user. POSTs to the product page (feedback)
+go to the sync view.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import Http404
+from django.shortcuts import render
+from django.urls import reverse
+
+from . import guest_cart, shopping, views
+from .cache import aget_or_set_listing, aget_or_set_product, arender_product_cards
+from .categories import afind_category
+from .conditional import (LISTING_VERSIONS, PUBLIC, conditional, listing_etag, product_etag, product_versions,
+                          reviews_etag)
+from .models import Product
+from .pagination import apaginate
+from .pricing import cart_totals
+from .recommendations import aalso_bought
+from .reviews import areview_page
+from .shell import ashell_response
+
+_render = sync_to_async(render)
+
+
+def _share_user(view):
+    """
+    Load the user once with request.auser() and hand it to the lazy
+    request.user, which caches separately, so the view and the templates
+    don't query it again.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        request.user = await request.auser()
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+async def _catalog_page(request, page_url, category=''):
+    """views._catalog_page with the async ORM and cache"""
+    filters = views._catalog_filters(request, category)
+    wanted = views._filters_category(filters)
+    selected = await afind_category(wanted) if wanted else None
+    if filters['query']:
+        # The search backend probes the database once per process to pick an implementation
+        products = await sync_to_async(views._catalog_products)(filters, selected)
+    else:
+        products = views._catalog_products(filters, selected)
+
+    page = await aget_or_set_listing(
+        views._listing_parts(filters, selected),
+        lambda: apaginate(products, filters['sort'], filters['cursor'], views.PRODUCTS_PER_PAGE),
+    )
+    cards = await arender_product_cards(request, page.items, token=False)
+    return views._catalog_context(page_url, filters, selected, page, cards)
+
+
+# ---------------- PRODUCTS ----------------
+@conditional(listing_etag, PUBLIC)
+async def product_list(request):
+    async def get_context():
+        return views._product_list_context(request, await _catalog_page(request, reverse('product_list')))
+    return await ashell_response(request, LISTING_VERSIONS, 'store/product_list.html', get_context)
+
+
+async def _load_product_detail(product_id, rating=None, cursor=None):
+    product = await Product.objects.select_related('category').filter(id=product_id).afirst()
+    if product is None:
+        raise Http404("No Product matches the given query.")
+    return product, await areview_page(product_id, rating, cursor)
+
+
+@conditional(product_etag, PUBLIC)
+async def product_view(request, product_id):
+    if request.method == 'POST':
+        return await sync_to_async(views.product_view)(request, product_id)
+    # Product and the requested page of its reviews are cached until either of them changes
+    rating, cursor = views._review_filters(request)
+
+    async def get_context():
+        product, reviews = await aget_or_set_product(
+            product_id, lambda: _load_product_detail(product_id, rating, cursor),
+            parts=views._review_parts(rating, cursor),
+        )
+        return views._product_context(product, rating, reviews, also_bought=await aalso_bought(product_id))
+    return await ashell_response(request, product_versions(product_id), 'store/product.html', get_context)
+
+
+@conditional(reviews_etag, PUBLIC)
+async def product_reviews(request, product_id):
+    rating, cursor = views._review_filters(request)
+    reviews = await aget_or_set_product(product_id, lambda: areview_page(product_id, rating, cursor),
+                                        parts=('review_page', rating, cursor))
+    return await sync_to_async(views._reviews_response)(request, product_id, rating, reviews)
+
+
+# ---------------- CART ----------------
+@_share_user
+async def view_cart(request):
+    if request.user.is_authenticated:
+        cart_items = await shopping.acart_items(request.user)
+    else:
+        cart_items = await guest_cart.acart_lines(guest_cart.read(request))
+    totals = cart_totals(cart_items)
+    return await _render(request, 'store/cart.html', {'cart_items': cart_items, 'totals': totals,
+                                                      'total_price': totals.total})
+
+
+# ---------------- CATEGORY ----------------
+@conditional(listing_etag, PUBLIC)
+async def category_view(request, category_name):
+    async def get_context():
+        context = await _catalog_page(request, reverse('category', args=[category_name]), category_name)
+        return views._category_context(category_name, context)
+    return await ashell_response(request, LISTING_VERSIONS, 'store/category.html', get_context)
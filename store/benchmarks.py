@@ -0,0 +1,205 @@
+"""
+Storefront benchmark: seed a synthetic catalog and drive the real URLs with the
+Django test client, recording throughput, latency percentiles and query counts
+per scenario. Run it with `manage.py benchmark` (see that command for options).
+"""
+import random
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils.text import slugify
+
+from .categories import recount_categories
+from .metrics import percentile
+from .models import Cart, Category, Feedback, Order, OrderItem, Product
+from .pricing import apply_prices
+from .ratings import rebuild_ratings
+from .search import rebuild_search_index
+
+CATEGORIES = ['Shoes', 'Shirts', 'Pants', 'Watches', 'Bags', 'Hoodies', 'T-Shirts', 'Jeans', 'Belts', 'Corts']
+ADJECTIVES = ['classic', 'slim', 'relaxed', 'leather', 'cotton', 'denim', 'running', 'formal', 'casual', 'vintage',
+              'waterproof', 'lightweight', 'premium', 'striped', 'canvas', 'wool', 'linen', 'suede', 'sport', 'urban']
+NOUNS = {
+    'Shoes': 'sneaker', 'Shirts': 'shirt', 'Pants': 'chinos', 'Watches': 'watch', 'Bags': 'backpack',
+    'Hoodies': 'hoodie', 'T-Shirts': 'tee', 'Jeans': 'jeans', 'Belts': 'belt', 'Corts': 'court shoe',
+}
+BATCH_SIZE = 1000
+
+
+@contextmanager
+def throwaway_database(name=None):
+    """
+    Run the block against a freshly migrated test database that is dropped
+    afterwards. `name` overrides the test database name, e.g. a file path so
+    other processes can open an SQLite database.
+    """
+    test_settings = connection.settings_dict['TEST']
+    default_name = test_settings['NAME']
+    if name:
+        test_settings['NAME'] = name
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        test_settings['NAME'] = default_name
+
+
+def seed(products=1000, users=50, cart_items=5, feedback=3000, orders=500, rng=None):
+    """Fill an empty database with a synthetic catalog. Returns the created users."""
+    rng = rng or random.Random(0)
+
+    categories = {c.name: c for c in Category.objects.bulk_create([Category(name=name, slug=slugify(name)) for name in CATEGORIES])}
+    catalog = []
+    for i in range(products):
+        category = rng.choice(CATEGORIES)
+        words = rng.sample(ADJECTIVES, 3)
+        catalog.append(Product(
+            name=f"{words[0].title()} {NOUNS[category].title()} {i}",
+            description=f"A {words[0]}, {words[1]} {NOUNS[category]} with {words[2]} finish. " * 3,
+            price=Decimal(rng.randrange(299, 9999)),
+            discount=Decimal(rng.choice([0, 0, 0, 50, 100])),
+            category=categories[category],
+            is_new=rng.random() < 0.05,
+        ))
+    apply_prices(catalog)
+    catalog = Product.objects.bulk_create(catalog, batch_size=BATCH_SIZE)
+
+    password = make_password('benchmark')
+    people = User.objects.bulk_create(
+        [User(username=f'bench{i}', email=f'bench{i}@example.com', password=password) for i in range(users)],
+        batch_size=BATCH_SIZE,
+    )
+
+    Cart.objects.bulk_create([
+        Cart(user=user, product=product, quantity=rng.randint(1, 3))
+        for user in people for product in rng.sample(catalog, min(cart_items, len(catalog)))
+    ], batch_size=BATCH_SIZE)
+
+    pairs = set()
+    while len(pairs) < min(feedback, users * products):
+        pairs.add((rng.randrange(users), rng.randrange(products)))
+    Feedback.objects.bulk_create([
+        Feedback(user=people[u], product=catalog[p], rating=rng.choice([3, 4, 4, 5, 5]),
+                 comment="Good quality and fits well, would buy again.")
+        for u, p in pairs
+    ], batch_size=BATCH_SIZE)
+
+    order_rows, line_rows = [], []
+    for _ in range(orders):
+        product = rng.choice(catalog)
+        quantity = rng.randint(1, 3)
+        order_rows.append(Order(
+            user=rng.choice(people), product=product, customer_name='Bench', email='bench@example.com',
+            mobile='9876543210', quantity=quantity, total_amount=product.effective_price * quantity,
+        ))
+    order_rows = Order.objects.bulk_create(order_rows, batch_size=BATCH_SIZE)
+    for order in order_rows:
+        line_rows.append(OrderItem(order=order, product=order.product, quantity=order.quantity,
+                                   unit_price=order.product.effective_price, line_total=order.total_amount))
+    OrderItem.objects.bulk_create(line_rows, batch_size=BATCH_SIZE)
+
+    # bulk_create skips signals, so build the rest of the denormalized data in one go
+    rebuild_ratings()
+    rebuild_search_index()
+    recount_categories()
+    return people
+
+
+def scenarios(rng, product_ids, categories):
+    """name -> function(client) making one request, with targets picked from `rng`"""
+    words = ADJECTIVES + list(NOUNS.values())
+
+    def buy_now(client):
+        return client.post(reverse('buy_now', args=[rng.choice(product_ids)]), {
+            'name': 'Bench', 'mobile': '9876543210', 'email': 'bench@example.com', 'quantity': 1,
+        })
+
+    return {
+        'home': lambda client: client.get(reverse('home')),
+        'product_list': lambda client: client.get(reverse('product_list')),
+        'search': lambda client: client.get(reverse('product_list'), {'q': rng.choice(words)}),
+        'category': lambda client: client.get(reverse('category', args=[rng.choice(categories)])),
+        'product_detail': lambda client: client.get(reverse('product_detail', args=[rng.choice(product_ids)])),
+        'cart_view': lambda client: client.get(reverse('view_cart')),
+        'add_to_cart': lambda client: client.post(reverse('add_to_cart', args=[rng.choice(product_ids)])),
+        'buy_now': buy_now,
+        'orders': lambda client: client.get(reverse('view_orders')),
+    }
+
+
+def targets():
+    """(product ids, category slugs) to aim the scenarios at"""
+    product_ids = list(Product.objects.values_list('id', flat=True))
+    categories = list(Category.objects.filter(product_count__gt=0).values_list('slug', flat=True))
+    return product_ids, categories
+
+
+def run(users, requests=200, warmup=20, cold_cache=False, only=None, rng=None):
+    """Drive every scenario and return {scenario: stats}"""
+    rng = rng or random.Random(1)
+    product_ids, categories = targets()
+    clients = []
+    for user in users[:10]:
+        client = Client()
+        client.force_login(user)
+        clients.append(client)
+
+    results = {}
+    for name, request in scenarios(rng, product_ids, categories).items():
+        if only and name not in only:
+            continue
+        for i in range(warmup):
+            request(clients[i % len(clients)])
+
+        latencies, query_counts, statuses = [], [], {}
+        started = time.perf_counter()
+        for i in range(requests):
+            if cold_cache:
+                cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                t0 = time.perf_counter()
+                response = request(clients[i % len(clients)])
+                latencies.append((time.perf_counter() - t0) * 1000)
+            query_counts.append(len(queries))
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        query_counts.sort()
+        results[name] = {
+            'requests': requests,
+            'throughput_rps': round(requests / elapsed, 1),
+            'latency_ms': {f'p{p}': round(percentile(latencies, p), 2) for p in (50, 95, 99)},
+            'queries': {'p50': percentile(query_counts, 50), 'max': query_counts[-1]},
+            'status_codes': statuses,
+        }
+    return results
+
+
+def compare(baseline, current, threshold=0.10):
+    """Rows of (scenario, metric, old, new, change) where `current` is worse than `baseline` by > threshold"""
+    regressions = []
+    for name, stats in current.items():
+        old = baseline.get(name)
+        if not old:
+            continue
+        checks = [
+            ('latency p95 ms', old['latency_ms']['p95'], stats['latency_ms']['p95'], 1),
+            ('throughput rps', old['throughput_rps'], stats['throughput_rps'], -1),
+            ('queries p50', old['queries']['p50'], stats['queries']['p50'], 1),
+        ]
+        for metric, before, after, direction in checks:
+            if before and direction * (after - before) / before > threshold:
+                regressions.append((name, metric, before, after, round((after - before) / before * 100, 1)))
+    return regressions
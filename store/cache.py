@@ -0,0 +1,334 @@
+"""
+Versioned cache for catalog pages.
+
+Cached values are keyed on version numbers instead of being deleted:
+
+- a per-product version, bumped when that product or one of its reviews changes
+- a listing version, bumped when any product or review changes
+- a nav version, bumped when the category nav changes (only read for ETags,
+  see conditional.py)
+- a price rules version, bumped when a tax rule, promotion or category
+  changes (see pricing.py)
+- a recommendations version and a per-user shopper version, for the home
+  page's picks (only read for ETags)
+
+Bumping a version makes every key built from the old one unreachable, and the
+cache's own LRU eviction (LocMemCache MAX_ENTRIES, Redis maxmemory-policy)
+drops the dead entries. Versions are bumped from signals in signals.py.
+Cached entries also expire after CATALOG_CACHE_TIMEOUT seconds, so a worker
+with its own LocMemCache, which never sees another worker's bumps, serves a
+stale entry for at most that long. Only the version keys never expire.
+
+The backend is whatever CACHES['default'] is configured to in settings.
+"""
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+LISTING_VERSION_KEY = 'catalog:v:listing'
+NAV_VERSION_KEY = 'catalog:v:nav'
+# Bumped when a tax rule, promotion or category changes (see pricing.load_rules)
+PRICE_RULES_VERSION_KEY = 'pricing:v:rules'
+# A backstop for processes whose cache didn't see the bump (a per-process LocMemCache)
+PRICE_RULES_TIMEOUT = 300
+# The same backstop for cached listings, product data, pages and cards
+CATALOG_CACHE_TIMEOUT = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+# Bumped when refresh_recommendations rebuilds any list (see recommendations.py)
+RECOMMENDATIONS_VERSION_KEY = 'catalog:v:recommendations'
+CARD_TEMPLATE = 'store/partials/product_card.html'
+# Cards are cached without the per-user CSRF token; this is swapped in on the way out
+CSRF_PLACEHOLDER = '__CSRF_TOKEN__'
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(kind, hits, misses):
+    with _stats_lock:
+        _stats[f'{kind}_hits'] += hits
+        _stats[f'{kind}_misses'] += misses
+
+
+def stats():
+    """Hit/miss counters for this process, plus a hit ratio per kind of entry"""
+    with _stats_lock:
+        counters = dict(_stats)
+    result = {'counters': counters, 'hit_ratio': {}}
+    for kind in {key.rsplit('_', 1)[0] for key in counters}:
+        hits, misses = counters.get(f'{kind}_hits', 0), counters.get(f'{kind}_misses', 0)
+        result['hit_ratio'][kind] = round(hits / (hits + misses), 4) if hits + misses else None
+    return result
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+# ---------------- VERSIONS ----------------
+def product_version_key(product_id):
+    return f'catalog:v:product:{product_id}'
+
+
+def shopper_version_key(user_id):
+    """Bumped when the user's cart, wishlist or orders change, for pages built from them"""
+    return f'shop:v:user:{user_id}'
+
+
+def _new_version():
+    # Millisecond clock rather than 1, so a version key that was evicted never
+    # restarts at a number that old entries were stored under.
+    return int(time.time() * 1000)
+
+
+def _get_versions(keys):
+    versions = cache.get_many(keys)
+    missing = {key: _new_version() for key in keys if key not in versions}
+    if missing:
+        for key, version in missing.items():
+            cache.add(key, version, timeout=None)
+        versions.update(cache.get_many(list(missing)))
+    return versions
+
+
+async def _aget_versions(keys):
+    versions = await cache.aget_many(keys)
+    missing = {key: _new_version() for key in keys if key not in versions}
+    if missing:
+        for key, version in missing.items():
+            await cache.aadd(key, version, timeout=None)
+        versions.update(await cache.aget_many(list(missing)))
+    return versions
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_version(), timeout=None)
+
+
+def listing_version():
+    return _get_versions([LISTING_VERSION_KEY])[LISTING_VERSION_KEY]
+
+
+def current_versions(*keys):
+    """The current value of each version key, in one cache read"""
+    versions = _get_versions(list(keys))
+    return tuple(versions[key] for key in keys)
+
+
+def invalidate_product(product_id):
+    """Called after a product or its feedback changes"""
+    _bump(product_version_key(product_id))
+    _bump(LISTING_VERSION_KEY)
+
+
+def invalidate_nav_version():
+    _bump(NAV_VERSION_KEY)
+
+
+def invalidate_price_rules():
+    _bump(PRICE_RULES_VERSION_KEY)
+
+
+def invalidate_recommendations():
+    _bump(RECOMMENDATIONS_VERSION_KEY)
+
+
+def invalidate_shopper(user_id):
+    _bump(shopper_version_key(user_id))
+
+
+def invalidate_products(product_ids):
+    """Same as invalidate_product for many products, bumping the listing version once"""
+    for product_id in product_ids:
+        _bump(product_version_key(product_id))
+    _bump(LISTING_VERSION_KEY)
+
+
+# ---------------- LISTINGS ----------------
+def _listing_key(version, parts):
+    digest = hashlib.md5(repr(parts).encode()).hexdigest()
+    return f'catalog:listing:{version}:{digest}'
+
+
+def listing_key(*parts):
+    return _listing_key(listing_version(), parts)
+
+
+async def alisting_key(*parts):
+    version = (await _aget_versions([LISTING_VERSION_KEY]))[LISTING_VERSION_KEY]
+    return _listing_key(version, parts)
+
+
+def get_or_set_listing(parts, compute, timeout=CATALOG_CACHE_TIMEOUT):
+    """Return the cached result for a listing described by `parts`, computing it on a miss"""
+    key = listing_key(*parts)
+    value = cache.get(key)
+    if value is not None:
+        _count('listing', 1, 0)
+        return value
+    _count('listing', 0, 1)
+    value = compute()
+    cache.set(key, value, timeout)
+    return value
+
+
+async def aget_or_set_listing(parts, compute, timeout=CATALOG_CACHE_TIMEOUT):
+    """get_or_set_listing for async views; `compute` is a coroutine function"""
+    key = await alisting_key(*parts)
+    value = await cache.aget(key)
+    if value is not None:
+        _count('listing', 1, 0)
+        return value
+    _count('listing', 0, 1)
+    value = await compute()
+    await cache.aset(key, value, timeout)
+    return value
+
+
+# ---------------- PRODUCT DETAIL ----------------
+def _product_key(product_id, version, parts):
+    key = f'catalog:product:{product_id}:{version}'
+    if parts:
+        key += ':' + hashlib.md5(repr(parts).encode()).hexdigest()
+    return key
+
+
+def get_or_set_product(product_id, compute, timeout=CATALOG_CACHE_TIMEOUT, parts=()):
+    """
+    Cached detail data for one product, valid until the product's version
+    changes. `parts` tells apart several entries for one product (e.g. review pages).
+    """
+    version_key = product_version_key(product_id)
+    key = _product_key(product_id, _get_versions([version_key])[version_key], parts)
+    value = cache.get(key)
+    if value is not None:
+        _count('product', 1, 0)
+        return value
+    _count('product', 0, 1)
+    value = compute()
+    cache.set(key, value, timeout)
+    return value
+
+
+async def aget_or_set_product(product_id, compute, timeout=CATALOG_CACHE_TIMEOUT, parts=()):
+    """get_or_set_product for async views; `compute` is a coroutine function"""
+    version_key = product_version_key(product_id)
+    key = _product_key(product_id, (await _aget_versions([version_key]))[version_key], parts)
+    value = await cache.aget(key)
+    if value is not None:
+        _count('product', 1, 0)
+        return value
+    _count('product', 0, 1)
+    value = await compute()
+    await cache.aset(key, value, timeout)
+    return value
+
+
+# ---------------- PAGES ----------------
+def _page_key(versions, parts):
+    digest = hashlib.md5(repr((versions, parts)).encode()).hexdigest()
+    return f'catalog:page:{digest}'
+
+
+def get_or_set_page(version_keys, parts, compute, timeout=CATALOG_CACHE_TIMEOUT):
+    """
+    A whole rendered page (a shell, see shell.py) described by `parts`,
+    valid until any of `version_keys` is bumped
+    """
+    key = _page_key(current_versions(*version_keys), parts)
+    value = cache.get(key)
+    if value is not None:
+        _count('page', 1, 0)
+        return value
+    _count('page', 0, 1)
+    value = compute()
+    cache.set(key, value, timeout)
+    return value
+
+
+async def aget_or_set_page(version_keys, parts, compute, timeout=CATALOG_CACHE_TIMEOUT):
+    """get_or_set_page for async views; `compute` is a coroutine function"""
+    versions = await _aget_versions(list(version_keys))
+    key = _page_key(tuple(versions[k] for k in version_keys), parts)
+    value = await cache.aget(key)
+    if value is not None:
+        _count('page', 1, 0)
+        return value
+    _count('page', 0, 1)
+    value = await compute()
+    await cache.aset(key, value, timeout)
+    return value
+
+
+# ---------------- PRICE RULES ----------------
+def get_or_set_price_rules(compute):
+    """The price rules computed by `compute`, cached until the rules version changes"""
+    key = f'pricing:rules:{_get_versions([PRICE_RULES_VERSION_KEY])[PRICE_RULES_VERSION_KEY]}'
+    value = cache.get(key)
+    if value is not None:
+        _count('price_rules', 1, 0)
+        return value
+    _count('price_rules', 0, 1)
+    value = compute()
+    cache.set(key, value, PRICE_RULES_TIMEOUT)
+    return value
+
+
+# ---------------- PRODUCT CARDS ----------------
+def render_product_cards(request, products, timeout=CATALOG_CACHE_TIMEOUT, token=True):
+    """
+    Render the product-card HTML for `products`, reusing cached cards.
+    With token=False the cards keep CSRF_PLACEHOLDER for render_shell() to blank out.
+
+    Costs two cache round trips for the whole page (versions, then cards) plus
+    one set_many for whatever had to be rendered.
+    """
+    versions = _get_versions([product_version_key(p.pk) for p in products])
+    card_keys = _card_keys(products, versions)
+    cards, rendered = _fill_cards(products, card_keys, cache.get_many(card_keys))
+    if rendered:
+        cache.set_many(rendered, timeout)
+    return _with_token(request, cards) if token else [mark_safe(html) for html in cards]
+
+
+async def arender_product_cards(request, products, timeout=CATALOG_CACHE_TIMEOUT, token=True):
+    """render_product_cards for async views"""
+    versions = await _aget_versions([product_version_key(p.pk) for p in products])
+    card_keys = _card_keys(products, versions)
+    cards, rendered = _fill_cards(products, card_keys, await cache.aget_many(card_keys))
+    if rendered:
+        await cache.aset_many(rendered, timeout)
+    return _with_token(request, cards) if token else [mark_safe(html) for html in cards]
+
+
+def _card_keys(products, versions):
+    return [f'catalog:card:{p.pk}:{versions[product_version_key(p.pk)]}' for p in products]
+
+
+def _fill_cards(products, card_keys, cached):
+    """The card HTML for each product, rendering the ones missing from `cached`. Returns (cards, rendered)."""
+    _count('card', len(cached), len(card_keys) - len(cached))
+    rendered = {}
+    cards = []
+    for product, key in zip(products, card_keys):
+        html = cached.get(key)
+        if html is None:
+            html = render_to_string(CARD_TEMPLATE, {'product': product, 'csrf_token': CSRF_PLACEHOLDER})
+            rendered[key] = html
+        cards.append(html)
+    return cards, rendered
+
+
+def _with_token(request, cards):
+    token = get_token(request)
+    return [mark_safe(html.replace(CSRF_PLACEHOLDER, token)) for html in cards]
@@ -0,0 +1,325 @@
+"""
+Bulk catalog import and export.
+
+Rows are matched to products on `sku`. Files are read as a stream and written
+in batches of BATCH_SIZE: one query to find which SKUs already exist, one
+bulk_create for the new ones and one bulk_update for the rest, each batch in
+its own transaction. Memory stays bounded by the batch size, so a million-row
+file is fine. Invalid rows are collected (up to MAX_REPORTED_ERRORS) and
+skipped without aborting the import, and so are new SKUs another import
+creates at the same time.
+
+The category column holds category names; missing categories are created.
+bulk_create/bulk_update don't send signals, so prices (pricing.py), category
+counts, the search index and the catalog cache are updated here, once per batch.
+
+Export streams rows from a chunked iterator and never holds the whole table.
+"""
+import csv
+import json
+import os
+from collections import Counter
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+
+from .cache import invalidate_products
+from .categories import categories_by_name, move_counts
+from .images import queue_variants
+from .models import Product
+from .pricing import PRICE_FIELDS, apply_prices, load_rules
+from .search import index_products
+
+BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 2000
+MAX_REPORTED_ERRORS = 1000
+FORMATS = ('csv', 'jsonl')
+
+# Columns in file order; `sku` and `name` are required, and `price` for new SKUs; the rest are optional
+FIELDS = ['sku', 'name', 'description', 'price', 'discount', 'category', 'is_new', 'stock_available', 'image']
+MAX_PRICE = Decimal('99999999.99')  # DecimalField(max_digits=10, decimal_places=2)
+CENTS = Decimal('0.01')
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+
+
+class ImportFormatError(Exception):
+    pass
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    updated: int = 0
+    failed: int = 0
+    errors: list = field(default_factory=list)  # (line number, sku, message)
+
+    def add_error(self, line, sku, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, sku, message))
+
+
+def guess_format(filename):
+    extension = os.path.splitext(filename)[1].lstrip('.').lower()
+    if extension == 'json':
+        extension = 'jsonl'
+    if extension not in FORMATS:
+        raise ImportFormatError(f"Can't tell the format of {filename!r}; use .csv or .jsonl")
+    return extension
+
+
+# ---------------- READING ----------------
+def read_rows(stream, fmt):
+    """Yield (line number, dict) for each row of a text stream"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        missing = {'sku', 'name'} - set(reader.fieldnames or ())
+        if missing:
+            raise ImportFormatError(f"CSV header is missing: {', '.join(sorted(missing))}")
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                row = exc  # reported as a row error by the batch validation
+            yield line_number, row
+    else:
+        raise ImportFormatError(f"Unknown format {fmt!r}")
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _decimal(value, default=None):
+    if value in (None, ''):
+        return default
+    value = Decimal(str(value))
+    if not value.is_finite():
+        raise InvalidOperation(f"{value} is not a finite number")
+    return value.quantize(CENTS)
+
+
+def _stock(value):
+    if value in (None, ''):
+        return None
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+        return value
+    raise ValueError(f"stock_available must be a whole number of 0 or more, not {value!r}")
+
+
+def _clean(row, images_dir):
+    """Turn one raw row into Product field values; raises ValueError with the reason"""
+    if not isinstance(row, dict):
+        raise ValueError(f"not a JSON object ({row})" if isinstance(row, Exception) else "not a JSON object")
+    values = {}
+    sku = str(row.get('sku') or '').strip()
+    name = str(row.get('name') or '').strip()
+    if not sku or len(sku) > 64:
+        raise ValueError("sku is required (max 64 characters)")
+    if not name or len(name) > 100:
+        raise ValueError("name is required (max 100 characters)")
+    values['sku'], values['name'] = sku, name
+
+    if 'description' in row:
+        values['description'] = str(row['description'] or '')
+    if 'category' in row:
+        values['category'] = str(row['category'] or '').strip() or None
+    if 'is_new' in row:
+        flag = row['is_new']
+        values['is_new'] = flag if isinstance(flag, bool) else str(flag or '').strip().lower() in TRUE_VALUES
+    if 'stock_available' in row:
+        values['stock_available'] = _stock(row['stock_available'])
+    if row.get('image'):
+        values['image'] = _ingest_image(str(row['image']), images_dir)
+
+    # Prices: the price is only required for new SKUs (see _import_batch), which
+    # also checks the discount against the stored price when the row leaves it out
+    try:
+        price = _decimal(row.get('price'))
+        discount = _decimal(row.get('discount'), Decimal('0.00'))
+    except InvalidOperation:
+        raise ValueError("price and discount must be numbers")
+    if price is not None:
+        if not Decimal('0') <= price <= MAX_PRICE:
+            raise ValueError(f"price {price} is out of range")
+        values['price'] = price
+    if discount < 0 or (price is not None and discount > price):
+        raise ValueError(f"discount {discount} must be between 0 and the price")
+    if 'discount' in row:
+        values['discount'] = discount
+    return values
+
+
+def _ingest_image(name, images_dir):
+    """
+    Storage name for an image column. With `images_dir`, the file is copied
+    from there into MEDIA storage under products/ (once); otherwise the value
+    is taken to already be a storage name like products/shoe.jpg.
+    """
+    if not images_dir:
+        return name
+    source = os.path.join(images_dir, name)
+    if not os.path.isfile(source):
+        raise ValueError(f"image {name!r} not found in {images_dir}")
+    target = f'products/{os.path.basename(name)}'
+    if not default_storage.exists(target):
+        with open(source, 'rb') as f:
+            target = default_storage.save(target, File(f))
+    return target
+
+
+# ---------------- IMPORT ----------------
+def _create(products, result, lines):
+    """
+    bulk_create `products`. If another import created one of the SKUs since
+    they were looked up, retry row by row and report the rows that clash.
+    Returns the products created.
+    """
+    try:
+        with transaction.atomic():
+            Product.objects.bulk_create(products)
+        return products
+    except IntegrityError:
+        pass
+    created = []
+    for product in products:
+        try:
+            with transaction.atomic():
+                Product.objects.bulk_create([product])
+        except IntegrityError:
+            result.add_error(lines[product.sku], product.sku,
+                             "sku was created by another import meanwhile; import the row again to update it")
+            continue
+        created.append(product)
+    return created
+
+
+def _import_batch(batch, result, images_dir, rules):
+    cleaned, lines = {}, {}
+    for line_number, row in batch:
+        try:
+            values = _clean(row, images_dir)
+        except (ValueError, TypeError) as exc:
+            sku = row.get('sku') if isinstance(row, dict) else None
+            result.add_error(line_number, sku, str(exc))
+            continue
+        # A SKU repeated inside one batch: the last row wins
+        cleaned[values['sku']] = values
+        lines[values['sku']] = line_number
+    if not cleaned:
+        return
+
+    with transaction.atomic():
+        categories = categories_by_name({v['category'] for v in cleaned.values() if v.get('category')})
+        for values in cleaned.values():
+            if 'category' in values:
+                values['category'] = categories.get(values['category'])
+
+        existing = dict(Product.objects.filter(sku__in=cleaned).values_list('sku', 'pk'))
+        new, changed, update_fields = [], [], set()
+        counts = Counter()
+        for sku, values in cleaned.items():
+            if sku in existing:
+                update_fields.update(values)
+                changed.append(Product(pk=existing[sku], **values))
+            elif 'price' not in values:
+                result.add_error(lines[sku], sku, "price is required for a new sku")
+            else:
+                new.append(Product(**values))
+        if changed:
+            # Rows that leave a column out keep whatever is stored; only update columns the batch provided.
+            # The price engine also needs the stored price, discount and category.
+            update_fields.discard('sku')
+            current = Product.objects.in_bulk([p.pk for p in changed])
+            valid = []
+            for product in changed:
+                for name in update_fields | {'price', 'discount', 'category'}:
+                    if name not in cleaned[product.sku]:
+                        attname = Product._meta.get_field(name).attname
+                        setattr(product, attname, getattr(current[product.pk], attname))
+                if product.discount > product.price:
+                    result.add_error(lines[product.sku], product.sku,
+                                     f"discount {product.discount} must be between 0 and the price")
+                    continue
+                valid.append(product)
+                if product.category_id != current[product.pk].category_id:
+                    counts[current[product.pk].category_id] -= 1
+                    counts[product.category_id] += 1
+            changed = valid
+
+        apply_prices(new + changed, rules)
+        if new:
+            new = _create(new, result, lines)
+        for product in new:
+            counts[product.category_id] += 1
+        if changed:
+            Product.objects.bulk_update(changed, sorted(update_fields | set(PRICE_FIELDS)))
+
+        # The saved rows, not the instances above: an updated row only carries
+        # the columns its batch provided, and new rows may have no pk (backends
+        # without RETURNING for bulk inserts)
+        products = list(Product.objects.filter(sku__in=[p.sku for p in new + changed]))
+        index_products(products)
+        queue_variants(products)
+        move_counts(counts)
+        transaction.on_commit(lambda: invalidate_products([p.pk for p in changed]))
+
+    result.created += len(new)
+    result.updated += len(changed)
+
+
+def import_products(stream, fmt, batch_size=BATCH_SIZE, images_dir=None):
+    """Upsert products from a CSV/JSONL text stream. Returns an ImportResult."""
+    result = ImportResult()
+    rules = load_rules()
+    for batch in _batches(read_rows(stream, fmt), batch_size):
+        _import_batch(batch, result, images_dir, rules)
+    return result
+
+
+# ---------------- EXPORT ----------------
+class _Echo:
+    """File-like object whose write() hands the line back, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def _export_values(queryset):
+    columns = ['category__name' if name == 'category' else name for name in FIELDS]
+    return queryset.order_by('pk').values_list(*columns).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def export_rows(fmt, queryset=None):
+    """Yield the catalog as CSV or JSONL lines, reading it in chunks"""
+    if fmt not in FORMATS:
+        raise ImportFormatError(f"Unknown format {fmt!r}")
+    queryset = Product.objects.all() if queryset is None else queryset
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(FIELDS)
+        for row in _export_values(queryset):
+            yield writer.writerow(['' if value is None else value for value in row])
+    else:
+        for row in _export_values(queryset):
+            record = dict(zip(FIELDS, row))
+            for key in ('price', 'discount'):
+                record[key] = str(record[key])
+            yield json.dumps(record) + '\n'
@@ -0,0 +1,108 @@
+"""
+Category navigation and per-category product counts.
+
+The nav (every category with its slug, icon and product count) is built with
+one query and cached under NAV_CACHE_KEY until a category changes or a
+product moves in or out of one, so rendering menus and resolving
+/category/<slug>/ never touch the product table. The entry also expires after
+CATALOG_CACHE_TIMEOUT seconds, as other workers' caches never see the
+invalidation.
+
+Category.product_count is adjusted with F() updates from Product signals and
+bulk imports; `recount_categories()` rebuilds it from scratch.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+from .cache import CATALOG_CACHE_TIMEOUT, invalidate_nav_version
+from .models import Category, Product, slugify_category
+
+NAV_CACHE_KEY = 'catalog:category_nav'
+
+
+NAV_FIELDS = ('id', 'name', 'slug', 'icon', 'product_count')
+
+
+def category_nav():
+    """List of dicts (id, name, slug, icon, product_count) for every category, by name"""
+    nav = cache.get(NAV_CACHE_KEY)
+    if nav is None:
+        nav = list(Category.objects.values(*NAV_FIELDS))
+        cache.set(NAV_CACHE_KEY, nav, CATALOG_CACHE_TIMEOUT)
+    return nav
+
+
+async def acategory_nav():
+    nav = await cache.aget(NAV_CACHE_KEY)
+    if nav is None:
+        nav = [category async for category in Category.objects.values(*NAV_FIELDS)]
+        await cache.aset(NAV_CACHE_KEY, nav, CATALOG_CACHE_TIMEOUT)
+    return nav
+
+
+def _match(nav, value):
+    value = (value or '').strip()
+    slug = slugify_category(value)
+    # Names with nothing to slugify only match by name (their slug is category-<id>)
+    return next((category for category in nav if (slug and category['slug'] == slug)
+                 or (value and category['name'].lower() == value.lower())), None)
+
+
+def find_category(value):
+    """The nav entry for a slug or a category name (any case), or None"""
+    return _match(category_nav(), value)
+
+
+async def afind_category(value):
+    return _match(await acategory_nav(), value)
+
+
+def invalidate_nav():
+    def drop():
+        cache.delete(NAV_CACHE_KEY)
+        invalidate_nav_version()
+    transaction.on_commit(drop)
+
+
+def move_counts(deltas):
+    """Apply {category_id: +/-n} to Category.product_count in one UPDATE"""
+    deltas = {pk: n for pk, n in deltas.items() if pk is not None and n}
+    if not deltas:
+        return
+    Category.objects.filter(pk__in=deltas).update(product_count=Case(
+        *[When(pk=pk, then=F('product_count') + n) for pk, n in deltas.items()],
+        output_field=IntegerField(),
+    ))
+    invalidate_nav()
+
+
+def recount_categories():
+    """Recompute every Category.product_count with one UPDATE"""
+    counts = Product.objects.filter(category=OuterRef('pk')).order_by().values('category').annotate(
+        n=Count('pk')).values('n')
+    updated = Category.objects.update(product_count=Coalesce(Subquery(counts), Value(0)))
+    invalidate_nav()
+    return updated
+
+
+def categories_by_name(names):
+    """
+    {name as given: Category} for category names from an import, creating the
+    missing ones. Names that slugify alike ("T-Shirts", "t shirts") share a
+    category; names with nothing to slugify are matched by name.
+    """
+    keys = {name: slugify_category(name) or name for name in names if name}
+    found = list(Category.objects.filter(Q(slug__in=set(keys.values())) | Q(name__in=set(keys.values()))))
+    existing = {category.slug: category for category in found}
+    for category in found:
+        existing.setdefault(category.name, category)
+    created = False
+    for name, key in keys.items():
+        if key not in existing:
+            existing[key] = Category.objects.create(name=name)
+            created = True
+    if created:
+        invalidate_nav()
+    return {name: existing[key] for name, key in keys.items()}
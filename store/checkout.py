@@ -0,0 +1,99 @@
+"""
+Order placement.
+
+A cart checkout reads the whole cart in one select_related query, prices every
+line in one pass and writes the stock decrement, the order header, all of its
+lines and the cart cleanup inside a single transaction, so the number of
+round trips doesn't grow with the size of the cart.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+
+from .inventory import commit_stock
+from .models import Cart, Order, OrderItem
+
+
+class EmptyCartError(Exception):
+    pass
+
+
+def unit_price(product):
+    """Per-unit price charged at checkout: the stored effective price (see pricing.py)"""
+    return product.effective_price
+
+
+def price_cart(cart_items):
+    """Build unsaved OrderItem lines for cart rows (with products loaded) and return (lines, total)"""
+    lines = []
+    total = Decimal('0.00')
+    for item in cart_items:
+        price = unit_price(item.product)
+        line = OrderItem(product=item.product, quantity=item.quantity, unit_price=price,
+                         line_total=price * item.quantity)
+        lines.append(line)
+        total += line.line_total
+    return lines, total
+
+
+def _cart_rows(user):
+    return Cart.objects.filter(user=user).select_related('product').order_by('added_at')
+
+
+def cart_lines(user, for_update=False):
+    """The user's cart with products, in one query"""
+    cart = _cart_rows(user)
+    if for_update:
+        # Lock the cart rows (not the products) so their stock holds can't be released mid-checkout
+        cart = cart.select_for_update(of=('self',))
+    return list(cart)
+
+
+def place_cart_order(user, customer_name, email, mobile, address=None):
+    """
+    Turn the user's whole cart into one Order with an OrderItem per cart row.
+    Raises EmptyCartError, or OutOfStockError if any product has run out.
+    """
+    with transaction.atomic():
+        cart_items = cart_lines(user, for_update=True)
+        if not cart_items:
+            raise EmptyCartError()
+        lines, total = price_cart(cart_items)
+        commit_stock([(item.product, item.quantity, item.reserved_quantity) for item in cart_items])
+
+        order = Order.objects.create(
+            user=user,
+            customer_name=customer_name,
+            email=email,
+            mobile=mobile,
+            address=address or None,
+            quantity=sum(line.quantity for line in lines),
+            total_amount=total,
+            order_status=Order.PENDING,
+        )
+        for line in lines:
+            line.order = order
+        OrderItem.objects.bulk_create(lines)
+        Cart.objects.filter(pk__in=[item.pk for item in cart_items]).delete()
+    return order
+
+
+def place_single_order(user, product, quantity, customer_name, email, mobile, address=None):
+    """Buy Now: an Order for one product, with its single OrderItem line. Raises OutOfStockError."""
+    price = unit_price(product)
+    with transaction.atomic():
+        commit_stock([(product, quantity, 0)])
+        order = Order.objects.create(
+            user=user,
+            product=product,
+            customer_name=customer_name,
+            email=email,
+            mobile=mobile,
+            address=address or None,
+            quantity=quantity,
+            total_amount=price * quantity,
+            order_status=Order.PENDING,
+        )
+        OrderItem.objects.create(order=order, product=product, quantity=quantity,
+                                 unit_price=price, line_total=price * quantity)
+    return order
@@ -0,0 +1,153 @@
+"""
+Conditional GETs and Cache-Control for the catalog pages.
+
+Catalog data already carries version numbers in cache.py (one per product,
+one for all listings, one for the category nav) that change on every write,
+so a page's ETag is built from them with a single cache read: no query, no
+render. A request whose If-None-Match still matches gets a 304 before the
+view runs.
+
+There are two policies:
+
+- PUBLIC, for responses built from catalog data alone: the catalog shells
+  (see shell.py) and the review stream. A short max-age for browsers and a
+  longer s-maxage for the CDN (Vercel's edge honours it). These views must
+  not touch the session or request.user, or SessionMiddleware adds
+  `Vary: Cookie` and the CDN can't share them.
+- PRIVATE, for pages that also show who is asking (header counts, username,
+  flash messages, CSRF tokens in forms). Their validator is wrapped in
+  with_viewer() so the viewer is part of the ETag; browsers keep the page but
+  revalidate it every time, and `Vary: Cookie` keeps shared caches from
+  handing it to someone else. A page with flash messages waiting gets no
+  ETag, since they're only shown once.
+
+ETags are weak: the markup carries relative times ("3 minutes ago") and
+freshly masked CSRF tokens that may differ between two equivalent renders.
+There is no Last-Modified; versions aren't timestamps, and If-None-Match
+takes precedence wherever both are sent.
+"""
+import hashlib
+from dataclasses import dataclass, field
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib import messages
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+
+from .cache import (LISTING_VERSION_KEY, NAV_VERSION_KEY, RECOMMENDATIONS_VERSION_KEY, current_versions,
+                    product_version_key, shopper_version_key)
+from .counters import get_counts
+
+PUBLIC_MAX_AGE = 60
+PUBLIC_S_MAXAGE = 300
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    cache_control: dict
+    vary: tuple = field(default=())
+
+
+PRIVATE = CachePolicy({'private': True, 'no_cache': True}, vary=('Cookie',))
+PUBLIC = CachePolicy({'public': True, 'max_age': PUBLIC_MAX_AGE, 's_maxage': PUBLIC_S_MAXAGE,
+                      'stale_while_revalidate': PUBLIC_MAX_AGE})
+
+
+def _etag(*parts):
+    return 'W/"%s"' % hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def _viewer(request):
+    """What a page shows that depends on who is asking, or None if it can't be revalidated"""
+    if len(messages.get_messages(request)):
+        return None
+    counts = get_counts(request)
+    # The page's forms create the CSRF cookie if there is none; do it now so it's part of this ETag
+    get_token(request)
+    return request.user.pk, counts['cart'], counts['wishlist'], request.META['CSRF_COOKIE']
+
+
+# ---------------- VALIDATORS ----------------
+# Everything a listing page shows changes with one of these
+LISTING_VERSIONS = (LISTING_VERSION_KEY, NAV_VERSION_KEY)
+
+
+def product_versions(product_id):
+    """What a product page shows: the product and its reviews, and the nav"""
+    return product_version_key(product_id), NAV_VERSION_KEY
+
+
+def listing_etag(request, *args, **kwargs):
+    return _etag('listing', current_versions(*LISTING_VERSIONS))
+
+
+def home_etag(request):
+    """The listings, plus what the home page's picks come from: the recommendations and the user's shopping"""
+    keys = [*LISTING_VERSIONS, RECOMMENDATIONS_VERSION_KEY]
+    if request.user.is_authenticated:
+        keys.append(shopper_version_key(request.user.pk))
+    return _etag('home', current_versions(*keys))
+
+
+def product_etag(request, product_id):
+    return _etag('product', current_versions(*product_versions(product_id)))
+
+
+def reviews_etag(request, product_id):
+    return _etag('reviews', current_versions(product_version_key(product_id)))
+
+
+def with_viewer(etag_func):
+    """`etag_func` for a PRIVATE page, which also shows who is asking"""
+    def viewer_etag(request, *args, **kwargs):
+        viewer = _viewer(request)
+        if viewer is None:
+            return None
+        return _etag(etag_func(request, *args, **kwargs), viewer)
+    return viewer_etag
+
+
+# ---------------- DECORATOR ----------------
+def _finish(request, response, etag, policy):
+    if response.status_code in (200, 304):
+        if etag:
+            response.headers.setdefault('ETag', etag)
+        patch_cache_control(response, **policy.cache_control)
+    if policy.vary:
+        patch_vary_headers(response, policy.vary)
+    return response
+
+
+def conditional(etag_func, policy):
+    """
+    Answer a GET or HEAD with 304 Not Modified when If-None-Match matches
+    `etag_func(request, *args, **kwargs)`, without calling the view, and
+    apply `policy`'s headers. Other methods go straight to the view.
+
+    Works on sync and async views. `etag_func` is sync (the session is), so
+    for async views it runs in a thread.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def inner(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return await view(request, *args, **kwargs)
+                etag = await sync_to_async(etag_func)(request, *args, **kwargs)
+                response = get_conditional_response(request, etag=etag) if etag else None
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return _finish(request, response, etag, policy)
+        else:
+            @wraps(view)
+            def inner(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return view(request, *args, **kwargs)
+                etag = etag_func(request, *args, **kwargs)
+                response = get_conditional_response(request, etag=etag) if etag else None
+                if response is None:
+                    response = view(request, *args, **kwargs)
+                return _finish(request, response, etag, policy)
+        return inner
+    return decorator
@@ -0,0 +1,54 @@
+"""
+Cart and wishlist badge counts for the site header.
+
+The counts live in the user's session so rendering the header doesn't cost two
+COUNT queries per page. They are computed on first use, adjusted in place by
+the add/remove views, and recomputed after COUNTS_TTL seconds so changes made
+elsewhere (another device, the admin) eventually show up. A guest's cart
+count comes from the guest cart cookie (see guest_cart.py).
+"""
+import time
+
+from . import guest_cart
+from .models import Cart, Wishlist
+
+SESSION_KEY = 'header_counts'
+COUNTS_TTL = 600
+
+
+def _fresh(request):
+    counts = request.session.get(SESSION_KEY)
+    if counts and time.time() - counts['at'] < COUNTS_TTL:
+        return counts
+    return None
+
+
+def get_counts(request):
+    """{'cart': n, 'wishlist': n} for the logged-in user, from the session when possible"""
+    if not request.user.is_authenticated:
+        # Guests have no session, just the cart cookie
+        return {'cart': len(guest_cart.read(request)), 'wishlist': 0}
+    counts = _fresh(request)
+    if counts is None:
+        counts = {
+            'cart': Cart.objects.filter(user=request.user).count(),
+            'wishlist': Wishlist.objects.filter(user=request.user).count(),
+            'at': time.time(),
+        }
+        request.session[SESSION_KEY] = counts
+    return counts
+
+
+def adjust_counts(request, cart=0, wishlist=0):
+    """Apply a known change to the cached counts; a no-op if they haven't been computed yet"""
+    counts = _fresh(request)
+    if counts is None:
+        return
+    counts['cart'] = max(counts['cart'] + cart, 0)
+    counts['wishlist'] = max(counts['wishlist'] + wishlist, 0)
+    request.session.modified = True
+
+
+def reset_counts(request):
+    """Forget the cached counts, e.g. after a bulk change to the cart"""
+    request.session.pop(SESSION_KEY, None)
@@ -0,0 +1,85 @@
+"""
+Query-plan checks for the hot views, used by `manage.py check_query_plans`.
+
+Every SELECT a view runs is captured with its parameters and fed back through
+EXPLAIN. A plan step that reads a whole table (SQLite `SCAN table` without an
+index, PostgreSQL `Seq Scan`) is reported, except on the small tables in
+SMALL_TABLES.
+
+SQLite also says `SCAN table` when it walks a table in rowid order to satisfy
+`ORDER BY id ... LIMIT n`; such a scan stops after n rows, so it is accepted
+when the query has a LIMIT, the plan needs no temporary B-tree to sort and no
+WHERE clause filters that table. A filtered walk may read every row before it
+finds n matches, which is the missing index the check is there to catch.
+"""
+import re
+from dataclasses import dataclass, field
+
+from django.db import connection
+
+# Lookup/config tables that stay small no matter how big the catalog gets
+SMALL_TABLES = {'django_content_type', 'django_migrations', 'store_taxrule', 'store_promotion'}
+
+_SQLITE_SCAN_RE = re.compile(r'^SCAN (\w+)(?!\w)(?! VIRTUAL TABLE)(?!.*USING (?:COVERING )?INDEX)')
+_POSTGRES_SCAN_RE = re.compile(r'Seq Scan on (\w+)')
+# A WHERE clause up to the ORDER BY/LIMIT that ends it (or the end of the query)
+_WHERE_RE = re.compile(r'\bWHERE\b(.*?)(?=\bORDER BY\b|\bLIMIT\b|$)', re.IGNORECASE | re.DOTALL)
+
+
+@dataclass
+class CapturedQuery:
+    sql: str
+    params: tuple
+    plan: list = field(default_factory=list)
+    full_scans: list = field(default_factory=list)
+
+
+class _Recorder:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith('SELECT'):
+            self.queries.append(CapturedQuery(sql, tuple(params or ())))
+        return execute(sql, params, many, context)
+
+
+def capture_selects(func):
+    """Call func() and return the SELECT statements it ran"""
+    recorder = _Recorder()
+    with connection.execute_wrapper(recorder):
+        func()
+    return recorder.queries
+
+
+def explain(query):
+    """Fill in query.plan (one string per plan step) and query.full_scans"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {query.sql}', query.params)
+            query.plan = [row[-1] for row in cursor.fetchall()]
+            sorted_in_memory = any('USE TEMP B-TREE' in step for step in query.plan)
+            limited = re.search(r'\bLIMIT\b', query.sql, re.IGNORECASE) is not None
+            filters = ' '.join(match.group(1) for match in _WHERE_RE.finditer(query.sql))
+            for step in query.plan:
+                match = _SQLITE_SCAN_RE.match(step)
+                if not match:
+                    continue
+                table = match.group(1)
+                filtered = f'"{table}".' in filters
+                if not (limited and not sorted_in_memory and not filtered):
+                    query.full_scans.append(table)
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN {query.sql}', query.params)
+            query.plan = [row[0] for row in cursor.fetchall()]
+            query.full_scans = [m.group(1) for step in query.plan for m in _POSTGRES_SCAN_RE.finditer(step)]
+        else:
+            raise NotImplementedError(f"No plan check for {connection.vendor}")
+    query.full_scans = [table for table in query.full_scans if table not in SMALL_TABLES]
+    return query
+
+
+def analyze():
+    """Refresh the planner statistics after seeding"""
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
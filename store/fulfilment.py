@@ -0,0 +1,159 @@
+"""
+Order status changes: which are allowed, applying them in bulk, and the log.
+
+    Pending -> Processing -> Shipped -> Delivered
+       |           |
+       +-----------+------> Cancelled
+
+transition(order_ids, status) moves every listed order that is allowed to go
+to `status`, a batch at a time. Each batch costs a fixed number of queries:
+
+- one SELECT of the candidates, locking them where the database can
+- one UPDATE ... WHERE order_status IN (allowed sources), so an order that
+  changed in the meantime is skipped instead of forced
+- one bulk_create of OrderEvents, the append-only audit log
+- one UPDATE of OrderStatusCount, plus one for each customer's lifetime spend
+  on cancellation
+- one INSERT of the ON_ORDER_STATUS follow-up tasks (tasks.py)
+
+A status saved on a single order (order.save()) does the same bookkeeping
+through the Order signals, but isn't checked against TRANSITIONS. The admin
+only changes statuses through transition().
+"""
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, IntegerField, When
+from django.utils import timezone
+
+from .models import ArchivedOrder, Order, OrderEvent, OrderStatusCount
+from .orders import adjust_spend
+from .taskqueue import enqueue_many
+from .tasks import ON_ORDER_STATUS
+
+TRANSITIONS = {
+    Order.PENDING: {Order.PROCESSING, Order.CANCELLED},
+    Order.PROCESSING: {Order.SHIPPED, Order.CANCELLED},
+    Order.SHIPPED: {Order.DELIVERED},
+    Order.DELIVERED: set(),
+    Order.CANCELLED: set(),
+}
+BATCH_SIZE = 1000
+
+
+class InvalidTransition(Exception):
+    pass
+
+
+@dataclass
+class TransitionResult:
+    moved: int = 0
+    skipped: list = field(default_factory=list)  # ids not found or not allowed to move
+
+
+def sources(status):
+    """The statuses an order may move to `status` from"""
+    if status not in TRANSITIONS:
+        raise InvalidTransition(f"Unknown order status {status!r}")
+    return [source for source, targets in TRANSITIONS.items() if status in targets]
+
+
+def can_transition(from_status, to_status):
+    return to_status in TRANSITIONS.get(from_status, ())
+
+
+# ---------------- COUNTS ----------------
+def move_status_counts(deltas):
+    """Apply {status: +/-n} to OrderStatusCount in one UPDATE"""
+    deltas = {status: n for status, n in deltas.items() if n}
+    if not deltas:
+        return
+    updated = OrderStatusCount.objects.filter(status__in=deltas).update(count=Case(
+        *[When(status=status, then=F('count') + n) for status, n in deltas.items()],
+        output_field=IntegerField(),
+    ))
+    if updated < len(deltas):
+        # A status without a row (the table was emptied): count everything again
+        recount_statuses()
+
+
+def status_counts():
+    """{status: number of orders}, archived ones included, for every status"""
+    counts = dict(OrderStatusCount.objects.values_list('status', 'count'))
+    return {status: counts.get(status, 0) for status in TRANSITIONS}
+
+
+def recount_statuses():
+    """Recompute OrderStatusCount from Order and ArchivedOrder"""
+    counts = Counter()
+    for model in (Order, ArchivedOrder):
+        for row in model.objects.order_by().values('order_status').annotate(n=Count('pk')):
+            counts[row['order_status']] += row['n']
+    with transaction.atomic():
+        OrderStatusCount.objects.all().delete()
+        OrderStatusCount.objects.bulk_create(
+            [OrderStatusCount(status=status, count=counts[status]) for status in {*TRANSITIONS, *counts}])
+    return dict(counts)
+
+
+# ---------------- TRANSITIONS ----------------
+def log_changes(changes, to_status, actor=None, note=''):
+    """
+    Record orders that moved to `to_status`: their OrderEvents, the status
+    counts and, for cancellations, lifetime spend. `changes` holds
+    (order_id, user_id, from_status, total_amount) tuples.
+    """
+    if not changes:
+        return
+    OrderEvent.objects.bulk_create([
+        OrderEvent(order_id=order_id, from_status=from_status, to_status=to_status, actor=actor, note=note)
+        for order_id, _, from_status, _ in changes
+    ])
+    deltas = Counter({to_status: len(changes)})
+    deltas.subtract(from_status for _, _, from_status, _ in changes)
+    move_status_counts(deltas)
+
+    spend = defaultdict(int)
+    for _, user_id, from_status, total in changes:
+        if to_status == Order.CANCELLED and from_status != Order.CANCELLED:
+            spend[user_id] -= total
+        elif from_status == Order.CANCELLED and to_status != Order.CANCELLED:
+            spend[user_id] += total
+    for user_id, amount in spend.items():
+        adjust_spend(user_id, amount)
+
+
+def _transition_batch(order_ids, to_status, allowed, actor, note):
+    with transaction.atomic():
+        candidates = Order.objects.filter(pk__in=order_ids, order_status__in=allowed)
+        if connection.features.has_select_for_update:
+            candidates = candidates.select_for_update()
+        changes = list(candidates.values_list('pk', 'user_id', 'order_status', 'total_amount'))
+        if not changes:
+            return []
+        moved_ids = [order_id for order_id, *_ in changes]
+        Order.objects.filter(pk__in=moved_ids, order_status__in=allowed).update(
+            order_status=to_status, updated_at=timezone.now())
+        log_changes(changes, to_status, actor, note)
+        for name in ON_ORDER_STATUS:
+            enqueue_many(name, {f'{name}:{order_id}:{to_status}': {'order_id': order_id, 'status': to_status}
+                                for order_id in moved_ids})
+    return moved_ids
+
+
+def transition(order_ids, to_status, actor=None, note='', batch_size=BATCH_SIZE):
+    """
+    Move the orders in `order_ids` to `to_status`, skipping those that aren't
+    allowed to (see TRANSITIONS). Each batch is its own transaction. Raises
+    InvalidTransition for an unknown status.
+    """
+    allowed = sources(to_status)
+    order_ids = list(dict.fromkeys(order_ids))
+    result = TransitionResult()
+    for start in range(0, len(order_ids), batch_size):
+        batch = order_ids[start:start + batch_size]
+        moved = set(_transition_batch(batch, to_status, allowed, actor, note))
+        result.moved += len(moved)
+        result.skipped += [order_id for order_id in batch if order_id not in moved]
+    return result
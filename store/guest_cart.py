@@ -0,0 +1,95 @@
+"""
+Cart for shoppers who aren't logged in, kept in a signed cookie.
+
+Browsing and filling the cart as a guest costs no database writes: there are
+no Cart rows and no session, just a {product_id: quantity} cookie signed so it
+can't be tampered with. Guest lines hold no stock (see inventory.py); that
+starts once the cart is merged into the Cart table on login, with one bulk
+upsert capped at MAX_QUANTITY per product and at the stock left.
+"""
+import json
+
+from django.conf import settings
+from django.core.signing import BadSignature
+from django.db import transaction
+
+from .cache import invalidate_shopper
+from .inventory import reserve_up_to
+from .models import Cart, Product
+
+COOKIE_NAME = 'guest_cart'
+COOKIE_SALT = 'store.guest_cart'
+COOKIE_MAX_AGE = 60 * 60 * 24 * 30
+# Keeps the cookie well under the browsers' 4 KB limit
+MAX_LINES = 50
+MAX_QUANTITY = 10
+
+
+def read(request):
+    """The guest cart as {product_id: quantity}; empty if there is none or it was tampered with"""
+    try:
+        raw = request.get_signed_cookie(COOKIE_NAME, default=None, salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE)
+    except BadSignature:
+        return {}
+    try:
+        data = json.loads(raw) if raw else {}
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    cart = {}
+    for product_id, quantity in data.items():
+        if product_id.isdigit() and isinstance(quantity, int) and quantity > 0:
+            cart[int(product_id)] = min(quantity, MAX_QUANTITY)
+    return cart
+
+
+def write(response, cart):
+    """Store `cart` on the response, or drop the cookie if it's empty"""
+    if not cart:
+        response.delete_cookie(COOKIE_NAME)
+        return
+    response.set_signed_cookie(
+        COOKIE_NAME, json.dumps(cart, separators=(',', ':')), salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE,
+        secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Lax',
+    )
+
+
+def _lines(cart, products):
+    # Unsaved Cart rows, so cart.html and cart_totals() treat them like a logged-in cart
+    return [Cart(product=products[product_id], quantity=quantity)
+            for product_id, quantity in cart.items() if product_id in products]
+
+
+def cart_lines(cart):
+    """The guest cart as unsaved Cart rows with their products, in one query"""
+    return _lines(cart, Product.objects.in_bulk(list(cart)))
+
+
+async def acart_lines(cart):
+    """cart_lines() with the async ORM"""
+    return _lines(cart, {product.pk: product async for product in Product.objects.filter(pk__in=list(cart))})
+
+
+def merge_into_cart(user, cart):
+    """
+    Add the guest cart to `user`'s Cart rows and reserve stock for them:
+    quantities of products already in the cart are added up, capped at
+    MAX_QUANTITY and at what is in stock, and everything is written in one
+    INSERT ... ON CONFLICT. Returns the number of rows written.
+    """
+    if not cart:
+        return 0
+    with transaction.atomic():
+        existing = {product_id: (quantity, held) for product_id, quantity, held in
+                    Cart.objects.select_for_update().filter(user=user, product_id__in=list(cart))
+                    .values_list('product_id', 'quantity', 'reserved_quantity')}
+        # Products deleted since they were added, and sold out ones, are skipped
+        rows = reserve_up_to([
+            Cart(user=user, product_id=product_id, reserved_quantity=existing.get(product_id, (0, 0))[1],
+                 quantity=min(existing.get(product_id, (0, 0))[0] + quantity, MAX_QUANTITY))
+            for product_id, quantity in cart.items()
+        ])
+    # bulk_create sends no post_save, see signals.shopping_changed
+    transaction.on_commit(lambda: invalidate_shopper(user.pk))
+    return len(rows)
@@ -0,0 +1,156 @@
+"""
+Responsive variants of Product.image.
+
+For every uploaded image we write resized copies at WIDTHS in AVIF and WebP
+(when this Pillow build supports them) plus a JPEG/PNG fallback, under
+products/variants/ in MEDIA storage. File names carry a hash of the source
+bytes, so they can be served with far-future cache headers: a new upload gets
+new names instead of overwriting files browsers already cached. Products with
+the same source share the files, which are only deleted once none uses them.
+
+What was generated is recorded in Product.image_variants, so rendering a
+srcset (the `product_image` template tag) needs no storage calls:
+
+    {"source": "products/shoe.jpg", "hash": "1a2b3c4d5e", "width": 1200, "height": 900,
+     "formats": {"avif": [[160, "products/variants/shoe-1a2b3c4d5e-160.avif"], ...],
+                 "webp": [...], "jpeg": [...]}}
+
+Variants are generated off the request by the generate_image_variants task,
+queued when a product gets a new image (see signals.py and catalog_io.py), and
+in bulk by `manage.py generate_image_variants`.
+"""
+import hashlib
+import io
+import logging
+import os
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+from .cache import invalidate_product
+from .models import Product
+from .taskqueue import enqueue_many
+
+logger = logging.getLogger('store.images')
+
+WIDTHS = (160, 320, 480, 800, 1200)
+VARIANT_DIR = 'products/variants'
+QUALITY = {'avif': 55, 'webp': 78, 'jpeg': 82}
+# Modern formats first: the <picture> element uses the first <source> the browser supports
+MODERN_FORMATS = [fmt for fmt, feature in (('avif', 'avif'), ('webp', 'webp')) if features.check(feature)]
+MIME_TYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'jpeg': 'image/jpeg', 'png': 'image/png'}
+
+
+def needs_variants(product):
+    return bool(product.image) and product.image_variants.get('source') != product.image.name
+
+
+def _target_widths(source_width):
+    widths = [w for w in WIDTHS if w <= source_width]
+    # Never upscale; a source narrower than the largest slot covers it at its own size
+    if source_width < WIDTHS[-1] and source_width not in widths:
+        widths.append(source_width)
+    return widths
+
+
+def _encode(image, fmt):
+    buffer = io.BytesIO()
+    options = {'quality': QUALITY[fmt]} if fmt in QUALITY else {'optimize': True}
+    if fmt == 'jpeg':
+        options.update(optimize=True, progressive=True)
+    image.save(buffer, format=fmt.upper(), **options)
+    return buffer.getvalue()
+
+
+def build_variants(product):
+    """Write every variant of the product's current image and return the manifest"""
+    with product.image.open('rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()[:10]
+    stem = os.path.splitext(os.path.basename(product.image.name))[0]
+
+    source = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    has_alpha = source.mode in ('RGBA', 'LA') or (source.mode == 'P' and 'transparency' in source.info)
+    source = source.convert('RGBA' if has_alpha else 'RGB')
+    fallback = 'png' if has_alpha else 'jpeg'
+
+    formats = {fmt: [] for fmt in MODERN_FORMATS + [fallback]}
+    for width in _target_widths(source.width):
+        height = max(round(source.height * width / source.width), 1)
+        resized = source if width == source.width else source.resize((width, height), Image.LANCZOS)
+        for fmt in formats:
+            name = f'{VARIANT_DIR}/{stem}-{digest}-{width}.{fmt}'
+            if not default_storage.exists(name):
+                name = default_storage.save(name, ContentFile(_encode(resized, fmt)))
+            formats[fmt].append([width, name])
+
+    return {
+        'source': product.image.name,
+        'hash': digest,
+        'width': source.width,
+        'height': source.height,
+        'formats': formats,
+    }
+
+
+def _variant_names(manifest):
+    return {name for variants in manifest.get('formats', {}).values() for _, name in variants}
+
+
+def _unshared(manifest, product_pk):
+    """The files of `manifest` to delete: none while another product's manifest has the same source hash"""
+    # Names come from the source bytes, so products sharing an original (catalog_io reuses
+    # products/<basename> across SKUs) share every variant file too
+    digest = manifest.get('hash')
+    if digest and Product.objects.exclude(pk=product_pk).filter(image_variants__hash=digest).exists():
+        return set()
+    return _variant_names(manifest)
+
+
+def generate_variants(product):
+    """
+    (Re)generate the variants for one product and store the manifest. Files of
+    the previous manifest that are no longer used are deleted. Returns False
+    if the image couldn't be read.
+    """
+    old = product.image_variants or {}
+    if product.image:
+        try:
+            manifest = build_variants(product)
+        except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as exc:
+            logger.warning("Could not build image variants for product %s (%s): %s",
+                           product.pk, product.image.name, exc)
+            return False
+    else:
+        manifest = {}
+
+    # update() rather than save(): this must not fire post_save and come back here
+    Product.objects.filter(pk=product.pk).update(image_variants=manifest)
+    product.image_variants = manifest
+    for name in _unshared(old, product.pk) - _variant_names(manifest):
+        default_storage.delete(name)
+    invalidate_product(product.pk)
+    return True
+
+
+def queue_variants(products):
+    """Queue the generate_image_variants task for those of `products` whose image has no variants yet"""
+    enqueue_many('generate_image_variants', {
+        f'generate_image_variants:{product.pk}:{product.image.name}': {'product_id': product.pk}
+        for product in products if needs_variants(product)
+    })
+
+
+def delete_variants(manifest, product_pk=None):
+    """Delete the files of a deleted product's manifest that no other product uses"""
+    for name in _unshared(manifest or {}, product_pk):
+        default_storage.delete(name)
+
+
+def srcset(manifest, fmt):
+    return ', '.join(f'{default_storage.url(name)} {width}w' for width, name in manifest['formats'][fmt])
+
+
+def fallback_format(manifest):
+    return 'png' if 'png' in manifest.get('formats', {}) else 'jpeg'
@@ -0,0 +1,200 @@
+"""
+Stock tracking.
+
+Product.stock_available is the number of units anyone can still buy and
+Product.stock_reserved the units held in carts. A product with
+stock_available = NULL doesn't track stock and never runs out.
+
+Every change is a conditional UPDATE (`... WHERE stock_available >= n`), so
+two checkouts racing for the last unit can't both succeed: the second UPDATE
+matches no row and the order is rolled back.
+
+Adding to the cart reserves units for RESERVATION_TTL. The cart row records
+how much it holds (Cart.reserved_quantity); checkout consumes the hold, and
+`manage.py release_reservations` hands expired holds back to stock.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, When
+from django.utils import timezone
+
+from .models import Cart, Product
+
+RESERVATION_TTL = timedelta(minutes=15)
+
+
+class OutOfStockError(Exception):
+    def __init__(self, products):
+        self.products = products
+        names = ', '.join(p.name for p in products)
+        super().__init__(f"Not enough stock for: {names}")
+
+
+def _shift_stock(changes):
+    """
+    Apply {product_id: (take_from_available, release_from_reserved)} in one UPDATE.
+
+    Each product only matches if it has enough available stock, so the number
+    of updated rows tells whether every change went through.
+    """
+    if not changes:
+        return True
+    condition = Q()
+    for product_id, (take, release) in changes.items():
+        condition |= Q(pk=product_id, stock_available__gte=take)
+    updated = Product.objects.filter(condition).update(
+        stock_available=Case(
+            *[When(pk=pid, then=F('stock_available') - take) for pid, (take, _) in changes.items()],
+            default=F('stock_available'),
+            output_field=IntegerField(),
+        ),
+        stock_reserved=Case(
+            *[When(pk=pid, then=F('stock_reserved') - release) for pid, (_, release) in changes.items()],
+            default=F('stock_reserved'),
+            output_field=IntegerField(),
+        ),
+    )
+    return updated == len(changes)
+
+
+def _short_products(changes):
+    products = Product.objects.filter(pk__in=changes)
+    return [p for p in products if p.stock_available is not None and p.stock_available < changes[p.pk][0]]
+
+
+class _PartialUpdate(Exception):
+    pass
+
+
+def commit_stock(lines):
+    """
+    Take stock for an order. `lines` are (product, quantity, reserved) tuples,
+    where `reserved` units were already held for the buyer and come out of
+    stock_reserved instead. Call inside the order's transaction; raises
+    OutOfStockError (which rolls it back) if any product is short.
+    """
+    changes = {}
+    for product, quantity, reserved in lines:
+        if product.stock_available is None:
+            continue
+        take, release = changes.get(product.pk, (0, 0))
+        reserved = min(reserved, quantity)
+        changes[product.pk] = (take + quantity - reserved, release + reserved)
+    try:
+        # Savepoint, so the products that did have stock are rolled back
+        # before we look up which ones didn't
+        with transaction.atomic():
+            if not _shift_stock(changes):
+                raise _PartialUpdate()
+    except _PartialUpdate:
+        raise OutOfStockError(_short_products(changes))
+
+
+def reserve(cart_item, quantity):
+    """
+    Set the cart row to `quantity` units and hold that many units of its
+    product for RESERVATION_TTL, adjusting whatever the row already holds.
+    Raises OutOfStockError, leaving the row untouched, if there aren't enough.
+    """
+    product = cart_item.product
+    if product.stock_available is None:
+        cart_item.quantity = quantity
+        cart_item.save()
+        return
+
+    with transaction.atomic():
+        held = 0
+        if cart_item.pk:
+            # Re-read under lock so the sweeper can't release this hold underneath us
+            held = Cart.objects.select_for_update().filter(pk=cart_item.pk).values_list(
+                'reserved_quantity', flat=True).first() or 0
+        delta = quantity - held
+        if delta > 0:
+            updated = Product.objects.filter(pk=product.pk, stock_available__gte=delta).update(
+                stock_available=F('stock_available') - delta,
+                stock_reserved=F('stock_reserved') + delta,
+            )
+            if not updated:
+                raise OutOfStockError([product])
+        elif delta < 0:
+            Product.objects.filter(pk=product.pk).update(
+                stock_available=F('stock_available') - delta,
+                stock_reserved=F('stock_reserved') + delta,
+            )
+        cart_item.quantity = quantity
+        cart_item.reserved_quantity = quantity
+        cart_item.reserved_until = timezone.now() + RESERVATION_TTL
+        cart_item.save()
+
+
+
+def reserve_up_to(cart_items):
+    """
+    reserve() for many unsaved cart rows at once (one per product), holding
+    what stock is left instead of failing: each row's quantity is cut to the
+    units its product can still give it on top of its `reserved_quantity`.
+    Rows that get nothing, or whose product is gone, are left out; the rest
+    are written in one upsert and returned.
+    """
+    with transaction.atomic():
+        stock = dict(Product.objects.select_for_update().filter(
+            pk__in=[item.product_id for item in cart_items]).values_list('pk', 'stock_available'))
+        until = timezone.now() + RESERVATION_TTL
+        rows, changes = [], {}
+        for item in cart_items:
+            if item.product_id not in stock:
+                continue
+            available = stock[item.product_id]
+            if available is not None:
+                item.quantity = min(item.quantity, item.reserved_quantity + available)
+                delta = item.quantity - item.reserved_quantity
+                if delta:
+                    changes[item.product_id] = (delta, -delta)
+                item.reserved_quantity, item.reserved_until = item.quantity, until
+            if item.quantity > 0:
+                rows.append(item)
+        if not _shift_stock(changes):
+            raise OutOfStockError(_short_products(changes))
+        Cart.objects.bulk_create(rows, update_conflicts=True, unique_fields=['user', 'product'],
+                                 update_fields=['quantity', 'reserved_quantity', 'reserved_until'])
+    return rows
+
+
+def release(cart_item):
+    """Give back the stock held by a cart row that is about to be deleted"""
+    if cart_item.reserved_quantity:
+        Product.objects.filter(pk=cart_item.product_id, stock_available__isnull=False).update(
+            stock_available=F('stock_available') + cart_item.reserved_quantity,
+            stock_reserved=F('stock_reserved') - cart_item.reserved_quantity,
+        )
+
+
+def release_expired(now=None, batch_size=500):
+    """Return expired cart holds to available stock, in batches. Returns the number of cart rows released."""
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                Cart.objects.select_for_update(skip_locked=True)
+                .filter(reserved_quantity__gt=0, reserved_until__lt=now)
+                .values_list('pk', 'product_id', 'reserved_quantity')[:batch_size]
+            )
+            if not rows:
+                return released
+            per_product = {}
+            for _, product_id, held in rows:
+                per_product[product_id] = per_product.get(product_id, 0) + held
+            Cart.objects.filter(pk__in=[pk for pk, _, _ in rows]).update(reserved_quantity=0, reserved_until=None)
+            Product.objects.filter(pk__in=per_product, stock_available__isnull=False).update(
+                stock_available=Case(
+                    *[When(pk=pid, then=F('stock_available') + held) for pid, held in per_product.items()],
+                    output_field=IntegerField(),
+                ),
+                stock_reserved=Case(
+                    *[When(pk=pid, then=F('stock_reserved') - held) for pid, held in per_product.items()],
+                    output_field=IntegerField(),
+                ),
+            )
+        released += len(rows)
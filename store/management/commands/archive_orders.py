@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from store.orders import HOT_MONTHS, archive_orders, hot_cutoff, rebuild_order_stats
+
+
+class Command(BaseCommand):
+    help = f"Move finished orders older than {HOT_MONTHS} months into the archive (run nightly from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--rebuild-stats', action='store_true',
+                            help="Also recompute every customer's order count and lifetime spend")
+
+    def handle(self, *args, **options):
+        moved = archive_orders(hot_cutoff(), batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Archived {moved} order(s)"))
+        if options['rebuild_stats']:
+            customers = rebuild_order_stats()
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt order stats for {customers} customer(s)"))
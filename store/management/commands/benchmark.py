@@ -0,0 +1,94 @@
+import json
+import platform
+import random
+import subprocess
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from store import benchmarks
+
+
+class Command(BaseCommand):
+    help = ("Seed a synthetic catalog into a throwaway test database and benchmark the storefront "
+            "hot paths (throughput, latency percentiles, queries per request)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--cart-items', type=int, default=5, help="Cart rows per user")
+        parser.add_argument('--feedback', type=int, default=3000)
+        parser.add_argument('--orders', type=int, default=500)
+        parser.add_argument('--requests', type=int, default=200, help="Measured requests per scenario")
+        parser.add_argument('--warmup', type=int, default=20, help="Unmeasured requests per scenario")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for the data and the request mix")
+        parser.add_argument('--cold-cache', action='store_true', help="Clear the cache before every request")
+        parser.add_argument('--only', nargs='+', metavar='SCENARIO', help="Run only these scenarios")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        parser.add_argument('--compare', metavar='BASELINE', help="JSON file from an earlier run to compare against")
+        parser.add_argument('--threshold', type=float, default=10, help="Regression threshold in percent (default 10)")
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['products'] < 1:
+            raise CommandError("--products and --users must be at least 1")
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        with benchmarks.throwaway_database():
+            self.stdout.write("Seeding catalog...")
+            users = benchmarks.seed(
+                products=options['products'], users=options['users'], cart_items=options['cart_items'],
+                feedback=options['feedback'], orders=options['orders'], rng=random.Random(options['seed']),
+            )
+            results = benchmarks.run(
+                users, requests=options['requests'], warmup=options['warmup'], cold_cache=options['cold_cache'],
+                only=options['only'], rng=random.Random(options['seed'] + 1),
+            )
+
+        report = {
+            'commit': self._commit(),
+            'created_at': timezone.now().isoformat(),
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+            },
+            'options': {key: options[key] for key in (
+                'products', 'users', 'cart_items', 'feedback', 'orders', 'requests', 'warmup', 'seed', 'cold_cache')},
+            'scenarios': results,
+        }
+
+        header = f"{'scenario':<16}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'q p50':>7}{'q max':>7}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for name, row in results.items():
+            latency = row['latency_ms']
+            self.stdout.write(
+                f"{name:<16}{row['throughput_rps']:>9.1f}{latency['p50']:>9.2f}{latency['p95']:>9.2f}"
+                f"{latency['p99']:>9.2f}{row['queries']['p50']:>7}{row['queries']['max']:>7}"
+            )
+            if set(row['status_codes']) - {200, 302}:
+                self.stdout.write(self.style.WARNING(f"    unexpected status codes: {row['status_codes']}"))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if baseline:
+            regressions = benchmarks.compare(baseline['scenarios'], results, options['threshold'] / 100)
+            if not regressions:
+                self.stdout.write(self.style.SUCCESS(f"No regressions against {baseline.get('commit') or 'baseline'}"))
+            for name, metric, before, after, change in regressions:
+                self.stdout.write(self.style.WARNING(f"{name}: {metric} {before} -> {after} ({change:+}%)"))
+
+    def _commit(self):
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
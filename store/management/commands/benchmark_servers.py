@@ -0,0 +1,82 @@
+import json
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from store import benchmarks, server_benchmark
+
+
+class Command(BaseCommand):
+    help = ("Seed a throwaway database and compare the sync views under gunicorn (WSGI) with the async views "
+            "under uvicorn (ASGI) under concurrent load that includes slow clients")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--servers', nargs='+', choices=server_benchmark.SERVERS, default=list(server_benchmark.SERVERS))
+        parser.add_argument('--workers', type=int, default=2, help="Worker processes per server")
+        parser.add_argument('--clients', type=int, default=20, help="Concurrent measured clients")
+        parser.add_argument('--slow-clients', type=int, default=20, help="Concurrent slow clients")
+        parser.add_argument('--slow-delay', type=float, default=0.25,
+                            help="Seconds a slow client waits between chunks it sends or reads")
+        parser.add_argument('--duration', type=float, default=15, help="Seconds of load per server")
+        parser.add_argument('--warmup', type=int, default=1, help="Unmeasured requests per page before the load")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--database', default='benchmark_servers.sqlite3',
+                            help="SQLite file for the throwaway database (deleted afterwards)")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        missing = server_benchmark.missing_servers(options['servers'])
+        if missing:
+            raise CommandError(f"Install {' and '.join(missing)} first (pip install -r requirements.txt)")
+        if options['users'] < 1 or options['products'] < 1:
+            raise CommandError("--products and --users must be at least 1")
+
+        results = {}
+        name = options['database'] if connection.vendor == 'sqlite' else None
+        with benchmarks.throwaway_database(name):
+            self.stdout.write("Seeding catalog...")
+            users = benchmarks.seed(products=options['products'], users=options['users'],
+                                    rng=random.Random(options['seed']))
+            cookies = server_benchmark.login_cookies(users)
+            paths = server_benchmark.catalog_paths(*benchmarks.targets())
+            env = {'DATABASE_URL': server_benchmark.database_url(), 'DEBUG': '0'}
+            connection.close()  # let the servers have the database to themselves
+
+            for server in options['servers']:
+                self.stdout.write(f"Running {server} ({options['workers']} worker(s), {options['clients']} clients, "
+                                  f"{options['slow_clients']} slow clients, {options['duration']:g}s)...")
+                try:
+                    with server_benchmark.Server(server, options['workers'], env) as running:
+                        results[server] = server_benchmark.run_load(
+                            running.port, paths, cookies, options['clients'], options['slow_clients'],
+                            options['slow_delay'], options['duration'], options['warmup'],
+                            random.Random(options['seed'] + 1),
+                        )
+                except RuntimeError as exc:
+                    raise CommandError(f"{server}: {exc}")
+
+        header = f"{'server':<8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}{'slow done':>11}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for server, row in results.items():
+            latency = row['latency_ms']
+            self.stdout.write(
+                f"{server:<8}{row['throughput_rps']:>9.1f}{latency['p50'] or 0:>10.2f}{latency['p95'] or 0:>10.2f}"
+                f"{latency['p99'] or 0:>10.2f}{row['errors']:>8}{row['slow_client_requests']:>11}"
+            )
+            if set(row['status_codes']) - {200}:
+                self.stdout.write(self.style.WARNING(f"    unexpected status codes: {row['status_codes']}"))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'options': {key: options[key] for key in (
+                    'products', 'users', 'workers', 'clients', 'slow_clients', 'slow_delay', 'duration', 'seed')},
+                    'servers': results}, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if {'wsgi', 'asgi'} <= results.keys() and results['wsgi']['throughput_rps']:
+            ratio = results['asgi']['throughput_rps'] / results['wsgi']['throughput_rps']
+            self.stdout.write(self.style.SUCCESS(f"ASGI throughput is {ratio:.2f}x WSGI under this load"))
@@ -0,0 +1,57 @@
+import random
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from store import benchmarks
+from store.explain import analyze, capture_selects, explain
+
+
+class Command(BaseCommand):
+    help = ("Seed a large synthetic catalog into a throwaway test database, EXPLAIN every query the hot "
+            "views run and fail if any of them scans a whole table")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=20000)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--feedback', type=int, default=20000)
+        parser.add_argument('--orders', type=int, default=5000)
+        parser.add_argument('--verbose-plans', action='store_true', help="Print every plan, not only the bad ones")
+
+    def handle(self, *args, **options):
+        with benchmarks.throwaway_database():
+            self.stdout.write("Seeding catalog...")
+            users = benchmarks.seed(products=options['products'], users=options['users'], cart_items=5,
+                                    feedback=options['feedback'], orders=options['orders'])
+            analyze()
+            client = Client()
+            client.force_login(users[0])
+            failures = self._check(client, options['verbose_plans'])
+
+        if failures:
+            raise CommandError(f"{failures} query plan(s) scan a whole table")
+        self.stdout.write(self.style.SUCCESS("Every hot-path query uses an index"))
+
+    def _check(self, client, verbose):
+        failures = 0
+        rng = random.Random(0)
+        for name, request in benchmarks.scenarios(rng, *benchmarks.targets()).items():
+            request(client)  # let the session settle (header counts etc.)
+            cache.clear()  # so cached listings and pages still hit the database
+            seen = set()
+            for query in capture_selects(lambda: request(client)):
+                if query.sql in seen:
+                    continue
+                seen.add(query.sql)
+                explain(query)
+                if query.full_scans:
+                    failures += 1
+                    self.stdout.write(self.style.ERROR(f"{name}: full scan of {', '.join(query.full_scans)}"))
+                elif not verbose:
+                    continue
+                self.stdout.write(f"    {query.sql[:300]}")
+                for step in query.plan:
+                    self.stdout.write(f"      {step}")
+            self.stdout.write(f"{name}: {len(seen)} distinct quer{'y' if len(seen) == 1 else 'ies'} checked")
+        return failures
@@ -0,0 +1,22 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from store.catalog_io import FORMATS, export_rows
+
+
+class Command(BaseCommand):
+    help = "Write the product catalog as CSV or JSONL (streamed, for any catalog size)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--output', help="File to write to (default: stdout)")
+
+    def handle(self, *args, **options):
+        out = open(options['output'], 'w', newline='', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            for line in export_rows(options['format']):
+                out.write(line)
+        finally:
+            if out is not sys.stdout:
+                out.close()
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from store.images import generate_variants, needs_variants
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = "Build the resized/WebP/AVIF variants of product images that don't have them yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, action='append', dest='product_ids',
+                            help="Only this product id (can be repeated)")
+        parser.add_argument('--force', action='store_true', help="Regenerate even if variants are up to date")
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').exclude(image__isnull=True).only('pk', 'image', 'image_variants')
+        if options['product_ids']:
+            products = products.filter(pk__in=options['product_ids'])
+
+        generated = failed = 0
+        for product in products.order_by('pk').iterator(chunk_size=options['batch_size']):
+            if not options['force'] and not needs_variants(product):
+                continue
+            if generate_variants(product):
+                generated += 1
+            else:
+                failed += 1
+                self.stderr.write(f"Product {product.pk}: could not read {product.image.name}")
+        style = self.style.SUCCESS if not failed else self.style.WARNING
+        self.stdout.write(style(f"Generated variants for {generated} product(s), {failed} failed"))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.catalog_io import BATCH_SIZE, FORMATS, ImportFormatError, guess_format, import_products
+
+
+class Command(BaseCommand):
+    help = "Create or update products from a CSV or JSONL file, matching rows on sku"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--images-dir', help="Copy the files named in the image column from this directory")
+
+    def handle(self, *args, **options):
+        try:
+            fmt = options['format'] or guess_format(options['path'])
+            with open(options['path'], newline='', encoding='utf-8-sig') as f:
+                result = import_products(f, fmt, batch_size=options['batch_size'], images_dir=options['images_dir'])
+        except (OSError, ImportFormatError) as exc:
+            raise CommandError(exc)
+
+        for line, sku, message in result.errors:
+            self.stderr.write(f"line {line} (sku {sku or '?'}): {message}")
+        if result.failed > len(result.errors):
+            self.stderr.write(f"... and {result.failed - len(result.errors)} more error(s)")
+        style = self.style.SUCCESS if not result.failed else self.style.WARNING
+        self.stdout.write(style(f"Created {result.created}, updated {result.updated}, skipped {result.failed} row(s)"))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from store.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized rating stats on Product from Feedback"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, action='append', dest='product_ids',
+                            help="Only rebuild this product id (can be repeated)")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        updated = rebuild_ratings(options['product_ids'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rating stats for {updated} product(s)"))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from store.search import get_backend, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text product search index from the Product table"
+
+    def handle(self, *args, **options):
+        indexed = rebuild_search_index()
+        backend = type(get_backend()).__name__
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} product(s) with {backend}"))
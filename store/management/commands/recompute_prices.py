@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from store.pricing import recompute_prices
+
+
+class Command(BaseCommand):
+    help = "Recompute stored product prices from the tax rules and promotions in force now (run from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, action='append', dest='product_ids',
+                            help="Only this product id (can be repeated)")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        updated = recompute_prices(options['product_ids'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Updated the price of {updated} product(s)"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store.categories import recount_categories
+
+
+class Command(BaseCommand):
+    help = "Recompute the product count of every category (after raw SQL or other bulk changes)"
+
+    def handle(self, *args, **options):
+        updated = recount_categories()
+        self.stdout.write(self.style.SUCCESS(f"Recounted {updated} category(ies)"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from store.recommendations import BATCH_SIZE, refresh_recommendations
+
+
+class Command(BaseCommand):
+    help = "Count new orders, carts and wishlists into the \"customers also bought\" lists (run from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--full', action='store_true', help="Rebuild every product's list, not just the changed ones")
+
+    def handle(self, *args, **options):
+        rebuilt = refresh_recommendations(batch_size=options['batch_size'], full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the recommendations of {rebuilt} product(s)"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from store.inventory import release_expired
+
+
+class Command(BaseCommand):
+    help = "Return stock held by expired cart reservations (run every few minutes from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        released = release_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Released {released} expired cart reservation(s)"))
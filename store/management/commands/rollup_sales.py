@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from store.analytics import BATCH_SIZE, rollup_sales
+
+
+class Command(BaseCommand):
+    help = "Fold new orders into the daily sales rollups (run every few minutes from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        added, taken_out = rollup_sales(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rolled up {added} order line(s), took out {taken_out} from cancelled orders"))
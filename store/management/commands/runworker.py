@@ -0,0 +1,88 @@
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from store.models import Task
+from store.taskqueue import claim, execute, requeue_stale
+
+STALE_CHECK_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = "Run queued background tasks (order emails etc.) until stopped with Ctrl+C or SIGTERM"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help="Tasks run at the same time")
+        parser.add_argument('--pool', choices=['thread', 'process'], default='thread',
+                            help="Run tasks in threads (I/O-bound work like email) or processes (CPU-bound work)")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument('--burst', action='store_true', help="Exit once no task is due, e.g. from cron")
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        if concurrency < 1:
+            raise CommandError("--concurrency must be at least 1")
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        stopping = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: stopping.set())
+
+        if options['pool'] == 'process':
+            # Fresh interpreters rather than forks, so no database connection is shared with this process
+            connections.close_all()
+            pool = ProcessPoolExecutor(concurrency, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=django.setup)
+        else:
+            pool = ThreadPoolExecutor(concurrency, thread_name_prefix='task')
+        self.stdout.write(f"Worker {worker} running up to {concurrency} task(s) in a {options['pool']} pool")
+
+        outcomes = Counter()
+        running = set()
+        next_stale_check = 0
+        try:
+            while not stopping.is_set():
+                if time.monotonic() >= next_stale_check:
+                    requeued = requeue_stale()
+                    if requeued:
+                        self.stdout.write(self.style.WARNING(f"Re-queued {requeued} task(s) from a lost worker"))
+                    next_stale_check = time.monotonic() + STALE_CHECK_INTERVAL
+
+                tasks = claim(worker, concurrency - len(running)) if len(running) < concurrency else []
+                running.update(pool.submit(execute, task) for task in tasks)
+                if not running:
+                    if options['burst']:
+                        break
+                    stopping.wait(options['poll_interval'])
+                    continue
+                # Wake up when a slot frees, or to poll again if there is still room
+                timeout = 0 if tasks and len(running) < concurrency else options['poll_interval']
+                done, running = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    outcomes[self._outcome(future)] += 1
+        finally:
+            for future in running:
+                outcomes[self._outcome(future)] += 1
+            pool.shutdown(wait=True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Ran {sum(outcomes.values())} task(s): {outcomes[Task.DONE]} done, "
+            f"{outcomes[Task.QUEUED]} to retry, {outcomes[Task.FAILED]} failed"
+        ))
+
+    def _outcome(self, future):
+        try:
+            return future.result()
+        except Exception as exc:
+            # Only the bookkeeping can get here (run_task catches the task's own errors);
+            # the task stays running and requeue_stale() picks it up again
+            self.stderr.write(f"Worker error: {exc!r}")
+            return 'error'
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.fulfilment import BATCH_SIZE, TRANSITIONS, InvalidTransition, recount_statuses, transition
+from store.models import Order
+
+
+class Command(BaseCommand):
+    help = "Move orders to a new status in bulk, e.g. every Processing order to Shipped"
+
+    def add_arguments(self, parser):
+        parser.add_argument('status', nargs='?', choices=list(TRANSITIONS))
+        parser.add_argument('--order', type=int, action='append', dest='order_ids',
+                            help="Move this order id (can be repeated)")
+        parser.add_argument('--from', dest='from_status', choices=list(TRANSITIONS),
+                            help="Move every order currently in this status")
+        parser.add_argument('--note', default='', help="Stored on each OrderEvent")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--recount', action='store_true', help="Recompute the per-status order counts")
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            counts = recount_statuses()
+            self.stdout.write(self.style.SUCCESS(f"Recounted {sum(counts.values())} order(s)"))
+        status = options['status']
+        if not status:
+            if not options['recount']:
+                raise CommandError("Give a status to move orders to, or --recount")
+            return
+        order_ids = list(options['order_ids'] or [])
+        if options['from_status']:
+            order_ids += Order.objects.filter(order_status=options['from_status']).order_by('pk').values_list(
+                'pk', flat=True)
+        if not order_ids:
+            raise CommandError("Give --order ids or --from a status")
+        try:
+            result = transition(order_ids, status, note=options['note'], batch_size=options['batch_size'])
+        except InvalidTransition as exc:
+            raise CommandError(str(exc))
+        if result.skipped:
+            self.stdout.write(self.style.WARNING(f"Skipped {len(result.skipped)} order(s) that can't move to {status}"))
+        self.stdout.write(self.style.SUCCESS(f"Moved {result.moved} order(s) to {status}"))
@@ -0,0 +1,36 @@
+import json
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from store.metrics import REGISTRY_KEY, collected_report
+
+
+class Command(BaseCommand):
+    help = "Dump per-view latency and query-count percentiles published by running workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help="Print the raw report as JSON")
+
+    def handle(self, *args, **options):
+        report = collected_report(include_local=False)
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        if not report:
+            workers = len(cache.get(REGISTRY_KEY) or [])
+            self.stdout.write(f"No metrics found ({workers} worker(s) registered). "
+                              "Workers only share metrics through a shared cache (REDIS_URL or CACHE_DIR).")
+            return
+
+        header = f"{'view':<28}{'reqs':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'p95 q':>7}{'p95 sql':>9}{'dups':>6}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for view, row in report.items():
+            self.stdout.write(
+                f"{view[:27]:<28}{row['requests']:>7}"
+                f"{row['wall_ms']['p50']:>9.1f}{row['wall_ms']['p95']:>9.1f}{row['wall_ms']['p99']:>9.1f}"
+                f"{row['queries']['p95']:>7}{row['sql_ms']['p95']:>9.1f}{row['max_duplicate_queries']:>6}"
+            )
+            for shape, count in row['top_duplicate_shapes']:
+                self.stdout.write(f"    repeated in {count} request(s): {shape[:100]}")
@@ -0,0 +1,192 @@
+"""
+Per-view request metrics collected by store.middleware.QueryMetricsMiddleware.
+
+Each worker keeps the last SAMPLE_SIZE requests per view in memory and
+periodically publishes them to the cache, so the staff endpoint and the
+`view_metrics` management command can report percentiles across workers
+(with a shared cache backend; with LocMemCache only the current process is
+visible). A worker's samples expire PROCESS_TIMEOUT after its last publish,
+and workers on the same host drop the registry entries of dead pids.
+"""
+import math
+import os
+import re
+import socket
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from django.conf import settings
+from django.core.cache import cache
+
+SAMPLE_SIZE = 1000
+PUBLISH_INTERVAL = 30  # seconds
+REGISTRY_KEY = 'metrics:views:processes'
+REGISTRY_TIMEOUT = 24 * 60 * 60
+# Serializes the registry's read-modify-write across workers
+REGISTRY_LOCK_KEY = 'metrics:views:processes:lock'
+REGISTRY_LOCK_TIMEOUT = 5
+REGISTRY_LOCK_ATTEMPTS = 5
+PROCESS_TIMEOUT = 60 * 60
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LIST_RE = re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)')
+
+
+def process_key():
+    # Computed per call: workers forked from a preloaded master get their own pid
+    return f'metrics:views:{socket.gethostname()}:{os.getpid()}'
+
+
+def _process_alive(key):
+    """False for a worker on this host whose pid is gone; other hosts' workers are left to PROCESS_TIMEOUT"""
+    _, host, pid = key.rsplit(':', 2)
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        pass
+    return True
+
+
+def _register(key):
+    """Add `key` to the registry, dropping workers that are gone, under a cache lock"""
+    for _ in range(REGISTRY_LOCK_ATTEMPTS):
+        if cache.add(REGISTRY_LOCK_KEY, key, REGISTRY_LOCK_TIMEOUT):
+            break
+        time.sleep(0.05)
+    else:
+        return  # the next publish tries again
+    try:
+        registered = cache.get(REGISTRY_KEY) or []
+        published = cache.get_many(registered)
+        processes = [other for other in registered if other in published and _process_alive(other)]
+        cache.delete_many([other for other in published if other not in processes])
+        if key not in processes:
+            processes.append(key)
+        if processes != registered:
+            cache.set(REGISTRY_KEY, processes, REGISTRY_TIMEOUT)
+    finally:
+        cache.delete(REGISTRY_LOCK_KEY)
+
+
+def query_shape(sql):
+    """Normalize SQL so the same query with different values maps to one shape"""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    return _LIST_RE.sub('(?, ...)', sql)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class RequestSample:
+    __slots__ = ('wall_ms', 'queries', 'sql_ms', 'duplicates')
+
+    def __init__(self, wall_ms, queries, sql_ms, duplicates):
+        self.wall_ms = wall_ms
+        self.queries = queries
+        self.sql_ms = sql_ms
+        self.duplicates = duplicates
+
+
+class ViewMetrics:
+    """Rolling per-view samples for this process"""
+
+    def __init__(self, sample_size=SAMPLE_SIZE):
+        self.sample_size = sample_size
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=self.sample_size))
+        self._totals = Counter()
+        self._duplicate_shapes = defaultdict(Counter)
+        self._published_at = 0
+
+    def record(self, view_name, sample, duplicate_shapes=()):
+        with self._lock:
+            self._samples[view_name].append(sample)
+            self._totals[view_name] += 1
+            for shape in duplicate_shapes:
+                self._duplicate_shapes[view_name][shape] += 1
+        if time.monotonic() - self._published_at > PUBLISH_INTERVAL:
+            self.publish()
+
+    def raw(self):
+        """Plain-data copy of the samples, suitable for the cache"""
+        with self._lock:
+            return {
+                view: {
+                    'count': self._totals[view],
+                    'samples': [(s.wall_ms, s.queries, s.sql_ms, s.duplicates) for s in samples],
+                    'duplicate_shapes': self._duplicate_shapes[view].most_common(5),
+                }
+                for view, samples in self._samples.items()
+            }
+
+    def publish(self):
+        # One thread publishes at a time; the others carry on serving
+        if not self._publish_lock.acquire(blocking=False):
+            return
+        try:
+            self._published_at = time.monotonic()
+            key = process_key()
+            cache.set(key, self.raw(), PROCESS_TIMEOUT)
+            _register(key)
+        finally:
+            self._publish_lock.release()
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._totals.clear()
+            self._duplicate_shapes.clear()
+
+
+def summarize(raw_by_process):
+    """Merge raw samples from one or more processes into a per-view report"""
+    merged = defaultdict(lambda: {'count': 0, 'samples': [], 'duplicate_shapes': Counter()})
+    for raw in raw_by_process:
+        for view, data in raw.items():
+            merged[view]['count'] += data['count']
+            merged[view]['samples'].extend(data['samples'])
+            merged[view]['duplicate_shapes'].update(dict(data['duplicate_shapes']))
+
+    report = {}
+    for view, data in merged.items():
+        wall, queries, sql, duplicates = (sorted(column) for column in zip(*data['samples']))
+        report[view] = {
+            'requests': data['count'],
+            'sampled': len(wall),
+            'wall_ms': {f'p{p}': percentile(wall, p) for p in (50, 95, 99)},
+            'queries': {f'p{p}': percentile(queries, p) for p in (50, 95, 99)},
+            'sql_ms': {f'p{p}': percentile(sql, p) for p in (50, 95, 99)},
+            'max_duplicate_queries': duplicates[-1],
+            'top_duplicate_shapes': data['duplicate_shapes'].most_common(3),
+        }
+    return dict(sorted(report.items(), key=lambda item: -item[1]['wall_ms']['p95']))
+
+
+def collected_report(include_local=True):
+    """Report across every process that published to the cache (and this one)"""
+    raws = []
+    for key in cache.get(REGISTRY_KEY) or []:
+        if include_local and key == process_key():
+            continue
+        raw = cache.get(key)
+        if raw:
+            raws.append(raw)
+    if include_local:
+        raws.append(view_metrics.raw())
+    return summarize(raws)
+
+
+view_metrics = ViewMetrics(getattr(settings, 'QUERY_METRICS_SAMPLE_SIZE', SAMPLE_SIZE))
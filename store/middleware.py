@@ -0,0 +1,144 @@
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.db.backends.signals import connection_created
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from .metrics import RequestSample, query_shape, view_metrics
+
+logger = logging.getLogger('store.metrics')
+
+
+class _QueryTracker:
+    """connection.execute_wrapper that counts query shapes and SQL time"""
+
+    def __init__(self):
+        self.shapes = Counter()
+        self.sql_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.shapes[query_shape(sql)] += 1
+
+
+# Under ASGI the ORM runs in worker threads, each with its own connection, so
+# the request's tracker travels in a context variable instead.
+_current_tracker = ContextVar('query_tracker', default=None)
+
+
+def _track_current(execute, sql, params, many, context):
+    tracker = _current_tracker.get()
+    if tracker is None:
+        return execute(sql, params, many, context)
+    return tracker(execute, sql, params, many, context)
+
+
+def _install_tracker(sender, connection, **kwargs):
+    if _track_current not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_track_current)
+
+
+class QueryMetricsMiddleware:
+    """
+    Record wall time, SQL query count, SQL time and repeated query shapes for
+    every request, keyed by the resolved view name (see metrics.py).
+
+    Off unless QUERY_METRICS_ENABLED = True (QUERY_METRICS_ENABLED=1 in the
+    environment). Set QUERY_METRICS_LOG_THRESHOLD = N to log a warning for any
+    request that runs more than N queries.
+
+    Works under WSGI and ASGI. Under ASGI only queries on connections opened
+    after startup are seen, which with CONN_MAX_AGE = 0 (see settings) is all
+    of them.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_METRICS_ENABLED', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.log_threshold = getattr(settings, 'QUERY_METRICS_LOG_THRESHOLD', None)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            connection_created.connect(_install_tracker)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        tracker = _QueryTracker()
+        started = time.perf_counter()
+        with connection.execute_wrapper(tracker):
+            response = self.get_response(request)
+        self._record(request, tracker, (time.perf_counter() - started) * 1000)
+        return response
+
+    async def __acall__(self, request):
+        tracker = _QueryTracker()
+        token = _current_tracker.set(tracker)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_tracker.reset(token)
+        self._record(request, tracker, (time.perf_counter() - started) * 1000)
+        return response
+
+    def _record(self, request, tracker, wall_ms):
+        shapes, sql_time = tracker.shapes, tracker.sql_time
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else 'unresolved'
+        queries = sum(shapes.values())
+        duplicate_shapes = [shape for shape, count in shapes.items() if count > 1]
+        view_metrics.record(view_name, RequestSample(
+            round(wall_ms, 2), queries, round(sql_time * 1000, 2), sum(shapes[s] - 1 for s in duplicate_shapes),
+        ), duplicate_shapes)
+
+        if self.log_threshold is not None and queries > self.log_threshold:
+            logger.warning(
+                "%s %s (%s) ran %d queries in %.1fms; repeated: %s",
+                request.method, request.path, view_name, queries, wall_ms,
+                '; '.join(f'{shapes[s]}x {s[:120]}' for s in duplicate_shapes) or 'none',
+            )
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise, async-capable. WhiteNoiseMiddleware is sync-only, and one sync
+    middleware makes Django run the whole request (async views included) in
+    a thread under ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            # Opening the file and stat() are blocking
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
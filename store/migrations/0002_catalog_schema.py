@@ -0,0 +1,178 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:54
+
+import django.db.models.deletion
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('line_total', models.DecimalField(decimal_places=2, max_digits=10)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Promotion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('category', models.CharField(blank=True, help_text='Leave empty to apply to every category', max_length=100)),
+                ('percent_off', models.DecimalField(decimal_places=2, default=0, max_digits=5)),
+                ('amount_off', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('starts_at', models.DateTimeField(blank=True, null=True)),
+                ('ends_at', models.DateTimeField(blank=True, null=True)),
+                ('is_active', models.BooleanField(default=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TaxRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('category', models.CharField(blank=True, help_text='Leave empty to apply to every category', max_length=100)),
+                ('rate', models.DecimalField(decimal_places=2, default=0, help_text='Percent of the discounted price', max_digits=5)),
+                ('flat_amount', models.DecimalField(decimal_places=2, default=0, help_text='Fixed amount per unit', max_digits=10)),
+                ('is_active', models.BooleanField(default=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='reserved_quantity',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='reserved_until',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='average_rating',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='promotion_amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='sku',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='star_1_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='star_2_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='star_3_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='star_4_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='star_5_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stock_available',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stock_reserved',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='tax_amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='store.product'),
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['user', 'product'], name='cart_user_product_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedback',
+            index=models.Index(fields=['product', '-created_at'], name='feedback_product_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-average_rating', '-id'], name='product_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['effective_price', 'id'], name='product_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(django.db.models.functions.text.Lower('category'), models.OrderBy(models.F('id'), descending=True), name='product_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_new', True)), fields=['-id'], name='product_new_idx'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='store.order'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='store.product'),
+        ),
+    ]
@@ -0,0 +1,78 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count, Exists, OuterRef, Q, Sum
+
+BATCH_SIZE = 500
+CENTS = Decimal('0.01')
+STARS = range(1, 6)
+
+
+def _batches(queryset):
+    batch = []
+    for row in queryset.iterator(chunk_size=BATCH_SIZE):
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def backfill_prices(apps, schema_editor):
+    # No tax rules or promotions exist yet, so every product gets the flat GST it was sold with before
+    Product = apps.get_model('store', 'Product')
+    tax = Decimal(str(getattr(settings, 'PRICING_DEFAULT_FLAT_TAX', '50.00')))
+    for batch in _batches(Product.objects.order_by('pk').only('pk', 'price', 'discount')):
+        for product in batch:
+            net = max(product.price - product.discount, Decimal('0.00'))
+            product.effective_price, product.tax_amount = net + tax, tax
+        Product.objects.bulk_update(batch, ['effective_price', 'tax_amount'])
+
+
+def backfill_ratings(apps, schema_editor):
+    Feedback = apps.get_model('store', 'Feedback')
+    Product = apps.get_model('store', 'Product')
+    fields = ['rating_count', 'rating_sum', 'average_rating'] + [f'star_{stars}_count' for stars in STARS]
+    stats = Feedback.objects.order_by().values('product_id').annotate(
+        rating_count=Count('id'),
+        rating_sum=Sum('rating'),
+        **{f'star_{stars}_count': Count('id', filter=Q(rating=stars)) for stars in STARS},
+    )
+    rows = {row.pop('product_id'): row for row in stats}
+    for batch in _batches(Product.objects.filter(pk__in=rows).order_by('pk').only('pk')):
+        for product in batch:
+            row = rows[product.pk]
+            for name, value in row.items():
+                setattr(product, name, value)
+            product.average_rating = row['rating_sum'] / row['rating_count']
+        Product.objects.bulk_update(batch, fields)
+
+
+def backfill_order_items(apps, schema_editor):
+    # Orders used to be for a single product, held on the order itself
+    Order = apps.get_model('store', 'Order')
+    OrderItem = apps.get_model('store', 'OrderItem')
+    legacy = (Order.objects.filter(product__isnull=False).exclude(Exists(OrderItem.objects.filter(order=OuterRef('pk'))))
+              .order_by('pk').only('pk', 'product_id', 'quantity', 'total_amount'))
+    for batch in _batches(legacy):
+        OrderItem.objects.bulk_create([
+            OrderItem(order_id=order.pk, product_id=order.product_id, quantity=order.quantity,
+                      unit_price=(order.total_amount / max(order.quantity, 1)).quantize(CENTS, ROUND_HALF_UP),
+                      line_total=order.total_amount)
+            for order in batch
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0002_catalog_schema'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_prices, migrations.RunPython.noop),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+        migrations.RunPython(backfill_order_items, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_backfill_catalog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('slug', models.SlugField(max_length=100, unique=True)),
+                ('icon', models.CharField(blank=True, default='🛍️', max_length=8)),
+                ('product_count', models.PositiveIntegerField(default=0, editable=False)),
+            ],
+            options={
+                'verbose_name_plural': 'categories',
+                'ordering': ['name'],
+            },
+        ),
+        # Filled from the old free-text column by 0005, then renamed to `category` by 0006
+        migrations.AddField(
+            model_name='product',
+            name='category_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL,
+                                    related_name='+', to='store.category'),
+        ),
+    ]
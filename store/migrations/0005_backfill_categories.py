@@ -0,0 +1,54 @@
+from django.db import migrations
+from django.db.models import Count
+from django.utils.text import slugify
+
+# The emoji the product templates used to pick with an if/elif chain
+ICONS = {
+    'shirts': '👕', 'shoes': '👟', 'watches': '⌚', 'hoodies': '🧥', 't-shirts': '👚',
+    'jeans': '👖', 'sunglasses': '🕶️', 'belts': '⛓️', 'court': '👟', 'corts': '👟',
+}
+
+
+def backfill(apps, schema_editor):
+    Category = apps.get_model('store', 'Category')
+    Product = apps.get_model('store', 'Product')
+
+    # Spellings that only differ in case or punctuation ("Shoes", "shoes ") share a slug and a category
+    by_slug = {}
+    names = Product.objects.exclude(category__isnull=True).values_list('category', flat=True).distinct()
+    for raw in names:
+        name = raw.strip()
+        if not name:
+            continue
+        slug = slugify(name, allow_unicode=True)
+        key = slug or name
+        if key not in by_slug:
+            # Names with nothing to slugify ("★★★") hold their name as the slug until the id is known
+            category = Category.objects.create(name=name, slug=key, icon=ICONS.get(slug, '🛍️'))
+            if not slug:
+                category.slug = f'category-{category.pk}'
+                category.save(update_fields=['slug'])
+            by_slug[key] = category
+        Product.objects.filter(category=raw).update(category_ref=by_slug[key])
+
+    counts = Product.objects.filter(category_ref__isnull=False).values('category_ref').annotate(n=Count('id'))
+    for row in counts:
+        Category.objects.filter(pk=row['category_ref']).update(product_count=row['n'])
+
+
+def restore(apps, schema_editor):
+    Category = apps.get_model('store', 'Category')
+    Product = apps.get_model('store', 'Product')
+    for category in Category.objects.all():
+        Product.objects.filter(category_ref=category).update(category=category.name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0004_category'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, restore),
+    ]
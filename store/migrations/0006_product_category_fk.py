@@ -0,0 +1,35 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0005_backfill_categories'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_category_idx',
+        ),
+        migrations.RemoveField(
+            model_name='product',
+            name='category',
+        ),
+        migrations.RenameField(
+            model_name='product',
+            old_name='category_ref',
+            new_name='category',
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='category',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL,
+                                    related_name='products', to='store.category'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', '-id'], name='product_category_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_product_category_fk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Task',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('idempotency_key', models.CharField(blank=True, max_length=200, null=True, unique=True)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('run_at', models.DateTimeField()),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=5)),
+                ('last_error', models.TextField(blank=True)),
+                ('locked_by', models.CharField(blank=True, max_length=100)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('status', 'queued')), fields=['run_at', 'id'], name='task_due_idx'), models.Index(condition=models.Q(('status', 'running')), fields=['locked_at'], name='task_running_idx')],
+            },
+        ),
+    ]
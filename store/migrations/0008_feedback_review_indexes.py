@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_task'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='feedback',
+            name='feedback_product_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='feedback',
+            index=models.Index(fields=['product', '-created_at', '-id'], name='feedback_product_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedback',
+            index=models.Index(fields=['product', 'rating', '-created_at', '-id'], name='feedback_product_rating_idx'),
+        ),
+    ]
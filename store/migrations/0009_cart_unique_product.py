@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F
+
+MAX_QUANTITY = 10
+
+
+def merge_duplicates(apps, schema_editor):
+    """Fold duplicate (user, product) cart rows into the oldest one before the unique constraint goes on"""
+    Cart = apps.get_model('store', 'Cart')
+    Product = apps.get_model('store', 'Product')
+
+    duplicates = (Cart.objects.values('user_id', 'product_id').annotate(n=Count('id')).filter(n__gt=1)
+                  .order_by())
+    for pair in duplicates:
+        rows = list(Cart.objects.filter(user_id=pair['user_id'], product_id=pair['product_id']).order_by('id'))
+        keep = rows[0]
+        quantity = min(sum(row.quantity for row in rows), MAX_QUANTITY)
+        held = sum(row.reserved_quantity for row in rows)
+        # Stock held beyond the merged quantity goes back on sale
+        surplus = held - min(held, quantity)
+        if surplus:
+            Product.objects.filter(pk=keep.product_id, stock_available__isnull=False).update(
+                stock_available=F('stock_available') + surplus,
+                stock_reserved=F('stock_reserved') - surplus,
+            )
+        Cart.objects.filter(pk=keep.pk).update(quantity=quantity, reserved_quantity=held - surplus)
+        Cart.objects.filter(pk__in=[row.pk for row in rows[1:]]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_feedback_review_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='cart',
+            name='cart_user_product_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='cart_user_product_uniq'),
+        ),
+    ]
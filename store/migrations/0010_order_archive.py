@@ -0,0 +1,73 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+
+
+def count_orders(apps, schema_editor):
+    """Fill CustomerOrderStats from the orders placed so far"""
+    Order = apps.get_model('store', 'Order')
+    CustomerOrderStats = apps.get_model('store', 'CustomerOrderStats')
+    rows = Order.objects.order_by().values('user_id').annotate(
+        order_count=Count('id'),
+        lifetime_spend=Sum('total_amount', filter=~Q(order_status='Cancelled'), default=0),
+        last_order_at=Max('created_at'),
+    )
+    CustomerOrderStats.objects.bulk_create([CustomerOrderStats(**row) for row in rows], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('store', '0009_cart_unique_product'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('customer_name', models.CharField(max_length=150)),
+                ('order_status', models.CharField(max_length=20)),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('lines', models.JSONField(default=list)),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CustomerOrderStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='order_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('lifetime_spend', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('last_order_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'customer order stats',
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_user_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='archived_order_user_idx'),
+        ),
+        migrations.RunPython(count_orders, migrations.RunPython.noop),
+    ]
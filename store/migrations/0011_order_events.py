@@ -0,0 +1,52 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+STATUSES = ['Pending', 'Processing', 'Shipped', 'Delivered', 'Cancelled']
+
+
+def count_statuses(apps, schema_editor):
+    """One OrderStatusCount row per status, counting current and archived orders"""
+    counts = dict.fromkeys(STATUSES, 0)
+    for name in ('Order', 'ArchivedOrder'):
+        for row in apps.get_model('store', name).objects.order_by().values('order_status').annotate(n=Count('pk')):
+            counts[row['order_status']] = counts.get(row['order_status'], 0) + row['n']
+    OrderStatusCount = apps.get_model('store', 'OrderStatusCount')
+    OrderStatusCount.objects.bulk_create([OrderStatusCount(status=status, count=n) for status, n in counts.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_order_archive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStatusCount',
+            fields=[
+                ('status', models.CharField(max_length=20, primary_key=True, serialize=False)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OrderEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_id', models.BigIntegerField()),
+                ('from_status', models.CharField(max_length=20)),
+                ('to_status', models.CharField(max_length=20)),
+                ('note', models.CharField(blank=True, max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('actor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['order_id', 'id'], name='order_event_order_idx')],
+            },
+        ),
+        migrations.RunPython(count_statuses, migrations.RunPython.noop),
+    ]
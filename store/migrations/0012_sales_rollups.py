@@ -0,0 +1,50 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_order_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyCategorySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('average_rating', models.FloatField(default=0)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='store.category')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('average_rating', models.FloatField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='store.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'date'], name='product_sales_product_idx')],
+                'constraints': [models.UniqueConstraint(fields=('date', 'product'), name='daily_product_sales_uniq')],
+            },
+        ),
+    ]
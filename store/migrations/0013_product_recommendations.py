@@ -0,0 +1,40 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPair',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('customers', models.PositiveIntegerField(default=0)),
+                ('savers', models.PositiveIntegerField(default=0)),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.product')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('product', 'other'), name='product_pair_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='store.product')),
+                ('recommended', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('product', 'rank'), name='product_recommendation_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_product_recommendations'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='category',
+            name='slug',
+            field=models.SlugField(allow_unicode=True, max_length=100, unique=True),
+        ),
+    ]
@@ -1,6 +1,7 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.core.validators import RegexValidator, MinValueValidator, MaxValueValidator
+from django.utils.text import slugify
 
 class Registerpage(models.Model):
     username = models.CharField(max_length=150, unique=True)
@@ -18,15 +19,101 @@ class Registerpage(models.Model):
 #         return self.username
 
 
+def slugify_category(name):
+    """The slug for a category name, keeping non-ASCII letters ("Jóias", "鞋子"); '' if nothing is left"""
+    return slugify(name or '', allow_unicode=True)
+
+
+# Product categories; product_count is kept up to date by signals (see categories.py)
+class Category(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    slug = models.SlugField(max_length=100, unique=True, allow_unicode=True)
+    icon = models.CharField(max_length=8, blank=True, default='🛍️')
+    product_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        ordering = ['name']
+        verbose_name_plural = 'categories'
+
+    def save(self, *args, **kwargs):
+        if not self.slug:
+            self.slug = slugify_category(self.name) or self.name
+        super().save(*args, **kwargs)
+        if self.slug == self.name and not slugify_category(self.name):
+            # Nothing to slugify in the name ("★★★"): it held the slug until the id was known
+            self.slug = f'category-{self.pk}'
+            super().save(update_fields=['slug'])
+
+    def __str__(self):
+        return self.name
+
+
 # Store products
 class Product(models.Model):
+    # What the price engine reads and what it writes (see pricing.py)
+    PRICE_INPUTS = frozenset({'price', 'discount', 'category', 'category_id'})
+    PRICE_FIELDS = ('effective_price', 'tax_amount', 'promotion_amount')
+
+    # Natural key used by bulk import/export (see catalog_io.py)
+    sku = models.CharField(max_length=64, unique=True, blank=True, null=True)
     name = models.CharField(max_length=100)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     discount = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     image = models.ImageField(upload_to='products/', blank=True, null=True)
-    category = models.CharField(max_length=100, blank=True, null=True) 
+    # Resized/WebP/AVIF copies of `image` and their storage names, see images.py
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, blank=True, null=True, related_name='products')
     is_new = models.BooleanField(default=False)  
+    # Units that can still be sold (NULL = stock not tracked) and units held in carts, see inventory.py
+    stock_available = models.PositiveIntegerField(blank=True, null=True)
+    stock_reserved = models.PositiveIntegerField(default=0)
+
+    # Denormalized rating stats, kept in sync by Feedback signals (see signals.py)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    average_rating = models.FloatField(default=0)
+    star_1_count = models.PositiveIntegerField(default=0)
+    star_2_count = models.PositiveIntegerField(default=0)
+    star_3_count = models.PositiveIntegerField(default=0)
+    star_4_count = models.PositiveIntegerField(default=0)
+    star_5_count = models.PositiveIntegerField(default=0)
+
+    # What a unit actually costs after discount, promotion and tax, kept up to date by pricing.py
+    effective_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    tax_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    promotion_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-average_rating', '-id'], name='product_rating_idx'),
+            models.Index(fields=['effective_price', 'id'], name='product_price_idx'),
+            models.Index(fields=['category', '-id'], name='product_category_idx'),
+            models.Index(fields=['-id'], condition=models.Q(is_new=True), name='product_new_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so a category change can move the category counts (see signals.py)
+        instance._loaded_category_id = instance.__dict__.get('category_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and self.PRICE_INPUTS & set(update_fields):
+            # The pre_save signal reprices the product (signals.price_product); save what it sets too
+            kwargs['update_fields'] = {*update_fields, *self.PRICE_FIELDS}
+        super().save(*args, **kwargs)
+
+    @property
+    def rating_histogram(self):
+        """List of (stars, count) pairs from 5 stars down to 1"""
+        return [(stars, getattr(self, f'star_{stars}_count')) for stars in range(5, 0, -1)]
+
+    @property
+    def in_stock(self):
+        return self.stock_available is None or self.stock_available > 0
 
     @property
     def has_discount(self):
@@ -35,18 +122,18 @@ class Product(models.Model):
 
     @property
     def gst_amount(self):
-        """Fixed GST amount of ₹50"""
-        return 50.00
+        """Tax per unit from the active tax rules"""
+        return self.tax_amount
 
     @property
     def discounted_price(self):
-        """Calculate price after discount and GST: base price + GST - discount"""
-        return float(self.price) + self.gst_amount -float(self.discount)
+        """Price after discount, promotion and GST"""
+        return self.effective_price
 
     @property
     def final_price(self):
         """Final price including GST and discount"""
-        return self.discounted_price
+        return self.effective_price
 
     def __str__(self):
         return self.name
@@ -58,10 +145,17 @@ class Cart(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
     added_at = models.DateTimeField(auto_now_add=True)
+    # Stock held for this cart row until reserved_until (see inventory.py)
+    reserved_quantity = models.PositiveIntegerField(default=0)
+    reserved_until = models.DateTimeField(blank=True, null=True, db_index=True)
+
+    class Meta:
+        # One row per product, so a guest cart can be merged in with a single upsert (see guest_cart.py)
+        constraints = [models.UniqueConstraint(fields=['user', 'product'], name='cart_user_product_uniq')]
 
     @property
     def total_price(self):
-        return self.quantity * self.product.price
+        return self.quantity * self.product.effective_price
 
     def __str__(self):
         return f"{self.user.username} - {self.product.name} ({self.quantity})"
@@ -82,28 +176,148 @@ class Wishlist(models.Model):
 
 # Store orders
 class Order(models.Model):
+    # Which status may follow which is up to fulfilment.py
+    PENDING = 'Pending'
+    PROCESSING = 'Processing'
+    SHIPPED = 'Shipped'
+    DELIVERED = 'Delivered'
+    CANCELLED = 'Cancelled'
     ORDER_STATUS_CHOICES = [
-        ('Pending', 'Pending'),
-        ('Processing', 'Processing'),
-        ('Shipped', 'Shipped'),
-        ('Delivered', 'Delivered'),
-        ('Cancelled', 'Cancelled'),
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (SHIPPED, 'Shipped'),
+        (DELIVERED, 'Delivered'),
+        (CANCELLED, 'Cancelled'),
     ]
     
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    # Set for single-product "Buy Now" orders; cart checkouts list their products in OrderItem
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, blank=True, null=True)
     customer_name = models.CharField(max_length=150)
     email = models.EmailField()
     mobile = models.CharField(max_length=15, validators=[RegexValidator(r'^[0-9]{10,15}$', 'Mobile number must contain only numbers and be 10-15 digits long.')])
     address = models.TextField(blank=True, null=True)
-    order_status = models.CharField(max_length=20, choices=ORDER_STATUS_CHOICES, default='Pending')
+    order_status = models.CharField(max_length=20, choices=ORDER_STATUS_CHOICES, default=PENDING)
     quantity = models.PositiveIntegerField(default=1)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # The orders page is keyset-paginated on (created_at, id) per user (see orders.py)
+        indexes = [models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx')]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so a status change can enqueue its follow-up work (see signals.py)
+        instance._loaded_order_status = instance.__dict__.get('order_status')
+        return instance
+
+    def __str__(self):
+        if self.product_id:
+            return f"Order #{self.id} - {self.customer_name} - {self.product.name}"
+        return f"Order #{self.id} - {self.customer_name}"
+
+
+# Store the individual lines of an order
+class OrderItem(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(default=1)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)  # price at time of purchase
+    line_total = models.DecimalField(max_digits=10, decimal_places=2)
+
+    def __str__(self):
+        return f"Order #{self.order_id} - {self.product.name} ({self.quantity})"
+
+
+# Append-only log of order status changes (see fulfilment.py)
+class OrderEvent(models.Model):
+    # Not a ForeignKey: the log outlives orders moved to the archive
+    order_id = models.BigIntegerField()
+    from_status = models.CharField(max_length=20)
+    to_status = models.CharField(max_length=20)
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True)
+    note = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['order_id', 'id'], name='order_event_order_idx')]
+
+    def __str__(self):
+        return f"Order #{self.order_id}: {self.from_status} -> {self.to_status}"
+
+
+# Orders per status, archived ones included, kept up to date with every status change (see fulfilment.py)
+class OrderStatusCount(models.Model):
+    status = models.CharField(max_length=20, primary_key=True)
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.status}: {self.count}"
+
+
+# Finished orders moved out of Order/OrderItem by `manage.py archive_orders` (see orders.py)
+class ArchivedOrder(models.Model):
+    # The original Order id, so order numbers stay the same
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    customer_name = models.CharField(max_length=150)
+    order_status = models.CharField(max_length=20)
+    quantity = models.PositiveIntegerField(default=1)
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    # [{"product_id", "name", "quantity", "line_total"}], names as they were when archived
+    lines = models.JSONField(default=list)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', '-created_at', '-id'], name='archived_order_user_idx')]
+
+    def __str__(self):
+        return f"Archived order #{self.id} - {self.customer_name}"
+
+
+# Per-customer order totals, kept up to date by Order signals (see orders.py)
+class CustomerOrderStats(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='order_stats')
+    order_count = models.PositiveIntegerField(default=0)
+    # Cancelled orders don't count towards spend
+    lifetime_spend = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    last_order_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name_plural = 'customer order stats'
+
+    def __str__(self):
+        return f"{self.user} - {self.order_count} order(s)"
+
+
+# Tax applied per unit on top of the discounted price (see pricing.py)
+class TaxRule(models.Model):
+    name = models.CharField(max_length=100)
+    category = models.CharField(max_length=100, blank=True, help_text="Leave empty to apply to every category")
+    rate = models.DecimalField(max_digits=5, decimal_places=2, default=0, help_text="Percent of the discounted price")
+    flat_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0, help_text="Fixed amount per unit")
+    is_active = models.BooleanField(default=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.category or 'all categories'})"
+
+
+# Time-limited price reductions on top of the product discount (see pricing.py)
+class Promotion(models.Model):
+    name = models.CharField(max_length=100)
+    category = models.CharField(max_length=100, blank=True, help_text="Leave empty to apply to every category")
+    percent_off = models.DecimalField(max_digits=5, decimal_places=2, default=0)
+    amount_off = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    starts_at = models.DateTimeField(blank=True, null=True)
+    ends_at = models.DateTimeField(blank=True, null=True)
+    is_active = models.BooleanField(default=True)
+
     def __str__(self):
-        return f"Order #{self.id} - {self.customer_name} - {self.product.name}"
+        return self.name
 
 
 # Store product feedback/reviews
@@ -129,6 +343,126 @@ class Feedback(models.Model):
     class Meta:
         ordering = ['-created_at']
         unique_together = ('user', 'product')  # Prevent duplicate feedback from same user
+        # Review pages are keyset-paginated on (created_at, id) per product, optionally per rating (see reviews.py)
+        indexes = [
+            models.Index(fields=['product', '-created_at', '-id'], name='feedback_product_created_idx'),
+            models.Index(fields=['product', 'rating', '-created_at', '-id'], name='feedback_product_rating_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Run the insert and the post_save rating update in one transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Feedback by {self.user.username} for {self.product.name}"
+
+
+# Background work queued from requests and run by `manage.py runworker` (see taskqueue.py)
+class Task(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    # Enqueueing twice with the same key gives back the first task instead of a second one
+    idempotency_key = models.CharField(max_length=200, unique=True, blank=True, null=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    run_at = models.DateTimeField()
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    last_error = models.TextField(blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # The worker's poll: the next due tasks, oldest first
+            models.Index(fields=['run_at', 'id'], name='task_due_idx', condition=models.Q(status='queued')),
+            models.Index(fields=['locked_at'], name='task_running_idx', condition=models.Q(status='running')),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+
+# Daily sales facts rolled up from orders by `manage.py rollup_sales` (see analytics.py)
+class DailyProductSales(models.Model):
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    order_count = models.PositiveIntegerField(default=0)
+    # The product's average rating when the row was last rolled up
+    average_rating = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['date', 'product'], name='daily_product_sales_uniq')]
+        indexes = [models.Index(fields=['product', 'date'], name='product_sales_product_idx')]
+
+    def __str__(self):
+        return f"{self.date} - {self.product_id}: {self.units} unit(s)"
+
+
+class DailyCategorySales(models.Model):
+    date = models.DateField(db_index=True)
+    # NULL for products without a category
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, blank=True, null=True)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    order_count = models.PositiveIntegerField(default=0)
+    average_rating = models.FloatField(default=0)
+
+    def __str__(self):
+        return f"{self.date} - {self.category_id}: {self.units} unit(s)"
+
+
+# How far each incremental job has read its source table (see analytics.py)
+class Watermark(models.Model):
+    name = models.CharField(max_length=50, primary_key=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.last_id}"
+
+
+# "Customers also bought", computed offline by `manage.py refresh_recommendations` (see recommendations.py)
+class ProductPair(models.Model):
+    """One cell of the product co-occurrence matrix; product == other holds the product's own totals"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    # Customers who bought both
+    customers = models.PositiveIntegerField(default=0)
+    # Customers with both in their cart or wishlist right now
+    savers = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['product', 'other'], name='product_pair_uniq')]
+
+    def __str__(self):
+        return f"{self.product_id} & {self.other_id}: {self.customers} customer(s)"
+
+
+class ProductRecommendation(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        # Also the index pages read a product's list from, in rank order
+        constraints = [models.UniqueConstraint(fields=['product', 'rank'], name='product_recommendation_uniq')]
+
+    def __str__(self):
+        return f"{self.product_id} #{self.rank}: {self.recommended_id}"
@@ -0,0 +1,146 @@
+"""
+Order history: a hot window of recent orders and an archive of old ones.
+
+Order and OrderItem only have to hold the last ORDER_HOT_MONTHS of orders
+plus anything still in progress. `manage.py archive_orders` moves finished
+orders older than that into ArchivedOrder, one summary row per order with its
+lines as JSON, in batches. Both are read a page at a time, keyset-paginated
+on (created_at, id) off the per-user indexes, so an account with ten thousand
+orders opens as fast as one with ten.
+
+The counts and lifetime spend shown above the list come from
+CustomerOrderStats, updated by Order signals as orders are placed or
+cancelled, so the page never counts or sums orders. `archive_orders
+--rebuild-stats` recomputes them from both tables.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, F, Max, OuterRef, Prefetch, Q, Sum
+from django.utils import timezone
+
+from .models import ArchivedOrder, CustomerOrderStats, Order, OrderItem
+from .pagination import keyset_paginate
+from .shopping import order_rows
+
+HOT_MONTHS = getattr(settings, 'ORDER_HOT_MONTHS', 12)
+ORDERS_PER_PAGE = 20
+# (field, descending) for keyset_paginate
+ORDER_SORT = ('created_at', True)
+# Orders that won't change any more (see fulfilment.TRANSITIONS) and can be archived
+FINISHED_STATUSES = (Order.DELIVERED, Order.CANCELLED)
+
+
+def hot_cutoff(now=None):
+    """Orders placed before this are old enough to archive"""
+    return (now or timezone.now()) - timedelta(days=30 * HOT_MONTHS)
+
+
+# ---------------- READING ----------------
+def recent_orders(user, cursor=None):
+    """One KeysetPage of the user's orders still in Order, newest first"""
+    return keyset_paginate(order_rows(user), *ORDER_SORT, cursor, ORDERS_PER_PAGE)
+
+
+def archived_orders(user, cursor=None):
+    """One KeysetPage of the user's archived orders, newest first"""
+    return keyset_paginate(ArchivedOrder.objects.filter(user=user), *ORDER_SORT, cursor, ORDERS_PER_PAGE)
+
+
+def legacy_orders(orders):
+    """The orders among `orders` from before OrderItem, which hold their single product themselves"""
+    return orders.filter(product__isnull=False).exclude(Exists(OrderItem.objects.filter(order=OuterRef('pk'))))
+
+
+def order_stats(user):
+    """The user's CustomerOrderStats, or an unsaved zero row if they never ordered"""
+    return CustomerOrderStats.objects.filter(user=user).first() or CustomerOrderStats(user=user)
+
+
+# ---------------- STATS ----------------
+def record_order(order):
+    """Count a new order and its spend in one UPDATE (plus an INSERT for a customer's first order)"""
+    spend = 0 if order.order_status == Order.CANCELLED else order.total_amount
+    stats = CustomerOrderStats.objects.filter(user_id=order.user_id)
+    changes = {'order_count': F('order_count') + 1, 'lifetime_spend': F('lifetime_spend') + spend,
+               'last_order_at': order.created_at}
+    if not stats.update(**changes):
+        CustomerOrderStats.objects.get_or_create(user_id=order.user_id)
+        stats.update(**changes)
+
+
+def adjust_spend(user_id, amount):
+    """Add `amount` (negative on cancellation) to the user's lifetime spend"""
+    CustomerOrderStats.objects.filter(user_id=user_id).update(lifetime_spend=F('lifetime_spend') + amount)
+
+
+def _totals(queryset):
+    return queryset.order_by().values('user_id').annotate(
+        order_count=Count('id'),
+        lifetime_spend=Sum('total_amount', filter=~Q(order_status=Order.CANCELLED), default=0),
+        last_order_at=Max('created_at'),
+    )
+
+
+def rebuild_order_stats():
+    """Recompute every CustomerOrderStats row from Order and ArchivedOrder. Returns the number of customers."""
+    stats = {}
+    for row in [*_totals(Order.objects.all()), *_totals(ArchivedOrder.objects.all())]:
+        user_id = row.pop('user_id')
+        if user_id not in stats:
+            stats[user_id] = CustomerOrderStats(user_id=user_id, **row)
+            continue
+        current = stats[user_id]
+        current.order_count += row['order_count']
+        current.lifetime_spend += row['lifetime_spend']
+        current.last_order_at = max(current.last_order_at, row['last_order_at'])
+    with transaction.atomic():
+        CustomerOrderStats.objects.all().delete()
+        CustomerOrderStats.objects.bulk_create(stats.values(), batch_size=500)
+    return len(stats)
+
+
+# ---------------- ARCHIVING ----------------
+def _lines(order):
+    lines = [(line.product_id, line.product.name, line.quantity, line.line_total) for line in order.items.all()]
+    if not lines and order.product_id:
+        # A legacy order, see legacy_orders()
+        lines = [(order.product_id, order.product.name, order.quantity, order.total_amount)]
+    return [{'product_id': product_id, 'name': name, 'quantity': quantity, 'line_total': str(line_total)}
+            for product_id, name, quantity, line_total in lines]
+
+
+def _archived(order):
+    return ArchivedOrder(
+        id=order.pk,
+        user_id=order.user_id,
+        customer_name=order.customer_name,
+        order_status=order.order_status,
+        quantity=order.quantity,
+        total_amount=order.total_amount,
+        lines=_lines(order),
+        created_at=order.created_at,
+    )
+
+
+def archive_orders(before=None, batch_size=500):
+    """
+    Move finished orders placed before `before` (default: hot_cutoff()) into
+    ArchivedOrder, oldest first, one transaction per batch. Returns the number
+    of orders moved.
+    """
+    before = before or hot_cutoff()
+    lines = OrderItem.objects.select_related('product').only('order_id', 'quantity', 'line_total', 'product__name')
+    old = (Order.objects.filter(created_at__lt=before, order_status__in=FINISHED_STATUSES)
+           .select_related('product').prefetch_related(Prefetch('items', queryset=lines)).order_by('pk'))
+    moved = 0
+    while True:
+        with transaction.atomic():
+            batch = list(old[:batch_size])
+            if not batch:
+                return moved
+            ArchivedOrder.objects.bulk_create([_archived(order) for order in batch])
+            # Their OrderItems go with them (on_delete=CASCADE)
+            Order.objects.filter(pk__in=[order.pk for order in batch]).delete()
+        moved += len(batch)
@@ -0,0 +1,124 @@
+"""
+Keyset (cursor) pagination for product listings and review streams.
+
+Every sort order ends with the primary key, so (sort key, id) is unique and a
+page is fetched with `WHERE (key, id) < (last key, last id) ... LIMIT n` no
+matter how deep the user has scrolled, unlike OFFSET which re-reads every
+skipped row.
+"""
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+# sort name -> (field, descending). Ties are broken on id in the same direction.
+SORT_ORDERS = {
+    'newest': ('id', True),  # ids grow with insertion order
+    'price_asc': ('effective_price', False),  # what the customer pays, see pricing.py
+    'price_desc': ('effective_price', True),
+    'rating': ('average_rating', True),
+    'relevance': ('search_rank', True),  # only valid on search results
+}
+DEFAULT_SORT = 'newest'
+
+
+@dataclass
+class KeysetPage:
+    items: list
+    next_cursor: str = None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def _cursor_value(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def encode_cursor(values):
+    raw = json.dumps([_cursor_value(v) for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Returns the [key, id] pair stored in a cursor, or None if it is missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, binascii.Error):
+        return None
+    if not isinstance(values, list) or len(values) != 2 or not isinstance(values[1], int):
+        return None
+    return values
+
+
+def _order_by(field, descending):
+    prefix = '-' if descending else ''
+    if field == 'id':
+        return [f'{prefix}id']
+    return [f'{prefix}{field}', f'{prefix}id']
+
+
+def order_fields(sort):
+    return _order_by(*SORT_ORDERS[sort])
+
+
+def _after(queryset, field, descending, cursor):
+    """`queryset` ordered on (field, id), starting after `cursor`"""
+    queryset = queryset.order_by(*_order_by(field, descending))
+
+    after = decode_cursor(cursor)
+    if after is not None:
+        key, last_id = after
+        op = 'lt' if descending else 'gt'
+        try:
+            if field == 'id':
+                queryset = queryset.filter(**{f'id__{op}': last_id})
+            else:
+                queryset = queryset.filter(
+                    Q(**{f'{field}__{op}': key}) | Q(**{field: key, f'id__{op}': last_id})
+                )
+        except (TypeError, ValueError, ValidationError):
+            pass  # a tampered cursor just starts from the first page
+    return queryset
+
+
+def _page(items, field, page_size):
+    # One row past the page tells whether there is a next page
+    if len(items) <= page_size:
+        return KeysetPage(items)
+    items = items[:page_size]
+    last = items[-1]
+    return KeysetPage(items, encode_cursor([getattr(last, field), last.id]))
+
+
+def keyset_paginate(queryset, field, descending, cursor=None, page_size=24):
+    """Return one KeysetPage of `queryset` ordered on (field, id), starting after `cursor`"""
+    return _page(list(_after(queryset, field, descending, cursor)[:page_size + 1]), field, page_size)
+
+
+async def akeyset_paginate(queryset, field, descending, cursor=None, page_size=24):
+    """keyset_paginate() with the async ORM"""
+    items = [item async for item in _after(queryset, field, descending, cursor)[:page_size + 1]]
+    return _page(items, field, page_size)
+
+
+def paginate(queryset, sort, cursor=None, page_size=24):
+    """Return one KeysetPage of `queryset` in `sort` order, starting after `cursor`"""
+    return keyset_paginate(queryset, *SORT_ORDERS[sort], cursor, page_size)
+
+
+async def apaginate(queryset, sort, cursor=None, page_size=24):
+    """paginate() with the async ORM"""
+    return await akeyset_paginate(queryset, *SORT_ORDERS[sort], cursor, page_size)
@@ -0,0 +1,182 @@
+"""
+Price engine.
+
+A unit of a product costs
+
+    net = price - discount - best promotion     (never below 0)
+    effective_price = net + flat tax + net * tax rate
+
+in exact Decimals, rounded half-up to paise. The result is stored on the
+product (effective_price, tax_amount, promotion_amount) so listings can
+filter and sort on it in SQL and the cart, Buy Now and checkout all charge the
+same number.
+
+Tax rules and promotions apply to one category (matched on its slug, so
+"T-Shirts" and "t-shirts" are the same) or, with an empty category, to all
+of them. A category's own tax rules replace the global ones; with no rules at
+all, settings.PRICING_DEFAULT_FLAT_TAX (the original ₹50 GST) applies. Only the single best promotion is used; they don't
+stack.
+
+Prices are recomputed when a product is saved (pre_save signal, with the
+rules cached until one changes), and for every product by the task queue
+worker when a rule changes (tasks.recompute_prices). Promotions start and end
+by the clock, so run `manage.py recompute_prices` from cron (e.g. every few
+minutes) as well.
+"""
+from dataclasses import dataclass, field
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import get_or_set_price_rules, invalidate_products
+from .models import Category, Product, Promotion, TaxRule, slugify_category
+
+CENTS = Decimal('0.01')
+ZERO = Decimal('0.00')
+PRICE_FIELDS = list(Product.PRICE_FIELDS)
+
+
+def _money(value):
+    return value.quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+@dataclass
+class PriceRules:
+    """Active tax rules and promotions, grouped by category slug ('' = all)"""
+    taxes: dict = field(default_factory=dict)
+    promotions: dict = field(default_factory=dict)
+    category_slugs: dict = field(default_factory=dict)  # Category id -> slug
+    default_flat_tax: Decimal = ZERO
+
+    def taxes_for(self, category_id):
+        slug = self.category_slugs.get(category_id, '')
+        if slug and slug in self.taxes:
+            return self.taxes[slug]
+        return self.taxes.get('', [])
+
+    def promotions_for(self, category_id):
+        slug = self.category_slugs.get(category_id, '')
+        return self.promotions.get('', []) + (self.promotions.get(slug, []) if slug else [])
+
+
+def _rule_rows():
+    """Categories, active tax rules and active promotions (whenever they run), in three small queries"""
+    return (list(Category.objects.values_list('pk', 'name', 'slug')), list(TaxRule.objects.filter(is_active=True)),
+            list(Promotion.objects.filter(is_active=True)))
+
+
+def _rule_key(category, slugs_by_name):
+    """The slug of the category a rule names ('' = all). Names with nothing to slugify are looked up by name."""
+    category = category.strip()
+    if not category:
+        return ''
+    return slugify_category(category) or slugs_by_name.get(category.lower(), category)
+
+
+def _running(promotion, now):
+    return (promotion.starts_at is None or promotion.starts_at <= now) and (
+        promotion.ends_at is None or promotion.ends_at > now)
+
+
+def load_rules(now=None, cached=True):
+    """
+    The rules in force at `now`. They come from the cache until a rule or
+    category changes, so repricing a saved product costs no queries;
+    cached=False reads the tables.
+    """
+    now = now or timezone.now()
+    categories, taxes, promotions = get_or_set_price_rules(_rule_rows) if cached else _rule_rows()
+    slugs_by_name = {name.lower(): slug for _, name, slug in categories}
+    rules = PriceRules(
+        category_slugs={pk: slug for pk, _, slug in categories},
+        default_flat_tax=Decimal(str(getattr(settings, 'PRICING_DEFAULT_FLAT_TAX', '50.00'))),
+    )
+    for rule in taxes:
+        rules.taxes.setdefault(_rule_key(rule.category, slugs_by_name), []).append(rule)
+    if not rules.taxes:
+        rules.taxes[''] = [TaxRule(name='Default GST', flat_amount=rules.default_flat_tax)]
+    for promotion in promotions:
+        if _running(promotion, now):
+            rules.promotions.setdefault(_rule_key(promotion.category, slugs_by_name), []).append(promotion)
+    return rules
+
+
+def compute_price(product, rules):
+    """(effective_price, tax_amount, promotion_amount) for one product"""
+    base = max(product.price - product.discount, ZERO)
+    promotion = ZERO
+    for promo in rules.promotions_for(product.category_id):
+        promotion = max(promotion, base * promo.percent_off / 100 + promo.amount_off)
+    promotion = _money(min(promotion, base))
+    net = base - promotion
+
+    tax = ZERO
+    for rule in rules.taxes_for(product.category_id):
+        tax += rule.flat_amount + net * rule.rate / 100
+    tax = _money(tax)
+    return net + tax, tax, promotion
+
+
+def apply_prices(products, rules=None):
+    """
+    Set the price fields on `products` (unsaved) in one pass. Returns the ones
+    whose price changed.
+    """
+    rules = rules or load_rules()
+    changed = []
+    for product in products:
+        # Unsaved model instances may still hold the raw input, e.g. from forms
+        product.price = Decimal(str(product.price))
+        product.discount = Decimal(str(product.discount or 0))
+        prices = compute_price(product, rules)
+        if prices != tuple(getattr(product, name) for name in PRICE_FIELDS):
+            for name, value in zip(PRICE_FIELDS, prices):
+                setattr(product, name, value)
+            changed.append(product)
+    return changed
+
+
+def recompute_prices(product_ids=None, batch_size=1000):
+    """Recompute stored prices (all products, or just `product_ids`). Returns the number that changed."""
+    rules = load_rules(cached=False)
+    products = Product.objects.only('pk', 'price', 'discount', 'category_id', *PRICE_FIELDS).order_by('pk')
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+
+    updated = 0
+    last_pk = 0
+    while True:
+        batch = list(products.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return updated
+        last_pk = batch[-1].pk
+        changed = apply_prices(batch, rules)
+        if changed:
+            with transaction.atomic():
+                Product.objects.bulk_update(changed, PRICE_FIELDS)
+                ids = [p.pk for p in changed]
+                transaction.on_commit(lambda ids=ids: invalidate_products(ids))
+            updated += len(changed)
+
+
+# ---------------- CARTS ----------------
+@dataclass(frozen=True)
+class CartTotals:
+    items: int
+    subtotal: Decimal  # at list price
+    discount: Decimal  # product discounts and promotions
+    tax: Decimal
+    total: Decimal  # what checkout charges: subtotal - discount + tax
+
+
+def cart_totals(cart_items):
+    """Totals for cart rows with their products loaded, in one pass and no queries"""
+    items, subtotal, tax, total = 0, ZERO, ZERO, ZERO
+    for item in cart_items:
+        items += item.quantity
+        subtotal += item.product.price * item.quantity
+        tax += item.product.tax_amount * item.quantity
+        total += item.product.effective_price * item.quantity
+    return CartTotals(items=items, subtotal=subtotal, discount=subtotal - (total - tax), tax=tax, total=total)
@@ -0,0 +1,66 @@
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Cast
+
+from .models import Feedback, Product
+
+STARS = range(1, 6)
+
+
+def apply_rating(product_id, rating, delta=1):
+    """Add (delta=1) or remove (delta=-1) a single rating from a product's stats in one UPDATE"""
+    new_count = F('rating_count') + delta
+    new_sum = F('rating_sum') + delta * rating
+    Product.objects.filter(pk=product_id).update(
+        rating_count=new_count,
+        rating_sum=new_sum,
+        average_rating=Case(
+            When(rating_count=-delta, then=Value(0.0)),
+            default=Cast(new_sum, FloatField()) / new_count,
+            output_field=FloatField(),
+        ),
+        **{f'star_{rating}_count': F(f'star_{rating}_count') + delta},
+    )
+
+
+def rating_stats(product_ids=None):
+    """Aggregate rating stats straight from Feedback, keyed by product id"""
+    feedback = Feedback.objects.order_by()
+    if product_ids is not None:
+        feedback = feedback.filter(product_id__in=product_ids)
+    rows = feedback.values('product_id').annotate(
+        rating_count=Count('id'),
+        rating_sum=Sum('rating'),
+        **{f'star_{stars}_count': Count('id', filter=Q(rating=stars)) for stars in STARS},
+    )
+    return {row.pop('product_id'): row for row in rows}
+
+
+def rebuild_ratings(product_ids=None, batch_size=500):
+    """Recompute rating stats for the given products (or all of them). Returns rows updated."""
+    fields = ['rating_count', 'rating_sum', 'average_rating'] + [f'star_{stars}_count' for stars in STARS]
+    products = Product.objects.order_by('pk').only('pk', *fields)
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+
+    stats = rating_stats(product_ids)
+    batch = []
+    updated = 0
+    for product in products.iterator(chunk_size=batch_size):
+        row = stats.get(product.pk, {})
+        product.rating_count = row.get('rating_count', 0)
+        product.rating_sum = row.get('rating_sum', 0)
+        product.average_rating = product.rating_sum / product.rating_count if product.rating_count else 0
+        for stars in STARS:
+            setattr(product, f'star_{stars}_count', row.get(f'star_{stars}_count', 0))
+        batch.append(product)
+        if len(batch) >= batch_size:
+            with transaction.atomic():
+                Product.objects.bulk_update(batch, fields)
+            updated += len(batch)
+            batch = []
+    if batch:
+        with transaction.atomic():
+            Product.objects.bulk_update(batch, fields)
+        updated += len(batch)
+    return updated
@@ -0,0 +1,253 @@
+"""
+"Customers also bought": item-to-item recommendations computed offline.
+
+`manage.py refresh_recommendations` (from cron) maintains ProductPair, a
+sparse co-occurrence matrix over products, and from it each product's top
+NEIGHBORS ProductRecommendations:
+
+- customers: how many customers bought both. Read incrementally from
+  OrderItem past the 'recs:orders' watermark: a customer's new products are
+  paired with each other and with everything they bought before, so a
+  customer counts once per pair however often they reorder. Lines of orders
+  younger than SETTLE_TIME wait for the next run (see watermarks.py).
+  Legacy orders without lines (orders.legacy_orders()) are read the same
+  way past 'recs:legacy-orders', on Order ids. Cancelled orders count too,
+  they show the same interest.
+- savers: how many customers have both in their cart or wishlist right now.
+  Carts and wishlists change in place, so these are counted again in full
+  each run and only the pairs whose count moved are written.
+
+A product paired with itself holds its own totals. B's score for A is the
+cosine similarity weight(A, B) / sqrt(weight(A) * weight(B)), a saved
+product weighing SAVED_WEIGHT of a purchase. Only products whose pairs
+changed get their lists rebuilt; `--full` rebuilds them all.
+
+Pages read a product's list with one query off the (product, rank) index.
+The counting uses SciPy sparse matrices (Xᵀ·X) when SciPy is installed and
+plain Python otherwise, with the same results.
+"""
+import math
+import operator
+from collections import Counter, defaultdict
+from datetime import timedelta
+from functools import reduce
+from itertools import chain
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .cache import invalidate_products, invalidate_recommendations
+from . import watermarks
+from .models import ArchivedOrder, Cart, Order, OrderItem, ProductPair, ProductRecommendation, Wishlist
+from .orders import legacy_orders
+
+try:
+    from scipy import sparse
+except ImportError:  # optional, see _pair_counts()
+    sparse = None
+
+ORDERS_WATERMARK = 'recs:orders'
+LEGACY_WATERMARK = 'recs:legacy-orders'
+NEIGHBORS = 8
+SAVED_WEIGHT = 0.5
+BATCH_SIZE = 5000
+# Products whose lists are rebuilt per transaction
+REBUILD_BATCH = 500
+# How far back a customer's orders count towards the home page's picks
+RECENT_DAYS = 90
+
+
+# ---------------- COUNTING ----------------
+def _pair_counts(baskets):
+    """
+    Counter {(a, b): customers} to add to the matrix, from one (before, new)
+    pair of product id sets per customer: new × (before ∪ new) and before × new.
+    `new` must not overlap `before`.
+    """
+    if sparse is not None and baskets:
+        ids = sorted(set().union(*(before | new for before, new in baskets)))
+        column = {product_id: i for i, product_id in enumerate(ids)}
+
+        def matrix(part):
+            rows, columns = [], []
+            for row, basket in enumerate(baskets):
+                for product_id in basket[part]:
+                    rows.append(row)
+                    columns.append(column[product_id])
+            return sparse.csr_matrix(([1] * len(rows), (rows, columns)), shape=(len(baskets), len(ids)))
+
+        before, new = matrix(0), matrix(1)
+        delta = (new.T @ (before + new) + before.T @ new).tocoo()
+        return Counter({(ids[a], ids[b]): int(n) for a, b, n in zip(delta.row, delta.col, delta.data)})
+    counts = Counter()
+    for before, new in baskets:
+        for a in new:
+            for b in new:
+                counts[a, b] += 1
+            for b in before:
+                counts[a, b] += 1
+                counts[b, a] += 1
+    return counts
+
+
+def _write_pairs(counts, field):
+    """Add `counts` to `field` of the matching ProductPairs, creating missing ones"""
+    products = {a for a, _ in counts}
+    existing = {(pair.product_id, pair.other_id): pair
+                for pair in ProductPair.objects.filter(product__in=products, other__in={b for _, b in counts})}
+    created, updated = [], []
+    for (a, b), n in counts.items():
+        pair = existing.get((a, b))
+        if pair is None:
+            pair = ProductPair(product_id=a, other_id=b)
+            created.append(pair)
+        else:
+            updated.append(pair)
+        setattr(pair, field, getattr(pair, field) + n)
+    ProductPair.objects.bulk_create(created, batch_size=1000)
+    ProductPair.objects.bulk_update(updated, [field], batch_size=1000)
+    ProductPair.objects.filter(product__in=products, customers=0, savers=0).delete()
+    return products
+
+
+def _purchases(items, orders):
+    """{user_id: {product_id}} for OrderItem rows `items` and the legacy orders among `orders`"""
+    bought = defaultdict(set)
+    for user_id, product_id in chain(items.values_list('order__user_id', 'product_id'),
+                                     legacy_orders(orders).values_list('user_id', 'product_id')):
+        bought[user_id].add(product_id)
+    return bought
+
+
+def _count_orders(batch_size, now):
+    """Pair up the next batch of settled purchases. Returns the products touched, or None once caught up."""
+    with transaction.atomic():
+        items, legacy = watermarks.lock(ORDERS_WATERMARK, LEGACY_WATERMARK)
+        batch = watermarks.next_batch(items, legacy, batch_size, now)
+        if batch is None:
+            return None
+        items_upto, orders_upto = batch
+        bought = _purchases(OrderItem.objects.filter(pk__gt=items.last_id, pk__lte=items_upto),
+                            Order.objects.filter(pk__gt=legacy.last_id, pk__lte=orders_upto))
+        before = _purchases(OrderItem.objects.filter(pk__lte=items.last_id, order__user__in=bought),
+                            Order.objects.filter(pk__lte=legacy.last_id, user__in=bought))
+        for user_id, lines in ArchivedOrder.objects.filter(user__in=bought).values_list('user_id', 'lines'):
+            before[user_id].update(line['product_id'] for line in lines)
+        baskets = [(before[user_id], products - before[user_id]) for user_id, products in bought.items()]
+        touched = _write_pairs(_pair_counts(baskets), 'customers')
+        watermarks.advance(items, legacy, batch)
+    return touched
+
+
+def _count_saved():
+    """Recount every pair's savers from carts and wishlists, writing only the changes. Returns the products touched."""
+    saved = defaultdict(set)
+    for model in (Cart, Wishlist):
+        for user_id, product_id in model.objects.values_list('user_id', 'product_id'):
+            saved[user_id].add(product_id)
+    counts = _pair_counts([(set(), products) for products in saved.values()])
+    with transaction.atomic():
+        current = {(a, b): n for a, b, n in
+                   ProductPair.objects.filter(savers__gt=0).values_list('product_id', 'other_id', 'savers')}
+        changes = Counter({key: counts.get(key, 0) - current.get(key, 0) for key in counts.keys() | current.keys()})
+        changes = Counter({key: n for key, n in changes.items() if n})
+        return _write_pairs(changes, 'savers') if changes else set()
+
+
+# ---------------- NEIGHBORS ----------------
+def _weight(customers, savers):
+    return customers + SAVED_WEIGHT * savers
+
+
+def _rebuild(product_ids):
+    """Replace the recommendation lists of `product_ids` from their ProductPairs"""
+    with transaction.atomic():
+        pairs = list(ProductPair.objects.filter(product__in=product_ids).exclude(other=F('product'))
+                     .values_list('product_id', 'other_id', 'customers', 'savers'))
+        involved = {*product_ids, *(other_id for _, other_id, _, _ in pairs)}
+        totals = {product_id: _weight(customers, savers) for product_id, customers, savers in
+                  ProductPair.objects.filter(product=F('other'), product__in=involved)
+                  .values_list('product_id', 'customers', 'savers')}
+        scored = defaultdict(list)
+        for product_id, other_id, customers, savers in pairs:
+            norm = math.sqrt(totals.get(product_id, 0) * totals.get(other_id, 0))
+            if norm:
+                scored[product_id].append((-_weight(customers, savers) / norm, other_id))
+        ProductRecommendation.objects.filter(product__in=product_ids).delete()
+        ProductRecommendation.objects.bulk_create([
+            ProductRecommendation(product_id=product_id, recommended_id=other_id, rank=rank, score=round(-score, 4))
+            for product_id, neighbors in scored.items()
+            for rank, (score, other_id) in enumerate(sorted(neighbors)[:NEIGHBORS], 1)
+        ], batch_size=1000)
+
+
+def refresh_recommendations(batch_size=BATCH_SIZE, full=False, now=None):
+    """
+    Count new orders and the current carts and wishlists into ProductPair,
+    then rebuild the lists of the products that changed (every product's
+    with full=True). Returns the number of products rebuilt.
+    """
+    now = now or timezone.now()
+    touched = _count_saved()
+    while True:
+        batch = _count_orders(batch_size, now)
+        if batch is None:
+            break
+        touched |= batch
+    if full:
+        touched = set(ProductPair.objects.filter(product=F('other')).values_list('product_id', flat=True))
+        touched |= set(ProductRecommendation.objects.values_list('product_id', flat=True).distinct())
+    touched = sorted(touched)
+    for start in range(0, len(touched), REBUILD_BATCH):
+        _rebuild(touched[start:start + REBUILD_BATCH])
+    if touched:
+        # Product pages show the lists and are cached per product version; the home page's ETag has its own
+        invalidate_products(touched)
+        invalidate_recommendations()
+    return len(touched)
+
+
+# ---------------- READING ----------------
+def _recommended(rows):
+    return rows.select_related('recommended__category').order_by('rank')
+
+
+def _also_bought_rows(product_id, limit):
+    return _recommended(ProductRecommendation.objects.filter(product_id=product_id))[:limit]
+
+
+def also_bought(product_id, limit=NEIGHBORS):
+    """The products recommended alongside `product_id`, best first, in one query"""
+    return [row.recommended for row in _also_bought_rows(product_id, limit)]
+
+
+async def aalso_bought(product_id, limit=NEIGHBORS):
+    """also_bought() with the async ORM"""
+    return [row.recommended async for row in _also_bought_rows(product_id, limit)]
+
+
+def recommended_for(user, limit=4):
+    """
+    Picks for the home page from the neighbors of what `user` has in their
+    cart or wishlist or ordered in the last RECENT_DAYS, leaving those out.
+    One query; empty for guests and customers without history.
+    """
+    if not user.is_authenticated:
+        return []
+    recent = timezone.now() - timedelta(days=RECENT_DAYS)
+    saved = [Cart.objects.filter(user=user).values('product'), Wishlist.objects.filter(user=user).values('product')]
+    # Order.product covers legacy orders without lines (and Buy Now orders, which have both)
+    ordered = [OrderItem.objects.filter(order__user=user), Order.objects.filter(user=user, product__isnull=False)]
+    seeds = [*saved, ordered[0].filter(order__created_at__gte=recent).values('product'),
+             ordered[1].filter(created_at__gte=recent).values('product')]
+    owned = [*saved, *(orders.values('product') for orders in ordered)]
+    seeds = reduce(operator.or_, (Q(product__in=products) for products in seeds))
+    owned = reduce(operator.or_, (Q(recommended__in=products) for products in owned))
+    rows = _recommended(ProductRecommendation.objects.filter(seeds).exclude(owned)).order_by('rank', '-score')
+    picks = {}
+    for row in rows[:limit * NEIGHBORS]:
+        picks.setdefault(row.recommended_id, row.recommended)
+        if len(picks) == limit:
+            break
+    return list(picks.values())
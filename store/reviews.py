@@ -0,0 +1,52 @@
+"""
+Product reviews (Feedback) a page at a time, newest first.
+
+The product page inlines the first page and the rest stream in from the
+product_reviews endpoint (HTML fragment or JSON), so the page costs the same
+for a product with five reviews as for one with fifty thousand. Pages are
+keyset-paginated on (created_at, id), optionally narrowed to one star rating;
+both orders are read straight off the per-product indexes on Feedback.
+"""
+from .models import Feedback
+from .pagination import akeyset_paginate, keyset_paginate
+from .ratings import STARS
+
+REVIEWS_PER_PAGE = 10
+# (field, descending) for keyset_paginate
+REVIEW_ORDER = ('created_at', True)
+
+
+def parse_rating(value):
+    """The star rating filter from a query string value, or None for all reviews"""
+    try:
+        rating = int(value)
+    except (TypeError, ValueError):
+        return None
+    return rating if rating in STARS else None
+
+
+def review_queryset(product_id, rating=None):
+    reviews = Feedback.objects.filter(product_id=product_id).select_related('user')
+    if rating is not None:
+        reviews = reviews.filter(rating=rating)
+    return reviews
+
+
+def review_page(product_id, rating=None, cursor=None):
+    """One KeysetPage of a product's reviews"""
+    return keyset_paginate(review_queryset(product_id, rating), *REVIEW_ORDER, cursor, REVIEWS_PER_PAGE)
+
+
+async def areview_page(product_id, rating=None, cursor=None):
+    """review_page() with the async ORM"""
+    return await akeyset_paginate(review_queryset(product_id, rating), *REVIEW_ORDER, cursor, REVIEWS_PER_PAGE)
+
+
+def review_json(feedback):
+    return {
+        'id': feedback.id,
+        'user': feedback.user.username,
+        'rating': feedback.rating,
+        'comment': feedback.comment,
+        'created_at': feedback.created_at.isoformat(),
+    }
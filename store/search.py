@@ -0,0 +1,253 @@
+"""
+Full-text product search.
+
+Products are indexed into a side table that the database can search without
+scanning every description:
+
+- SQLite: an FTS5 virtual table using the porter stemmer, joined to the
+  products and ranked on its weighted bm25() rank column
+- PostgreSQL: a weighted tsvector column with a GIN index, ranked with ts_rank_cd()
+- anything else: the old icontains lookups
+
+The index is created after `migrate`, and filled from the product table if
+it is empty (a store upgraded from before search existed). From then on it is
+updated incrementally from Product post_save/post_delete signals (not for
+fixtures, which are loaded raw) and can be rebuilt with
+`manage.py rebuild_search_index`.
+"""
+import re
+from functools import lru_cache
+
+from django.db import connection
+from django.db.models import F, FloatField, Q
+from django.db.models.expressions import RawSQL
+
+from .models import Category, Product
+
+MAX_QUERY_TERMS = 8
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+STOP_WORDS = frozenset("""
+a an and are as at be by for from in is it of on or the to with
+""".split())
+
+
+def tokenize(text):
+    """Split user input into lowercase search terms, dropping stop words and FTS syntax"""
+    terms = [t for t in TOKEN_RE.findall((text or '').lower()) if t not in STOP_WORDS]
+    return terms[:MAX_QUERY_TERMS]
+
+
+def _product_table():
+    return connection.ops.quote_name(Product._meta.db_table)
+
+
+def _documents(products):
+    """(id, name, description, category name) rows for the index, with one query for the category names"""
+    products = list(products)
+    names = dict(Category.objects.filter(pk__in={p.category_id for p in products if p.category_id})
+                 .values_list('pk', 'name'))
+    return [(p.pk, p.name or '', p.description or '', names.get(p.category_id, '')) for p in products]
+
+
+def _rebuild_select():
+    """SELECT of (id, name, description, category name) for every product"""
+    category_table = connection.ops.quote_name(Category._meta.db_table)
+    return (f"SELECT p.id, p.name, p.description, COALESCE(c.name, '') FROM {_product_table()} p "
+            f"LEFT JOIN {category_table} c ON c.id = p.category_id")
+
+
+class LikeSearchBackend:
+    """Fallback for databases without a full-text engine"""
+
+    def ensure_index(self):
+        pass
+
+    def is_empty(self):
+        return False
+
+    def index(self, products):
+        pass
+
+    def remove(self, product_ids):
+        pass
+
+    def rebuild(self):
+        return 0
+
+    def search(self, queryset, terms):
+        for term in terms:
+            queryset = queryset.filter(
+                Q(name__icontains=term) | Q(description__icontains=term) | Q(category__name__icontains=term)
+            )
+        return queryset.annotate(search_rank=F('average_rating'))
+
+
+class SQLiteSearchBackend:
+    table = 'store_product_fts'
+    # bm25 column weights: name, description, category
+    weights = (10.0, 1.0, 5.0)
+
+    def ensure_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} "
+                "USING fts5(name, description, category, tokenize='porter unicode61')"
+            )
+
+    def is_empty(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT 1 FROM {self.table} LIMIT 1")
+            return cursor.fetchone() is None
+
+    def index(self, products):
+        rows = _documents(products)
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.table} WHERE rowid = %s", [(row[0],) for row in rows])
+            cursor.executemany(
+                f"INSERT INTO {self.table} (rowid, name, description, category) VALUES (%s, %s, %s, %s)", rows
+            )
+
+    def remove(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.table} WHERE rowid = %s", [(pk,) for pk in product_ids])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+            cursor.execute(
+                f"INSERT INTO {self.table} (rowid, name, description, category) {_rebuild_select()}"
+            )
+            return cursor.rowcount
+
+    def match_expression(self, terms):
+        # Quote every term so user input can't inject FTS5 operators; the last
+        # term is a prefix match so results show up while the user is typing.
+        quoted = [f'"{term}"' for term in terms]
+        quoted[-1] += '*'
+        return ' AND '.join(quoted)
+
+    def search(self, queryset, terms):
+        # One join against the FTS table: MATCH finds the rows and its rank
+        # column scores them with the weighted bm25(), so each search is one
+        # FTS query however many products match. extra() is the only way the
+        # ORM joins a table that has no model.
+        weights = ', '.join(str(w) for w in self.weights)
+        return queryset.extra(
+            tables=[self.table],
+            where=[f"{self.table}.rowid = {_product_table()}.id",
+                   f"{self.table} MATCH %s", f"{self.table}.rank MATCH %s"],
+            params=[self.match_expression(terms), f'bm25({weights})'],
+        ).annotate(search_rank=RawSQL(f"-{self.table}.rank", (), output_field=FloatField()))
+
+
+class PostgresSearchBackend:
+    table = 'store_product_search'
+    document_sql = (
+        "setweight(to_tsvector('english', %s), 'A') || "
+        "setweight(to_tsvector('english', %s), 'C') || "
+        "setweight(to_tsvector('english', %s), 'B')"
+    )
+
+    def ensure_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                f"product_id bigint PRIMARY KEY REFERENCES {_product_table()} (id) ON DELETE CASCADE, "
+                "document tsvector NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_document_gin ON {self.table} USING gin (document)"
+            )
+
+    def is_empty(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT 1 FROM {self.table} LIMIT 1")
+            return cursor.fetchone() is None
+
+    def index(self, products):
+        rows = _documents(products)
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {self.table} (product_id, document) VALUES (%s, {self.document_sql}) "
+                "ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+                rows,
+            )
+
+    def remove(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE product_id = ANY(%s)", [list(product_ids)])
+
+    def rebuild(self):
+        document = self.document_sql % ('d.name', 'd.description', 'd.category')
+        with connection.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {self.table}")
+            cursor.execute(
+                f"INSERT INTO {self.table} (product_id, document) "
+                f"SELECT d.id, {document} FROM ({_rebuild_select()}) AS d (id, name, description, category)"
+            )
+            return cursor.rowcount
+
+    def tsquery(self, terms):
+        return ' & '.join(terms[:-1] + [terms[-1] + ':*'])
+
+    def search(self, queryset, terms):
+        tsquery = self.tsquery(terms)
+        return queryset.filter(pk__in=RawSQL(
+            f"SELECT product_id FROM {self.table} WHERE document @@ to_tsquery('english', %s)", (tsquery,)
+        )).annotate(search_rank=RawSQL(
+            # Normalization 1 divides by 1 + log(document length), the closest
+            # ts_rank_cd gets to BM25's length normalization.
+            f"SELECT ts_rank_cd(document, to_tsquery('english', %s), 1) FROM {self.table} "
+            f"WHERE product_id = {_product_table()}.id",
+            (tsquery,),
+            output_field=FloatField(),
+        ))
+
+
+@lru_cache(maxsize=None)
+def _sqlite_has_fts5():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def get_backend():
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    if connection.vendor == 'sqlite' and _sqlite_has_fts5():
+        return SQLiteSearchBackend()
+    return LikeSearchBackend()
+
+
+def search_products(queryset, query):
+    """Filter a Product queryset to full-text matches for `query`, best matches first"""
+    terms = tokenize(query)
+    if not terms:
+        return queryset.none()
+    return get_backend().search(queryset, terms).order_by('-search_rank', '-id')
+
+
+def index_products(products):
+    get_backend().index(products)
+
+
+def remove_products(product_ids):
+    get_backend().remove(product_ids)
+
+
+def rebuild_search_index():
+    backend = get_backend()
+    backend.ensure_index()
+    return backend.rebuild()
+
+
+def ensure_search_index():
+    """Create the index if it doesn't exist and fill it if it is empty"""
+    backend = get_backend()
+    backend.ensure_index()
+    if backend.is_empty():
+        backend.rebuild()
@@ -0,0 +1,225 @@
+"""
+Benchmark the storefront behind real servers: the sync views under gunicorn
+(the WSGI deployment) against the async views under uvicorn (asgi.py), with
+the same catalog, the same number of worker processes and the same load.
+Run it with `manage.py benchmark_servers`.
+
+The load is two groups of concurrent connections on 127.0.0.1:
+
+- fast clients request catalog pages back to back and are measured
+- slow clients (phones on a bad network) trickle each request out in
+  SLOW_CHUNKS pieces and read the response a few KB at a time
+
+A sync worker is tied up for as long as its client takes to send the request,
+so slow clients eat into the capacity left for everyone else; an ASGI server
+only parks the socket. Each request opens its own connection
+(`Connection: close`) so both servers see the same traffic.
+"""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from importlib import import_module
+from urllib.parse import urlsplit, urlunsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.db import connection
+from django.urls import reverse
+
+from .metrics import percentile
+
+SERVERS = ('wsgi', 'asgi')
+SLOW_CHUNKS = 8
+READ_SIZE = 4096
+REQUEST_TIMEOUT = 30
+STARTUP_TIMEOUT = 30
+
+
+def server_command(server, port, workers):
+    if server == 'wsgi':
+        return [sys.executable, '-m', 'gunicorn', 'ecommerce_site.wsgi:application', '--bind', f'127.0.0.1:{port}',
+                '--workers', str(workers), '--log-level', 'warning']
+    return [sys.executable, '-m', 'uvicorn', 'ecommerce_site.asgi:application', '--host', '127.0.0.1',
+            '--port', str(port), '--workers', str(workers), '--log-level', 'warning', '--no-access-log']
+
+
+def missing_servers(servers):
+    """The servers whose package isn't installed"""
+    modules = {'wsgi': 'gunicorn', 'asgi': 'uvicorn'}
+    missing = []
+    for server in servers:
+        try:
+            import_module(modules[server])
+        except ImportError:
+            missing.append(modules[server])
+    return missing
+
+
+def database_url():
+    """DATABASE_URL for the database this process is connected to (the throwaway one)"""
+    if connection.vendor == 'sqlite':
+        return f"sqlite:///{connection.settings_dict['NAME']}"
+    url = urlsplit(settings.DATABASE_URL)
+    return urlunsplit(url._replace(path='/' + connection.settings_dict['NAME']))
+
+
+def login_cookies(users):
+    """A session cookie per user, stored the way Client.force_login() does it"""
+    engine = import_module(settings.SESSION_ENGINE)
+    cookies = []
+    for user in users:
+        session = engine.SessionStore()
+        session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        cookies.append(f'{settings.SESSION_COOKIE_NAME}={session.session_key}')
+    return cookies
+
+
+def catalog_paths(product_ids, categories):
+    """The read-heavy pages that have async versions"""
+    paths = [reverse('product_list'), reverse('view_cart')]
+    paths += [reverse('product_detail', args=[pk]) for pk in product_ids[:200]]
+    paths += [reverse('category', args=[slug]) for slug in categories]
+    return paths
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Server:
+    """One server process on a free local port, stopped on exit"""
+
+    def __init__(self, server, workers, env):
+        self.port = free_port()
+        self.process = subprocess.Popen(
+            server_command(server, self.port, workers), cwd=settings.BASE_DIR, env={**os.environ, **env},
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+        )
+
+    def __enter__(self):
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"server exited during startup:\n{self.process.stderr.read()}")
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=1).close()
+                return self
+            except OSError:
+                time.sleep(0.1)
+        self.__exit__()
+        raise RuntimeError(f"server didn't start listening within {STARTUP_TIMEOUT}s")
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+# ---------------- LOAD ----------------
+@dataclass
+class LoadResult:
+    duration: float
+    latencies: list = field(default_factory=list)  # seconds, fast clients only
+    status_codes: dict = field(default_factory=dict)
+    errors: int = 0
+    slow_requests: int = 0
+
+    def report(self):
+        latencies = sorted(self.latencies)
+        ms = lambda pct: round(percentile(latencies, pct) * 1000, 2) if latencies else None
+        return {
+            'requests': len(latencies),
+            'throughput_rps': round(len(latencies) / self.duration, 1),
+            'latency_ms': {'p50': ms(50), 'p95': ms(95), 'p99': ms(99)},
+            'status_codes': self.status_codes,
+            'errors': self.errors,
+            'slow_client_requests': self.slow_requests,
+        }
+
+
+def _request_bytes(path, cookie):
+    return (f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nCookie: {cookie}\r\n'
+            'Accept: text/html\r\nConnection: close\r\n\r\n').encode()
+
+
+async def _fetch(port, path, cookie, slow_delay=None):
+    """Make one request; returns the status code. A slow_delay trickles the request and the response."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        data = _request_bytes(path, cookie)
+        if slow_delay is None:
+            writer.write(data)
+        else:
+            step = -(-len(data) // SLOW_CHUNKS)
+            for start in range(0, len(data), step):
+                writer.write(data[start:start + step])
+                await writer.drain()
+                await asyncio.sleep(slow_delay)
+        await writer.drain()
+        status_line = await reader.readline()
+        while await reader.read(READ_SIZE):
+            if slow_delay is not None:
+                await asyncio.sleep(slow_delay)
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def _fast_client(port, paths, cookie, rng, until, result):
+    while time.monotonic() < until:
+        started = time.perf_counter()
+        try:
+            status = await asyncio.wait_for(_fetch(port, rng.choice(paths), cookie), REQUEST_TIMEOUT)
+        except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+            result.errors += 1
+            continue
+        result.latencies.append(time.perf_counter() - started)
+        result.status_codes[status] = result.status_codes.get(status, 0) + 1
+
+
+async def _slow_client(port, paths, cookie, rng, until, delay, result):
+    while time.monotonic() < until:
+        try:
+            await asyncio.wait_for(_fetch(port, rng.choice(paths), cookie, slow_delay=delay), REQUEST_TIMEOUT * 4)
+            result.slow_requests += 1
+        except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+            await asyncio.sleep(delay)
+
+
+async def _load(port, paths, cookies, clients, slow_clients, slow_delay, duration, rng):
+    result = LoadResult(duration)
+    started = time.monotonic()
+    until = started + duration
+    tasks = [_fast_client(port, paths, cookies[i % len(cookies)], rng, until, result) for i in range(clients)]
+    tasks += [_slow_client(port, paths, cookies[i % len(cookies)], rng, until, slow_delay, result)
+              for i in range(slow_clients)]
+    await asyncio.gather(*tasks)
+    # Requests still in flight at the deadline are counted, so use the real elapsed time
+    result.duration = time.monotonic() - started
+    return result
+
+
+def run_load(port, paths, cookies, clients, slow_clients, slow_delay, duration, warmup, rng):
+    """Warm the server's caches with `warmup` requests per path, then apply the load. Returns a report dict."""
+    async def warm():
+        for path in paths * warmup:
+            try:
+                await asyncio.wait_for(_fetch(port, path, cookies[0]), REQUEST_TIMEOUT)
+            except (OSError, asyncio.TimeoutError):
+                pass
+
+    asyncio.run(warm())
+    result = asyncio.run(_load(port, paths, cookies, clients, slow_clients, slow_delay, duration, rng))
+    return result.report()
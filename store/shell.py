@@ -0,0 +1,98 @@
+"""
+Catalog pages that are the same for everyone ("shells"), and the per-user
+state the browser fills into them.
+
+A shell is rendered for nobody in particular: the header shows the guest
+links, forms carry an empty CSRF token and flash messages are left out. It
+never touches the session, so the response has no `Vary: Cookie`, and one
+cached rendering per URL (get_or_set_page) serves every user, from the CDN
+too (PUBLIC in conditional.py). Templates check `shell` to leave the
+per-user parts out, see the header in store/base.html.
+
+static/js/hydrate.js then fetches user_state() from the user_fragments
+endpoint and fills everything personal in: sign-in state and username, badge
+counts, which products on the page are wishlisted or in the cart, a CSRF
+token for the forms and any pending messages. For a signed-in user that
+costs one query for cart and wishlist together, on top of the session lookup
+every signed-in request pays; a guest's cart is read from its cookie with no
+query at all.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.db.models import CharField, IntegerField, Value
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+
+from . import guest_cart
+from .cache import CSRF_PLACEHOLDER, aget_or_set_page, get_or_set_page
+from .models import Cart, Wishlist
+
+
+def render_shell(request, template, context):
+    """Render `template` with no per-user data"""
+    html = render_to_string(template, {**context, 'shell': True, 'csrf_token': CSRF_PLACEHOLDER}, request)
+    return html.replace(CSRF_PLACEHOLDER, '')
+
+
+def _page_parts(request):
+    # The query string in a fixed order, so ?a=1&b=2 and ?b=2&a=1 share an entry
+    return request.path, sorted(request.GET.lists())
+
+
+def shell_response(request, version_keys, template, get_context):
+    """The cached shell of `template` for this URL, rendered with get_context() on a miss"""
+    html = get_or_set_page(version_keys, _page_parts(request),
+                           lambda: render_shell(request, template, get_context()))
+    return HttpResponse(html)
+
+
+async def ashell_response(request, version_keys, template, get_context):
+    """shell_response() for async views; `get_context` is a coroutine function"""
+    async def compute():
+        return await sync_to_async(render_shell)(request, template, await get_context())
+    return HttpResponse(await aget_or_set_page(version_keys, _page_parts(request), compute))
+
+
+# ---------------- PER-USER STATE ----------------
+def _saved_products(user):
+    """({product_id: quantity} for the cart, [product_id] for the wishlist) in one query"""
+    cart_rows = (Cart.objects.filter(user=user).annotate(kind=Value('cart', output_field=CharField()))
+                 .values_list('kind', 'product_id', 'quantity'))
+    wishlist_rows = (Wishlist.objects.filter(user=user)
+                     .annotate(kind=Value('wishlist', output_field=CharField()),
+                               quantity=Value(0, output_field=IntegerField()))
+                     .values_list('kind', 'product_id', 'quantity'))
+    cart, wishlisted = {}, []
+    for kind, product_id, quantity in cart_rows.union(wishlist_rows, all=True):
+        if kind == 'cart':
+            cart[product_id] = quantity
+        else:
+            wishlisted.append(product_id)
+    return cart, wishlisted
+
+
+def user_state(request, product_ids=None):
+    """
+    Everything per-user a shell shows, ready for JSON. `product_ids` narrows
+    the cart and wishlist to the products on the page; the counts are always
+    for the whole cart and wishlist.
+    """
+    user = request.user
+    if user.is_authenticated:
+        cart, wishlist = _saved_products(user)
+    else:
+        cart, wishlist = guest_cart.read(request), []
+    counts = {'cart': len(cart), 'wishlist': len(wishlist)}
+    if product_ids is not None:
+        cart = {product_id: quantity for product_id, quantity in cart.items() if product_id in product_ids}
+        wishlist = [product_id for product_id in wishlist if product_id in product_ids]
+    return {
+        'authenticated': user.is_authenticated,
+        'username': user.get_username() if user.is_authenticated else None,
+        'counts': counts,
+        'cart': cart,
+        'wishlist': wishlist,
+        'csrf_token': get_token(request),
+        'messages': [{'tags': message.tags, 'text': str(message)} for message in messages.get_messages(request)],
+    }
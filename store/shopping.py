@@ -0,0 +1,50 @@
+"""
+What the cart, wishlist and order history pages read.
+
+Each page loads its rows together with their products in one query (the
+order history: one more for the lines of its orders), and only the
+product columns its template shows, so a 40-line cart costs as many queries
+as a 1-line one. The cart's totals come from the same rows in one pass
+(pricing.cart_totals). Checkout reads the cart itself, with row locks and
+whole products (see checkout.py).
+"""
+from django.db.models import Prefetch
+
+from .models import Cart, Order, OrderItem, Wishlist
+
+# Product columns for product_image and the price/stock lines of each page
+IMAGE_FIELDS = ('product__name', 'product__image', 'product__image_variants')
+CART_FIELDS = ('quantity', 'reserved_quantity', 'reserved_until', 'product__price', 'product__effective_price',
+               'product__tax_amount', 'product__stock_available', *IMAGE_FIELDS)
+WISHLIST_FIELDS = ('product__description', 'product__is_new', 'product__effective_price', *IMAGE_FIELDS)
+ORDER_PRODUCT_FIELDS = ('product__description', *IMAGE_FIELDS)
+
+
+def _cart_rows(user):
+    return Cart.objects.filter(user=user).select_related('product').only(*CART_FIELDS).order_by('added_at')
+
+
+def cart_items(user):
+    """The user's cart rows with the products cart.html shows, in one query"""
+    return list(_cart_rows(user))
+
+
+async def acart_items(user):
+    """cart_items() with the async ORM"""
+    return [item async for item in _cart_rows(user)]
+
+
+def wishlist_items(user):
+    """The user's wishlist with the products wishlist.html shows, in one query"""
+    return list(Wishlist.objects.filter(user=user).select_related('product').only(*WISHLIST_FIELDS)
+                .order_by('-added_at'))
+
+
+def order_rows(user):
+    """The user's orders with their products and lines, for the orders page: two queries per page"""
+    lines = OrderItem.objects.select_related('product').only(
+        'order_id', 'quantity', 'line_total', *IMAGE_FIELDS).order_by('pk')
+    return (Order.objects.filter(user=user).select_related('product')
+            .only('customer_name', 'email', 'mobile', 'address', 'order_status', 'quantity', 'total_amount',
+                  'created_at', *ORDER_PRODUCT_FIELDS)
+            .prefetch_related(Prefetch('items', queryset=lines)))
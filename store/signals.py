@@ -0,0 +1,168 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .cache import invalidate_price_rules, invalidate_product, invalidate_products, invalidate_shopper
+from .categories import invalidate_nav, move_counts
+from .fulfilment import log_changes, move_status_counts
+from .images import delete_variants, queue_variants
+from .models import Cart, Category, Feedback, Order, Product, Promotion, Task, TaxRule, Wishlist
+from .orders import record_order
+from .pricing import apply_prices, recompute_prices
+from .ratings import apply_rating, rebuild_ratings
+from .search import ensure_search_index, index_products, remove_products
+from .taskqueue import enqueue
+from .tasks import ON_ORDER_CREATED, ON_ORDER_STATUS
+
+
+# ---------------- PRICES ----------------
+@receiver(pre_save, sender=Product)
+def price_product(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and not Product.PRICE_INPUTS & set(update_fields)):
+        return
+    apply_prices([instance])
+
+
+@receiver([post_save, post_delete], sender=TaxRule)
+@receiver([post_save, post_delete], sender=Promotion)
+def price_rules_changed(sender, raw=False, **kwargs):
+    if raw:
+        return
+    # Repricing every product is the worker's job, not the admin request's; one queued run covers every edit
+    transaction.on_commit(invalidate_price_rules)
+    if not Task.objects.filter(name='recompute_prices', status=Task.QUEUED).exists():
+        enqueue('recompute_prices')
+
+
+# ---------------- CATEGORIES ----------------
+@receiver(post_save, sender=Product)
+def product_category_counted(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        move_counts({instance.category_id: 1})
+    elif 'category_id' in instance.__dict__ and hasattr(instance, '_loaded_category_id'):
+        old = instance._loaded_category_id
+        if old != instance.category_id:
+            move_counts({old: -1, instance.category_id: 1})
+    instance._loaded_category_id = instance.__dict__.get('category_id')
+
+
+@receiver(post_delete, sender=Product)
+def product_category_uncounted(sender, instance, **kwargs):
+    move_counts({instance.category_id: -1})
+
+
+@receiver(post_save, sender=Category)
+@receiver(pre_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    # Product cards and search documents include the category name and icon
+    product_ids = list(instance.products.values_list('pk', flat=True))
+    invalidate_nav()
+
+    def refresh():
+        invalidate_price_rules()
+        recompute_prices(product_ids)  # rules match categories by slug
+        invalidate_products(product_ids)
+        index_products(Product.objects.filter(pk__in=product_ids))
+    transaction.on_commit(refresh)
+
+
+# ---------------- ORDERS ----------------
+# Connected before order_follow_up, which moves _loaded_order_status on
+@receiver(post_save, sender=Order)
+def order_recorded(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        record_order(instance)
+        move_status_counts({instance.order_status: 1})
+    elif 'order_status' in instance.__dict__ and hasattr(instance, '_loaded_order_status'):
+        old = instance._loaded_order_status
+        if old != instance.order_status:
+            log_changes([(instance.pk, instance.user_id, old, instance.total_amount)], instance.order_status)
+
+
+@receiver(post_save, sender=Order)
+def order_follow_up(sender, instance, created, raw=False, **kwargs):
+    # Queued in the order's own transaction: the work exists exactly when the order does
+    if raw:
+        return
+    if created:
+        for name in ON_ORDER_CREATED:
+            enqueue(name, {'order_id': instance.pk}, key=f'{name}:{instance.pk}')
+    elif 'order_status' in instance.__dict__ and hasattr(instance, '_loaded_order_status'):
+        status = instance.order_status
+        if status != instance._loaded_order_status:
+            for name in ON_ORDER_STATUS:
+                enqueue(name, {'order_id': instance.pk, 'status': status}, key=f'{name}:{instance.pk}:{status}')
+    instance._loaded_order_status = instance.__dict__.get('order_status')
+
+
+# ---------------- RATINGS ----------------
+@receiver(post_save, sender=Feedback)
+def feedback_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        apply_rating(instance.product_id, instance.rating, 1)
+    else:
+        # Edits (e.g. from admin) may change the rating, so recompute this product only
+        rebuild_ratings([instance.product_id])
+
+
+@receiver(post_delete, sender=Feedback)
+def feedback_deleted(sender, instance, **kwargs):
+    apply_rating(instance.product_id, instance.rating, -1)
+
+
+# ---------------- SEARCH INDEX ----------------
+@receiver(post_migrate)
+def create_search_index(sender, **kwargs):
+    if sender.name == 'store':
+        ensure_search_index()
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, raw=False, **kwargs):
+    # Fixtures are loaded raw, possibly before the index exists; rebuild_search_index covers them
+    if not raw:
+        index_products([instance])
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    remove_products([instance.pk])
+
+
+# ---------------- IMAGE VARIANTS ----------------
+@receiver(post_save, sender=Product)
+def product_image_changed(sender, instance, raw=False, **kwargs):
+    # Resizing is the worker's job; the task commits or rolls back with the product
+    if not raw:
+        queue_variants([instance])
+
+
+@receiver(post_delete, sender=Product)
+def product_image_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: delete_variants(instance.image_variants, instance.pk))
+
+
+# ---------------- CACHE VERSIONS ----------------
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Feedback)
+def catalog_changed(sender, instance, **kwargs):
+    product_id = instance.pk if sender is Product else instance.product_id
+    # Bump after commit so no request can re-cache the old rows in between
+    transaction.on_commit(lambda: invalidate_product(product_id))
+
+
+@receiver([post_save, post_delete], sender=Cart)
+@receiver([post_save, post_delete], sender=Wishlist)
+@receiver(post_save, sender=Order)
+def shopping_changed(sender, instance, raw=False, **kwargs):
+    # The home page's picks come from these (see conditional.home_etag)
+    if raw:
+        return
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_shopper(user_id))
@@ -0,0 +1,170 @@
+"""
+A small database-backed task queue for work that shouldn't hold up a request
+(order emails, invoices, stock syncs).
+
+    @task(max_attempts=3)
+    def send_receipt(order_id):
+        ...
+
+    enqueue('send_receipt', {'order_id': order.pk}, key=f'receipt:{order.pk}')
+
+Tasks are rows in the Task table, so enqueueing inside a transaction (e.g.
+from an Order signal during checkout) commits or rolls back together with the
+data the task is about. `manage.py runworker` claims due tasks and runs them
+in a thread or process pool.
+
+- Handlers are looked up by name in the registry filled by @task; their
+  modules are imported from StoreConfig.ready().
+- A failing task is retried with exponential backoff (BACKOFF_BASE seconds,
+  doubling, capped at BACKOFF_MAX, plus jitter) until it has used
+  max_attempts, then left as failed with the traceback in last_error.
+- An idempotency key makes enqueue() return the existing task instead of
+  adding a duplicate. A task whose worker died is re-queued after
+  LOCK_TIMEOUT, so handlers must be safe to run twice.
+"""
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger('store.tasks')
+
+BACKOFF_BASE = 10
+BACKOFF_MAX = 3600
+LOCK_TIMEOUT = timedelta(minutes=15)
+
+_registry = {}
+
+
+class UnknownTaskError(Exception):
+    pass
+
+
+def task(func=None, *, name=None, max_attempts=5):
+    """Register a function as a task handler, under its own name unless `name` is given"""
+    def register(func):
+        func.task_name = name or func.__name__
+        func.max_attempts = max_attempts
+        _registry[func.task_name] = func
+        return func
+    return register(func) if func else register
+
+
+def enqueue(name, payload=None, key=None, delay=0, max_attempts=None):
+    """
+    Queue task `name` to run with `payload` (JSON-serializable kwargs) after
+    `delay` seconds. With `key`, a task already queued under the same key is
+    returned instead of a new one.
+    """
+    handler = _registry.get(name)
+    if handler is None:
+        raise UnknownTaskError(name)
+    values = {
+        'name': name,
+        'payload': payload or {},
+        'run_at': timezone.now() + timedelta(seconds=delay),
+        'max_attempts': max_attempts or handler.max_attempts,
+    }
+    if key is None:
+        return Task.objects.create(**values)
+    try:
+        # The savepoint keeps a duplicate key from breaking the caller's transaction
+        with transaction.atomic():
+            return Task.objects.create(idempotency_key=key, **values)
+    except IntegrityError:
+        return Task.objects.get(idempotency_key=key)
+
+
+def enqueue_many(name, payloads_by_key):
+    """
+    Queue task `name` once per {key: payload}, in one INSERT. Keys already
+    queued are skipped, as with enqueue().
+    """
+    handler = _registry.get(name)
+    if handler is None:
+        raise UnknownTaskError(name)
+    run_at = timezone.now()
+    Task.objects.bulk_create(
+        [Task(name=name, payload=payload, idempotency_key=key, run_at=run_at, max_attempts=handler.max_attempts)
+         for key, payload in payloads_by_key.items()],
+        ignore_conflicts=True,
+    )
+
+
+def backoff(attempts):
+    """Seconds to wait before retry number `attempts`"""
+    delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+    return delay + random.uniform(0, delay / 10)
+
+
+# ---------------- WORKER ----------------
+def claim(worker, limit):
+    """Mark up to `limit` due tasks as running by `worker` and return them, oldest first"""
+    now = timezone.now()
+    due = Task.objects.filter(status=Task.QUEUED, run_at__lte=now).order_by('run_at', 'id')
+    claimed = []
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        for pk in due.values_list('pk', flat=True)[:limit]:
+            # The status check keeps two workers from claiming one task where rows can't be locked (SQLite)
+            if Task.objects.filter(pk=pk, status=Task.QUEUED).update(
+                    status=Task.RUNNING, locked_by=worker, locked_at=now, attempts=F('attempts') + 1):
+                claimed.append(pk)
+    return list(Task.objects.filter(pk__in=claimed).order_by('run_at', 'id'))
+
+
+def run_task(task):
+    """Run one claimed task and record how it went. Returns its new status."""
+    finished = Task.objects.filter(pk=task.pk, status=Task.RUNNING, locked_by=task.locked_by)
+    try:
+        handler = _registry.get(task.name)
+        if handler is None:
+            raise UnknownTaskError(task.name)
+        # A handler that fails halfway leaves no partial writes behind for the retry
+        with transaction.atomic():
+            handler(**task.payload)
+    except Exception:
+        error = traceback.format_exc()
+        if task.attempts >= task.max_attempts:
+            logger.error("Task %s #%s failed for good after %d attempt(s)", task.name, task.pk, task.attempts)
+            finished.update(status=Task.FAILED, last_error=error, locked_by='', locked_at=None,
+                            finished_at=timezone.now())
+            return Task.FAILED
+        delay = backoff(task.attempts)
+        logger.warning("Task %s #%s failed (attempt %d), retrying in %ds", task.name, task.pk, task.attempts, delay)
+        finished.update(status=Task.QUEUED, last_error=error, locked_by='', locked_at=None,
+                        run_at=timezone.now() + timedelta(seconds=delay))
+        return Task.QUEUED
+    finished.update(status=Task.DONE, locked_by='', locked_at=None, finished_at=timezone.now())
+    return Task.DONE
+
+
+def execute(task):
+    """Pool entry point: run_task on this thread's or process's own database connection"""
+    close_old_connections()
+    try:
+        return run_task(task)
+    finally:
+        close_old_connections()
+
+
+def requeue_stale(timeout=LOCK_TIMEOUT):
+    """
+    Put tasks whose worker died mid-run (running for longer than `timeout`)
+    back in the queue, or fail them if that was their last attempt. Returns
+    the number of tasks touched.
+    """
+    now = timezone.now()
+    stale = Task.objects.filter(status=Task.RUNNING, locked_at__lt=now - timeout)
+    lost = "Worker stopped responding while running this task"
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Task.FAILED, last_error=lost, locked_by='', locked_at=None, finished_at=now)
+    requeued = stale.update(status=Task.QUEUED, last_error=lost, locked_by='', locked_at=None, run_at=now)
+    return failed + requeued
@@ -0,0 +1,62 @@
+"""
+Background work run by `manage.py runworker` (see taskqueue.py): follow-ups
+for orders, repricing the catalog and resizing product images.
+
+The Order signals in signals.py enqueue these inside the checkout transaction,
+keyed so a retried request or a re-saved order never queues the same email
+twice. Mail goes through settings.EMAIL_BACKEND (the console in development).
+"""
+from django.conf import settings
+from django.core.mail import send_mail
+from django.template.loader import render_to_string
+
+from . import pricing
+from .images import generate_variants, needs_variants
+from .models import Order, Product
+from .taskqueue import task
+
+# Queued for every new order and every order_status change. Further follow-up
+# work (invoices, stock syncs) is a new @task added to these lists.
+ON_ORDER_CREATED = ['send_order_confirmation']  # called with order_id
+ON_ORDER_STATUS = ['send_order_status']  # called with order_id, status
+
+
+@task(max_attempts=8)
+def send_order_confirmation(order_id):
+    order = Order.objects.get(pk=order_id)
+    items = order.items.select_related('product')
+    send_mail(
+        f"Your order #{order.pk} is confirmed",
+        render_to_string('store/emails/order_confirmation.txt', {'order': order, 'items': items}),
+        settings.DEFAULT_FROM_EMAIL,
+        [order.email],
+    )
+
+
+@task(max_attempts=8)
+def send_order_status(order_id, status):
+    order = Order.objects.get(pk=order_id)
+    if order.order_status != status:
+        return  # changed again since; that change queued its own email
+    send_mail(
+        f"Order #{order.pk}: {status}",
+        render_to_string('store/emails/order_status.txt', {'order': order}),
+        settings.DEFAULT_FROM_EMAIL,
+        [order.email],
+    )
+
+
+# ---------------- CATALOG ----------------
+@task(max_attempts=3)
+def recompute_prices():
+    """Queued when a tax rule or promotion changes (signals.price_rules_changed)"""
+    pricing.recompute_prices()
+
+
+@task(max_attempts=3)
+def generate_image_variants(product_id):
+    """Queued when a product gets a new image (images.queue_variants)"""
+    product = Product.objects.filter(pk=product_id).only('pk', 'image', 'image_variants').first()
+    # Gone, or already done by an earlier run or generate_image_variants
+    if product is not None and needs_variants(product):
+        generate_variants(product)
@@ -0,0 +1,41 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+
+from store.images import MIME_TYPES, fallback_format, srcset
+
+register = template.Library()
+
+DEFAULT_IMAGE = 'images/default.png'
+
+
+@register.simple_tag
+def product_image(product, sizes='100vw', css_class='', loading='lazy'):
+    """
+    <picture> for a product's image with AVIF/WebP sources and a srcset, so
+    the browser fetches the smallest variant that fills `sizes`. Falls back to
+    the original upload until its variants exist, and to the placeholder when
+    there is no image.
+    """
+    if not product.image:
+        return format_html('<img src="{}" alt="No image" class="{}" loading="{}">',
+                           static(DEFAULT_IMAGE), css_class, loading)
+
+    manifest = product.image_variants or {}
+    if manifest.get('source') != product.image.name:
+        return format_html('<img src="{}" alt="{}" class="{}" loading="{}">',
+                           product.image.url, product.name, css_class, loading)
+
+    fallback = fallback_format(manifest)
+    sources = format_html_join(
+        '', '<source type="{}" srcset="{}" sizes="{}">',
+        ((MIME_TYPES[fmt], srcset(manifest, fmt), sizes) for fmt in manifest['formats'] if fmt != fallback),
+    )
+    _, largest = manifest['formats'][fallback][-1]
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" class="{}" '
+        'loading="{}" decoding="async"></picture>',
+        sources, default_storage.url(largest), srcset(manifest, fallback), sizes,
+        manifest['width'], manifest['height'], product.name, css_class, loading,
+    )
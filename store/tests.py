@@ -1,3 +1,1255 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from contextlib import nullcontext
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.contrib.sessions.backends.base import SessionBase
+from django.template import Context, RequestContext, Template
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import async_views, benchmarks, views
+from .analytics import moving_average, rank, rollup_sales, sales_report
+from .catalog_io import ImportResult, _create, export_rows, import_products
+from .cache import CATALOG_CACHE_TIMEOUT, get_or_set_listing, get_or_set_product
+from .categories import categories_by_name, category_nav, find_category
+from .explain import capture_selects, explain
+from .checkout import place_cart_order, place_single_order
+from .fulfilment import InvalidTransition, status_counts, transition
+from .inventory import OutOfStockError, release_expired, reserve
+from .metrics import REGISTRY_KEY, process_key, view_metrics
+from .models import (ArchivedOrder, Cart, Category, DailyCategorySales, DailyProductSales, Feedback, Order, OrderEvent,
+                     Product, ProductPair, Promotion, Task, TaxRule, Wishlist)
+from .orders import ORDERS_PER_PAGE, order_stats
+from .pagination import encode_cursor, paginate
+from .ratings import rebuild_ratings
+from .recommendations import also_bought, recommended_for, refresh_recommendations
+from .reviews import REVIEWS_PER_PAGE
+from .search import ensure_search_index, get_backend, search_products
+from .taskqueue import claim, enqueue, run_task, task
+
+
+@task(name='test_always_fails', max_attempts=2)
+def always_fails():
+    raise RuntimeError("boom")
+
+
+class RatingTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Sneaker', description='Limited drop', price=100)
+        self.users = [User.objects.create_user(f'buyer{i}', password='secret123') for i in range(2)]
+
+    def _stats(self):
+        self.product.refresh_from_db()
+        return (self.product.rating_count, self.product.rating_sum, self.product.average_rating,
+                dict(self.product.rating_histogram))
+
+    def test_counters_follow_reviews(self):
+        first = Feedback.objects.create(user=self.users[0], product=self.product, comment='Great', rating=5)
+        Feedback.objects.create(user=self.users[1], product=self.product, comment='Fine', rating=3)
+        self.assertEqual(self._stats(), (2, 8, 4.0, {5: 1, 4: 0, 3: 1, 2: 0, 1: 0}))
+
+        first.rating = 1
+        first.save()
+        self.assertEqual(self._stats(), (2, 4, 2.0, {5: 0, 4: 0, 3: 1, 2: 0, 1: 1}))
+
+        first.delete()
+        self.assertEqual(self._stats(), (1, 3, 3.0, {5: 0, 4: 0, 3: 1, 2: 0, 1: 0}))
+        Feedback.objects.get().delete()
+        self.assertEqual(self._stats(), (0, 0, 0.0, {5: 0, 4: 0, 3: 0, 2: 0, 1: 0}))
+
+    def test_rebuild_matches_the_reviews(self):
+        Feedback.objects.create(user=self.users[0], product=self.product, comment='Great', rating=4)
+        Product.objects.update(rating_count=9, rating_sum=1, average_rating=0.1, star_4_count=0)
+        self.assertEqual(rebuild_ratings(), 1)
+        self.assertEqual(self._stats(), (1, 4, 4.0, {5: 0, 4: 1, 3: 0, 2: 0, 1: 0}))
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.shoes = Product.objects.create(name='Running shoes', description='Light and fast', price=100)
+        self.hoodie = Product.objects.create(name='Hoodie', description='Warm enough for running in winter', price=100)
+        Product.objects.create(name='Cap', description='Keeps the sun off', price=100)
+
+    def _search(self, query):
+        return [product.name for product in search_products(Product.objects.all(), query)]
+
+    def test_stemmed_terms_match_best_first(self):
+        self.assertEqual(self._search('runs'), ['Running shoes', 'Hoodie'])
+
+    def test_last_term_matches_as_a_prefix(self):
+        self.assertEqual(self._search('hood'), ['Hoodie'])
+        self.assertEqual(self._search('warm hood'), ['Hoodie'])
+
+    def test_fts_syntax_is_not_interpreted(self):
+        self.assertEqual(self._search('shoes OR "cap'), [])
+        self.assertEqual(self._search('the'), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.hoodie.name = 'Fleece'
+        self.hoodie.save()
+        self.assertEqual(self._search('fleece'), ['Fleece'])
+        self.assertEqual(self._search('hoodie'), [])
+        self.shoes.delete()
+        self.assertEqual(self._search('running'), ['Fleece'])
+
+    def test_one_fts_query_however_many_match(self):
+        Product.objects.bulk_create([Product(name=f'Trail runner {i}', description='Grippy', price=100)
+                                     for i in range(50)])
+        get_backend().rebuild()
+        with self.assertNumQueries(1):
+            [query] = capture_selects(lambda: list(search_products(Product.objects.all(), 'runner')[:25]))
+        plan = explain(query).plan
+        self.assertEqual(sum('VIRTUAL TABLE INDEX' in step for step in plan), 1, plan)
+        self.assertFalse(any('SUBQUERY' in step for step in plan), plan)
+
+    def test_empty_index_is_filled_after_migrate(self):
+        # A store upgraded from before search: the products exist, the index is new
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {get_backend().table}")
+        self.assertEqual(self._search('running'), [])
+        ensure_search_index()
+        self.assertEqual(self._search('running'), ['Running shoes', 'Hoodie'])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        # Repeated prices, so pages have to break ties on id
+        Product.objects.bulk_create([Product(name=f'Product {i}', description='', price=100 + i % 3,
+                                             effective_price=100 + i % 3) for i in range(10)])
+
+    def _walk(self, sort):
+        pages, cursor = [], None
+        while True:
+            page = paginate(Product.objects.all(), sort, cursor, page_size=3)
+            pages.append([product.pk for product in page.items])
+            if not page.has_next:
+                return pages
+            cursor = page.next_cursor
+
+    def test_pages_cover_every_product_once_in_order(self):
+        expected = list(Product.objects.order_by('effective_price', 'id').values_list('pk', flat=True))
+        pages = self._walk('price_asc')
+        self.assertEqual([len(page) for page in pages], [3, 3, 3, 1])
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual(sum(self._walk('newest'), []), sorted(expected, reverse=True))
+
+    def test_tampered_cursor_starts_from_the_first_page(self):
+        first = paginate(Product.objects.all(), 'price_asc', None, page_size=3).items
+        for cursor in ('not-a-cursor', encode_cursor(['cheap', 1]), encode_cursor([100]), 'W10'):
+            self.assertEqual(paginate(Product.objects.all(), 'price_asc', cursor, page_size=3).items, first)
+        response = self.client.get('/products/', {'sort': 'price_asc', 'cursor': encode_cursor(['cheap', 1])})
+        self.assertEqual(response.status_code, 200)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.sneaker = Product.objects.create(name='Sneaker', description='Limited drop', price=100)
+        self.hoodie = Product.objects.create(name='Hoodie', description='Bestseller', price=100)
+        self.computed = []
+
+    def _product(self, product):
+        return get_or_set_product(product.pk, lambda: self.computed.append(product.pk) or product.name)
+
+    def _listing(self):
+        return get_or_set_listing(('products',), lambda: self.computed.append('listing') or 'page')
+
+    def test_saving_a_product_bumps_its_version_and_the_listing(self):
+        for _ in range(2):
+            self._product(self.sneaker)
+            self._product(self.hoodie)
+            self._listing()
+        self.assertEqual(self.computed, [self.sneaker.pk, self.hoodie.pk, 'listing'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sneaker.name = 'Sneaker v2'
+            self.sneaker.save()
+        self.assertEqual((self._product(self.sneaker), self._product(self.hoodie), self._listing()),
+                         ('Sneaker v2', 'Hoodie', 'page'))
+        self.assertEqual(self.computed, [self.sneaker.pk, self.hoodie.pk, 'listing', self.sneaker.pk, 'listing'])
+
+    def test_versions_move_only_after_commit(self):
+        self._product(self.sneaker)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.sneaker.save()
+            self._product(self.sneaker)
+        self.assertEqual(self.computed, [self.sneaker.pk])
+        for callback in callbacks:
+            callback()
+        self._product(self.sneaker)
+        self.assertEqual(self.computed, [self.sneaker.pk, self.sneaker.pk])
+
+    def test_entries_expire_but_versions_do_not(self):
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set, \
+                mock.patch.object(cache, 'add', wraps=cache.add) as cache_add:
+            self._product(self.sneaker)
+            self._listing()
+        self.assertEqual([c.args[2] for c in cache_set.call_args_list], [CATALOG_CACHE_TIMEOUT] * 2)
+        self.assertTrue(cache_add.call_args_list)
+        self.assertTrue(all(c.kwargs['timeout'] is None for c in cache_add.call_args_list))
+
+
+class HeaderCountTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='secret123')
+        product = Product.objects.create(name='Sneaker', description='Limited drop', price=100)
+        Cart.objects.create(user=self.user, product=product)
+        Wishlist.objects.create(user=self.user, product=product)
+        self.request = RequestFactory().get('/')
+        self.request.user = self.user
+        self.request.session = SessionBase()
+
+    def _render(self, source):
+        return Template(source).render(RequestContext(self.request))
+
+    def test_counts_cost_nothing_unless_rendered(self):
+        with self.assertNumQueries(0):
+            self._render('{{ request.path }}')
+
+    def test_counts_are_counted_once_per_session(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(self._render('{{ cart_count }}/{{ wishlist_count }}'), '1/1')
+        with self.assertNumQueries(0):
+            self.assertEqual(self._render('{{ cart_count }}/{{ wishlist_count }}'), '1/1')
+
+
+class CartCheckoutTests(TestCase):
+    def _checkout(self, username, lines):
+        user = User.objects.create_user(username, password='secret123')
+        for i in range(lines):
+            product = Product.objects.create(name=f'{username} {i}', description='', price=100 + i,
+                                             stock_available=5)
+            Cart.objects.create(user=user, product=product, quantity=2)
+        with CaptureQueriesContext(connection) as queries:
+            order = place_cart_order(user, 'Buyer', 'b@example.com', '9876543210')
+        return order, len(queries)
+
+    def test_query_count_does_not_grow_with_the_cart(self):
+        _, small = self._checkout('one', 1)
+        order, large = self._checkout('many', 6)
+        self.assertEqual(small, large)
+        self.assertEqual(order.items.count(), 6)
+        self.assertEqual(order.quantity, 12)
+        self.assertFalse(Cart.objects.filter(user=order.user).exists())
+        self.assertEqual(set(Product.objects.filter(name__startswith='many').values_list('stock_available', flat=True)),
+                         {3})
+
+
+class StockTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='secret123')
+        self.product = Product.objects.create(name='Sneaker', description='Limited drop', price=100, stock_available=3)
+
+    def test_buy_now_decrements_stock(self):
+        place_single_order(self.user, self.product, 2, 'Buyer', 'b@example.com', '9876543210')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_available, 1)
+
+    def test_buy_now_refuses_to_oversell(self):
+        with self.assertRaises(OutOfStockError):
+            place_single_order(self.user, self.product, 4, 'Buyer', 'b@example.com', '9876543210')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_available, 3)
+        self.assertFalse(Order.objects.exists())
+
+    def test_cart_reservation_is_consumed_by_checkout(self):
+        self.client.force_login(self.user)
+        self.client.post(f'/cart/add/{self.product.id}/', {'quantity': 2})
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock_available, self.product.stock_reserved), (1, 2))
+
+        self.client.post('/cart/checkout/', {'name': 'Buyer', 'mobile': '9876543210', 'email': 'b@example.com'})
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock_available, self.product.stock_reserved), (1, 0))
+        self.assertEqual(Order.objects.get().quantity, 2)
+
+    def test_cart_quantity_below_one_adds_one(self):
+        self.client.force_login(self.user)
+        self.client.post(f'/cart/add/{self.product.id}/', {'quantity': -5})
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock_available, self.product.stock_reserved), (2, 1))
+        self.assertEqual(Cart.objects.get().quantity, 1)
+
+    def test_expired_reservations_are_released(self):
+        cart_item = Cart(user=self.user, product=self.product)
+        reserve(cart_item, 3)
+        Cart.objects.update(reserved_until='2000-01-01T00:00:00Z')
+
+        self.assertEqual(release_expired(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock_available, self.product.stock_reserved), (3, 0))
+
+    def test_untracked_stock_never_runs_out(self):
+        self.product.stock_available = None
+        self.product.save()
+        place_single_order(self.user, self.product, 10, 'Buyer', 'b@example.com', '9876543210')
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    buyers = 12
+
+    def test_only_one_buyer_gets_the_last_unit(self):
+        product = Product.objects.create(name='Last pair', description='One left', price=100, stock_available=1)
+        users = [User.objects.create_user(f'buyer{i}', password='secret123') for i in range(self.buyers)]
+        start = threading.Barrier(self.buyers)
+        results = []
+
+        def buy(user):
+            start.wait()
+            try:
+                while True:
+                    try:
+                        place_single_order(user, product, 1, user.username, 'b@example.com', '9876543210')
+                        results.append('ok')
+                    except OutOfStockError:
+                        results.append('sold out')
+                    except OperationalError:
+                        continue  # SQLite's database lock; try again like a real client would
+                    break
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        self.assertEqual(results.count('ok'), 1)
+        self.assertEqual(results.count('sold out'), self.buyers - 1)
+        self.assertEqual(product.stock_available, 0)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class QueryMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        view_metrics.reset()
+        self.addCleanup(cache.clear)
+        self.addCleanup(view_metrics.reset)
+        Product.objects.create(name='Sneaker', description='Limited drop', price=100)
+
+    def test_metrics_are_off_by_default(self):
+        self.client.get('/products/')
+        self.assertEqual(view_metrics.raw(), {})
+
+    @override_settings(QUERY_METRICS_ENABLED=True)
+    def test_requests_are_reported_per_view(self):
+        self.client.get('/products/')
+        self.client.get('/products/')
+        User.objects.create_user('staff', password='secret123', is_staff=True)
+        self.client.login(username='staff', password='secret123')
+        report = self.client.get('/metrics/views/').json()
+        listing = report['product_list']
+        self.assertEqual((listing['requests'], listing['sampled']), (2, 2))
+        self.assertEqual(set(listing['wall_ms']), {'p50', 'p95', 'p99'})
+        self.assertGreater(listing['queries']['p99'], 0)
+
+    def test_publish_drops_dead_workers(self):
+        finished = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                                  capture_output=True, text=True)
+        dead = process_key().rsplit(':', 1)[0] + ':' + finished.stdout.strip()
+        expired = 'metrics:views:elsewhere:1'
+        cache.set(dead, {})
+        cache.set(REGISTRY_KEY, [dead, expired])
+        view_metrics.publish()
+        self.assertEqual(cache.get(REGISTRY_KEY), [process_key()])
+        self.assertIsNone(cache.get(dead))
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_every_scenario_runs_against_a_seeded_catalog(self):
+        users = benchmarks.seed(products=20, users=3, cart_items=2, feedback=10, orders=5)
+        self.assertEqual((Product.objects.count(), Feedback.objects.count(), Order.objects.count()), (20, 10, 5))
+        results = benchmarks.run(users, requests=2, warmup=1)
+        self.assertEqual(set(results), {'home', 'product_list', 'search', 'category', 'product_detail', 'cart_view',
+                                        'add_to_cart', 'buy_now', 'orders'})
+        for name, stats in results.items():
+            self.assertEqual(stats['requests'], 2)
+            self.assertLessEqual(set(stats['status_codes']), {200, 302}, name)
+
+    def test_compare_flags_only_regressions_past_the_threshold(self):
+        def stats(p95, rps, queries):
+            return {'latency_ms': {'p95': p95}, 'throughput_rps': rps, 'queries': {'p50': queries}}
+
+        baseline = {'home': stats(10, 100, 5), 'search': stats(10, 100, 5)}
+        current = {'home': stats(10.5, 95, 5), 'search': stats(13, 100, 7), 'orders': stats(1, 1, 1)}
+        self.assertEqual(benchmarks.compare(baseline, current, 0.10),
+                         [('search', 'latency p95 ms', 10, 13, 30.0), ('search', 'queries p50', 5, 7, 40.0)])
+
+    def test_command_reports_and_compares(self):
+        output = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+        output.close()
+        self.addCleanup(os.remove, output.name)
+        out = io.StringIO()
+        # The test database stands in for the throwaway one the command would create
+        with mock.patch.object(benchmarks, 'throwaway_database', nullcontext):
+            call_command('benchmark', products=10, users=2, feedback=5, orders=2, requests=2, warmup=0,
+                         only=['home', 'product_detail'], output=output.name, compare=None, stdout=out)
+        self.assertIn('product_detail', out.getvalue())
+        with open(output.name) as f:
+            self.assertEqual(set(json.load(f)['scenarios']), {'home', 'product_detail'})
+
+
+class CatalogImportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.shoes = Category.objects.create(name='Shoes')
+        self.sneaker = Product.objects.create(sku='SNK-1', name='Sneaker', description='Limited drop', price=100,
+                                              discount=10, category=self.shoes, stock_available=3)
+
+    def _import(self, text, fmt='csv'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return import_products(io.StringIO(text), fmt)
+
+    def test_bad_rows_are_reported_and_skipped(self):
+        result = self._import(
+            'sku,name,price,discount,stock_available\n'
+            'CAP-1,Cap,20,,5\n'
+            'CAP-2,Cap without price,,,\n'
+            'CAP-3,Half a cap,20,,3.5\n'
+            'CAP-4,Free cap,20,30,\n'
+        )
+        self.assertEqual((result.created, result.updated, result.failed), (1, 0, 3))
+        self.assertEqual(sorted((line, sku) for line, sku, _ in result.errors),
+                         [(3, 'CAP-2'), (4, 'CAP-3'), (5, 'CAP-4')])
+        self.assertEqual(Product.objects.get(sku='CAP-1').stock_available, 5)
+        self.assertEqual(Category.objects.get(pk=self.shoes.pk).product_count, 1)
+
+    def test_non_finite_prices_are_rejected_rows(self):
+        result = self._import(
+            'sku,name,price,discount\n'
+            'CAP-1,Cap,20,\n'
+            'CAP-2,Cap,NaN,\n'
+            'CAP-3,Cap,20,nan\n'
+            'CAP-4,Cap,Infinity,\n'
+        )
+        self.assertEqual((result.created, result.failed), (1, 3))
+        self.assertEqual(sorted((line, sku) for line, sku, _ in result.errors),
+                         [(3, 'CAP-2'), (4, 'CAP-3'), (5, 'CAP-4')])
+        self.assertTrue(Product.objects.filter(sku='CAP-1').exists())
+
+    def test_partial_rows_update_only_their_columns(self):
+        result = self._import('{"sku": "SNK-1", "name": "Sneaker v2", "stock_available": 7}\n'
+                              '{"sku": "SNK-1", "name": "Sneaker v2", "discount": 150}\n', 'jsonl')
+        self.assertEqual((result.updated, result.failed), (0, 1))
+        result = self._import('{"sku": "SNK-1", "name": "Sneaker v2", "stock_available": 7}\n', 'jsonl')
+        self.assertEqual(result.updated, 1)
+        self.sneaker.refresh_from_db()
+        self.assertEqual((self.sneaker.name, self.sneaker.stock_available, self.sneaker.category),
+                         ('Sneaker v2', 7, self.shoes))
+        self.assertEqual((self.sneaker.price, self.sneaker.discount, self.sneaker.effective_price),
+                         (Decimal('100.00'), Decimal('10.00'), Decimal('140.00')))
+
+    def test_partial_rows_keep_the_product_searchable(self):
+        result = self._import('sku,name,price\nSNK-1,Sneaker,120\n')
+        self.assertEqual(result.updated, 1)
+        self.assertEqual([p.sku for p in search_products(Product.objects.all(), 'limited')], ['SNK-1'])
+        self.assertEqual([p.sku for p in search_products(Product.objects.all(), 'sneaker')], ['SNK-1'])
+
+    def test_sku_created_meanwhile_fails_only_its_row(self):
+        result = ImportResult()
+        rows = [Product(sku='SNK-1', name='Sneaker', price=100), Product(sku='CAP-1', name='Cap', price=20)]
+        created = _create(rows, result, {'SNK-1': 2, 'CAP-1': 3})
+        self.assertEqual([p.sku for p in created], ['CAP-1'])
+        self.assertEqual([(line, sku) for line, sku, _ in result.errors], [(2, 'SNK-1')])
+        self.assertEqual(Product.objects.filter(sku='SNK-1').count(), 1)
+
+    def test_export_round_trips(self):
+        exported = ''.join(export_rows('csv'))
+        self.assertEqual(exported.splitlines()[1], 'SNK-1,Sneaker,Limited drop,100.00,10.00,Shoes,False,3,')
+        result = self._import(exported)
+        self.assertEqual((result.created, result.updated, result.failed), (0, 1, 0))
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+
+    def _image(self, width):
+        buffer = io.BytesIO()
+        Image.new('RGB', (width, width // 2), 'navy').save(buffer, format='PNG')
+        return buffer.getvalue()
+
+    def _run_tasks(self):
+        return [run_task(claimed) for claimed in claim('test-worker', 10)]
+
+    def _product(self, name, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name=name, description='Shoe', price=100, image=image)
+        self._run_tasks()
+        product.refresh_from_db()
+        return product
+
+    def _files(self, product):
+        product.refresh_from_db()
+        return {name for variants in product.image_variants['formats'].values() for _, name in variants}
+
+    def test_variants_cover_every_width_up_to_the_source(self):
+        product = self._product('Sneaker', SimpleUploadedFile('shoe.png', self._image(1200)))
+        self.assertEqual([width for width, _ in product.image_variants['formats']['jpeg']], [160, 320, 480, 800, 1200])
+        self.assertTrue(all(default_storage.exists(name) for name in self._files(product)))
+
+        old = self._files(product)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.image = SimpleUploadedFile('shoe.png', self._image(300))
+            product.save()
+        self.assertEqual(self._run_tasks(), [Task.DONE])
+        self._files(product)
+        self.assertEqual([width for width, _ in product.image_variants['formats']['jpeg']], [160, 300])
+        self.assertFalse(any(default_storage.exists(name) for name in old))
+
+    def test_shared_variants_outlive_one_of_their_products(self):
+        first = self._product('Sneaker', SimpleUploadedFile('shoe.png', self._image(400)))
+        # Another SKU pointing at the same stored original, as an import with an images dir does
+        second = self._product('Sneaker XL', first.image.name)
+        files = self._files(first)
+        self.assertEqual(self._files(second), files)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(all(default_storage.exists(name) for name in files))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(any(default_storage.exists(name) for name in files))
+
+    def test_saving_queues_the_resize_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name='Sneaker', description='Shoe', price=100,
+                                             image=SimpleUploadedFile('shoe.png', self._image(400)))
+            product.save()
+        self.assertEqual(product.image_variants, {})  # nothing resized during the request
+        self.assertEqual(list(Task.objects.values_list('name', 'payload')),
+                         [('generate_image_variants', {'product_id': product.pk})])
+        self.assertEqual(self._run_tasks(), [Task.DONE])
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants['source'], product.image.name)
+
+    def test_import_queues_new_images_only(self):
+        image_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, image_dir)
+        with open(os.path.join(image_dir, 'cap.png'), 'wb') as f:
+            f.write(self._image(400))
+        rows = 'sku,name,price,image\nCAP-1,Cap,20,cap.png\n'
+        with self.captureOnCommitCallbacks(execute=True):
+            import_products(io.StringIO(rows), 'csv', images_dir=image_dir)
+        self.assertEqual(self._run_tasks(), [Task.DONE])
+        with self.captureOnCommitCallbacks(execute=True):
+            import_products(io.StringIO(rows), 'csv', images_dir=image_dir)
+        self.assertEqual(self._run_tasks(), [])
+        self.assertTrue(Product.objects.get(sku='CAP-1').image_variants)
+
+    def test_picture_tag_uses_variants_once_they_exist(self):
+        with self.captureOnCommitCallbacks():
+            product = Product.objects.create(name='Sneaker', description='Shoe', price=100,
+                                             image=SimpleUploadedFile('shoe.png', self._image(500)))
+        render = Template('{% load store_images %}{% product_image product sizes="50vw" %}').render
+        html = render(Context({'product': product}))
+        self.assertTrue(html.startswith('<img src="/media/products/shoe'), html)
+
+        out = io.StringIO()
+        call_command('generate_image_variants', stdout=out)
+        self.assertIn('Generated variants for 1 product(s), 0 failed', out.getvalue())
+        product.refresh_from_db()
+        html = render(Context({'product': product}))
+        self.assertTrue(html.startswith('<picture>'), html)
+        self.assertIn('sizes="50vw"', html)
+        self.assertIn(' 500w', html)
+
+
+class PricingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.product = Product.objects.create(name='Sneaker', description='Limited drop', price=1000, discount=100)
+
+    def test_default_flat_tax_applies_without_rules(self):
+        self.assertEqual((self.product.effective_price, self.product.tax_amount, self.product.promotion_amount),
+                         (Decimal('950.00'), Decimal('50.00'), Decimal('0.00')))
+
+    def test_running_promotion_and_tax_rule_make_the_price(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            TaxRule.objects.create(name='GST', rate=18)
+            Promotion.objects.create(name='Sale', percent_off=10)
+            Promotion.objects.create(name='Next week', percent_off=50,
+                                     starts_at=timezone.now() + timedelta(days=7))
+        run_task(Task.objects.get(name='recompute_prices'))
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.effective_price, self.product.tax_amount, self.product.promotion_amount),
+                         (Decimal('955.80'), Decimal('145.80'), Decimal('90.00')))
+
+    def test_saving_a_rule_queues_the_recompute(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            TaxRule.objects.create(name='GST', rate=18)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.tax_amount, Decimal('50.00'))
+        self.assertEqual(Task.objects.filter(name='recompute_prices').count(), 1)
+
+    def test_update_fields_saves_the_new_price(self):
+        self.product.price = 2000
+        self.product.save(update_fields=['price'])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.effective_price, Decimal('1950.00'))
+
+    def test_rules_are_cached_between_saves(self):
+        self.product.save()
+        with CaptureQueriesContext(connection) as queries:
+            self.product.save()
+        rule_tables = ('store_taxrule', 'store_promotion', 'store_category')
+        self.assertFalse([query for query in queries if any(table in query['sql'] for table in rule_tables)])
+
+
+class QueryPlanTests(TestCase):
+    def _plan(self, func):
+        [query] = capture_selects(func)
+        return explain(query)
+
+    def test_full_scans_are_reported(self):
+        query = self._plan(lambda: list(Product.objects.filter(description__contains='drop')))
+        self.assertEqual(query.full_scans, ['store_product'])
+
+    def test_filtered_limited_scans_are_reported(self):
+        query = self._plan(lambda: list(Product.objects.filter(description__contains='drop').order_by('id')[:24]))
+        self.assertEqual(query.full_scans, ['store_product'])
+
+    def test_index_lookups_and_limited_pk_walks_pass(self):
+        self.assertEqual(self._plan(lambda: Product.objects.filter(sku='SNK-1').first()).full_scans, [])
+        self.assertEqual(self._plan(lambda: list(Product.objects.order_by('-id')[:24])).full_scans, [])
+        self.assertEqual(self._plan(lambda: list(TaxRule.objects.all())).full_scans, [])
+
+    def test_command_passes_on_the_hot_paths(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        out = io.StringIO()
+        with mock.patch.object(benchmarks, 'throwaway_database', nullcontext):
+            # Big enough that the planner's statistics favour the indexes, as they do in production
+            call_command('check_query_plans', products=500, users=5, feedback=500, orders=1000, stdout=out)
+        self.assertIn('Every hot-path query uses an index', out.getvalue())
+
+
+class CategoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.shoes = Category.objects.create(name='Shoes')
+        self.watches = Category.objects.create(name='Watches')
+
+    def _counts(self):
+        return dict(Category.objects.values_list('name', 'product_count'))
+
+    def test_counts_follow_products(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            sneaker = Product.objects.create(name='Sneaker', description='Limited drop', price=100, category=self.shoes)
+            Product.objects.create(name='Boot', description='Waterproof', price=100, category=self.shoes)
+        self.assertEqual(self._counts(), {'Shoes': 2, 'Watches': 0})
+        with self.captureOnCommitCallbacks(execute=True):
+            sneaker.category = self.watches
+            sneaker.save()
+        self.assertEqual(self._counts(), {'Shoes': 1, 'Watches': 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            sneaker.delete()
+        self.assertEqual(self._counts(), {'Shoes': 1, 'Watches': 0})
+        self.assertEqual([(c['name'], c['product_count']) for c in category_nav()], [('Shoes', 1), ('Watches', 0)])
+
+    def test_nav_is_cached_until_a_category_changes(self):
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            category_nav()
+        self.assertEqual(cache_set.call_args.args[2], CATALOG_CACHE_TIMEOUT)
+        with self.assertNumQueries(0):
+            self.assertEqual(find_category('SHOES')['id'], self.shoes.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Belts')
+        self.assertEqual(find_category('belts')['name'], 'Belts')
+
+    def test_unicode_names_keep_their_letters(self):
+        shoes = Category.objects.create(name='鞋子')
+        stars = Category.objects.create(name='★★★')
+        self.assertEqual((shoes.slug, stars.slug), ('鞋子', f'category-{stars.pk}'))
+        self.assertEqual(find_category('鞋子')['id'], shoes.pk)
+        self.assertEqual(find_category('★★★')['id'], stars.pk)
+        self.assertEqual(find_category(f'category-{stars.pk}')['id'], stars.pk)
+        self.assertEqual(categories_by_name(['★★★', 'Jóias', 'jóias ']),
+                         {'★★★': stars, 'Jóias': Category.objects.get(slug='jóias'),
+                          'jóias ': Category.objects.get(slug='jóias')})
+
+    def test_category_page_resolves_unicode_slugs(self):
+        category = Category.objects.create(name='鞋子')
+        response = self.client.get(reverse('category', args=[category.slug]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['category_name'], '鞋子')
+
+
+class AsyncCatalogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        shoes = Category.objects.create(name='Shoes')
+        self.product = Product.objects.create(name='Running shoes', description='Light and fast', price=100,
+                                              category=shoes)
+
+    async def test_async_views_match_the_sync_views(self):
+        pk = self.product.pk
+        for path, async_view, sync_view, args in [
+            ('/products/?q=running', async_views.product_list, views.product_list, ()),
+            (f'/product/{pk}/', async_views.product_view, views.product_view, (pk,)),
+            ('/category/shoes/', async_views.category_view, views.category_view, ('shoes',)),
+        ]:
+            expected = await sync_to_async(sync_view)(RequestFactory().get(path), *args)
+            response = await async_view(AsyncRequestFactory().get(path), *args)
+            self.assertEqual((response.status_code, response['ETag']), (expected.status_code, expected['ETag']))
+            self.assertContains(response, 'Running shoes')
+
+    async def test_catalog_pages_under_the_asgi_client(self):
+        response = await self.async_client.get('/products/', {'q': 'running'})
+        self.assertContains(response, 'Running shoes')
+        again = await self.async_client.get('/products/', {'q': 'running'}, headers={'if-none-match': response['ETag']})
+        self.assertEqual(again.status_code, 304)
+        missing = await self.async_client.get(f'/product/{self.product.pk + 1}/')
+        self.assertEqual(missing.status_code, 404)
+
+
+class GuestCartTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='secret123')
+        self.sneaker = Product.objects.create(name='Sneaker', description='Limited drop', price=100, stock_available=5)
+        self.hoodie = Product.objects.create(name='Hoodie', description='Bestseller', price=100)
+
+    def test_guest_cart_costs_no_writes(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(f'/cart/add/{self.sneaker.pk}/', {'quantity': 2})
+            self.client.post(f'/cart/add/{self.sneaker.pk}/')
+            self.client.post(f'/cart/add/{self.hoodie.pk}/')
+            response = self.client.get('/cart/')
+        writes = [q['sql'] for q in queries if not q['sql'].lstrip().upper().startswith('SELECT')]
+        self.assertEqual(writes, [])
+        self.assertEqual([(item.product, item.quantity) for item in response.context['cart_items']],
+                         [(self.sneaker, 3), (self.hoodie, 1)])
+        self.assertContains(response, '<span id="cart-count" class="badge" data-count="cart">2</span>', html=True)
+
+    def test_login_merges_guest_cart_up_to_the_cap(self):
+        Cart.objects.create(user=self.user, product=self.hoodie, quantity=8)
+        self.client.post(f'/cart/add/{self.hoodie.pk}/', {'quantity': 5})
+        self.client.post(f'/cart/add/{self.sneaker.pk}/', {'quantity': 2})
+
+        response = self.client.post('/login/', {'username': 'buyer', 'password': 'secret123'})
+        self.assertEqual(response.cookies['guest_cart'].value, '')
+        self.assertEqual(dict(Cart.objects.filter(user=self.user).values_list('product_id', 'quantity')),
+                         {self.sneaker.pk: 2, self.hoodie.pk: 10})
+
+    def test_merged_lines_hold_the_stock_left(self):
+        sold_out = Product.objects.create(name='Cap', description='Gone', price=100, stock_available=0)
+        Cart.objects.create(user=self.user, product=self.sneaker, quantity=1)
+        self.client.post(f'/cart/add/{self.sneaker.pk}/', {'quantity': 7})
+        self.client.post(f'/cart/add/{sold_out.pk}/')
+
+        self.client.post('/login/', {'username': 'buyer', 'password': 'secret123'})
+        self.assertEqual(list(Cart.objects.filter(user=self.user).values_list('product_id', 'quantity',
+                                                                               'reserved_quantity')),
+                         [(self.sneaker.pk, 5, 5)])
+        self.sneaker.refresh_from_db()
+        self.assertEqual((self.sneaker.stock_available, self.sneaker.stock_reserved), (0, 5))
+
+class ReviewPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()  # version bumps run on commit, which TestCase never does
+        self.user = User.objects.create_user('shopper', password='secret123')
+        self.client.force_login(self.user)
+        self.product = Product.objects.create(name='Sneaker', description='Limited drop', price=100)
+
+    def _review(self, product, count):
+        reviewers = User.objects.bulk_create(
+            User(username=f'reviewer-{product.pk}-{i}') for i in range(count))
+        for i, reviewer in enumerate(reviewers):
+            Feedback.objects.create(user=reviewer, product=product, rating=i % 5 + 1, comment=f'Review number {i}')
+
+    def _walk(self, url):
+        seen = []
+        while url:
+            data = self.client.get(url).json()
+            self.assertLessEqual(len(data['reviews']), REVIEWS_PER_PAGE)
+            seen += data['reviews']
+            url = data['next_url']
+        return seen
+
+    def test_pages_cover_every_review_newest_first(self):
+        self._review(self.product, 23)
+        seen = self._walk(f'/product/{self.product.pk}/reviews/?format=json')
+        expected = list(Feedback.objects.filter(product=self.product).order_by('-created_at', '-id')
+                        .values_list('id', flat=True))
+        self.assertEqual([review['id'] for review in seen], expected)
+
+    def test_rating_filter(self):
+        self._review(self.product, 23)
+        seen = self._walk(f'/product/{self.product.pk}/reviews/?format=json&rating=2')
+        self.assertEqual(len(seen), 5)
+        self.assertEqual({review['rating'] for review in seen}, {2})
+
+    def test_product_page_cost_does_not_grow_with_reviews(self):
+        popular = Product.objects.create(name='Hoodie', description='Bestseller', price=100)
+        self._review(self.product, 2)
+        self._review(popular, 3 * REVIEWS_PER_PAGE)
+        self.client.get('/products/')  # session and category nav
+
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(f'/product/{self.product.pk}/')
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(f'/product/{popular.pk}/')
+        self.assertEqual(len(many), len(few))
+        self.assertEqual(len(response.context['feedback_list']), REVIEWS_PER_PAGE)
+        self.assertContains(response, 'Load more reviews')
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()  # version bumps run on commit, which TestCase never does
+        self.user = User.objects.create_user('shopper', password='secret123')
+        self.client.force_login(self.user)
+        self.product = Product.objects.create(name='Sneaker', description='Limited drop', price=100)
+
+    def test_unchanged_product_page_is_not_rendered_again(self):
+        url = f'/product/{self.product.pk}/'
+        first = self.client.get(url)
+        etag = first['ETag']
+        self.assertIn('public', first['Cache-Control'])
+        self.assertNotIn('Cookie', first.get('Vary', ''))
+
+        with CaptureQueriesContext(connection) as queries:
+            again = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(again.status_code, 304)
+        self.assertFalse(any('store_feedback' in q['sql'] for q in queries))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Feedback.objects.create(user=self.user, product=self.product, rating=4, comment='Fits really well')
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], etag)
+
+    def test_home_page_is_private(self):
+        response = self.client.get('/')
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+
+    def test_home_page_revalidates_when_picks_can_change(self):
+        boot = Product.objects.create(name='Boot', description='Waterproof', price=200)
+        Wishlist.objects.create(user=self.user, product=self.product)
+        etag = self.client.get('/')['ETag']
+        self.assertEqual(self.client.get('/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Same counts, different products
+        with self.captureOnCommitCallbacks(execute=True):
+            Wishlist.objects.filter(user=self.user).delete()
+            Wishlist.objects.create(user=self.user, product=boot)
+        swapped = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(swapped.status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.create(user=self.user, product=boot, customer_name='Shopper', email='s@example.com',
+                                 mobile='9876543210', total_amount=200)
+        ordered = self.client.get('/', HTTP_IF_NONE_MATCH=swapped['ETag'])
+        self.assertEqual(ordered.status_code, 200)
+        refresh_recommendations(now=timezone.now() + timedelta(hours=1))
+        self.assertEqual(self.client.get('/', HTTP_IF_NONE_MATCH=ordered['ETag']).status_code, 200)
+
+    def test_review_stream_is_public(self):
+        self.client.logout()
+        response = self.client.get(f'/product/{self.product.pk}/reviews/?format=json')
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('s-maxage', response['Cache-Control'])
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+        self.assertEqual(self.client.get(f'/product/{self.product.pk}/reviews/?format=json',
+                                         HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class CatalogShellTests(TestCase):
+    def setUp(self):
+        cache.clear()  # version bumps run on commit, which TestCase never does
+        self.user = User.objects.create_user('shopper', password='secret123')
+        self.sneaker = Product.objects.create(name='Sneaker', description='Limited drop', price=100)
+        self.hoodie = Product.objects.create(name='Hoodie', description='Bestseller', price=100)
+        Cart.objects.create(user=self.user, product=self.sneaker, quantity=2)
+        Wishlist.objects.create(user=self.user, product=self.hoodie)
+
+    def test_one_rendering_serves_every_user(self):
+        guest = self.client.get('/products/')
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            shopper = self.client.get('/products/')
+        self.assertEqual(shopper.content, guest.content)
+        self.assertEqual(len(queries), 0)
+        self.assertNotIn('shopper', shopper.content.decode())
+        self.assertNotIn('Cookie', shopper.get('Vary', ''))
+
+    def test_fragments_fill_in_the_user(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            state = self.client.get(f'/me/fragments/?products={self.sneaker.pk}').json()
+        self.assertLessEqual(len(queries), 3)  # session, user, cart and wishlist together
+        self.assertEqual(state['username'], 'shopper')
+        self.assertEqual(state['counts'], {'cart': 1, 'wishlist': 1})
+        self.assertEqual(state['cart'], {str(self.sneaker.pk): 2})
+        self.assertEqual(state['wishlist'], [])
+        self.assertIn('no-cache', self.client.get('/me/fragments/')['Cache-Control'])
+
+    def test_cart_rows_are_told_apart_from_wishlist_rows(self):
+        boot = Product.objects.create(name='Boot', description='Waterproof', price=100)
+        Cart.objects.create(user=self.user, product=boot, quantity=0)
+        self.client.force_login(self.user)
+        state = self.client.get(f'/me/fragments/?products={self.sneaker.pk},{self.hoodie.pk},{boot.pk}').json()
+        self.assertEqual(state['cart'], {str(self.sneaker.pk): 2, str(boot.pk): 0})
+        self.assertEqual(state['wishlist'], [self.hoodie.pk])
+
+    def test_unicode_digits_in_product_ids_are_ignored(self):
+        state = self.client.get(f'/me/fragments/?products={self.sneaker.pk},²,x').json()
+        self.assertEqual(state['cart'], {})
+
+
+class ShoppingPagesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', password='secret123')
+        self.client.force_login(self.user)
+        self.products = Product.objects.bulk_create(
+            Product(name=f'Tee {i}', description='Cotton', price=500, discount=100, effective_price=450,
+                    tax_amount=50) for i in range(6))
+
+    def _fill(self, count):
+        for product in self.products[:count]:
+            Cart.objects.get_or_create(user=self.user, product=product, defaults={'quantity': 2})
+            Wishlist.objects.get_or_create(user=self.user, product=product)
+        place_cart_order(self.user, 'Shopper', 's@example.com', '9876543210')
+        Cart.objects.bulk_create(Cart(user=self.user, product=product, quantity=2)
+                                 for product in self.products[:count])
+        place_single_order(self.user, self.products[0], 1, 'Shopper', 's@example.com', '9876543210')
+
+    def _queries(self, url):
+        self.client.get(url)  # header counts and category nav, cached after the first page
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_query_count_does_not_grow_with_lines(self):
+        self._fill(1)
+        few = {url: self._queries(url)[0] for url in ('/cart/', '/wishlist/', '/orders/')}
+        self._fill(6)
+        many = {url: self._queries(url)[0] for url in ('/cart/', '/wishlist/', '/orders/')}
+        self.assertEqual(many, few)
+
+    def test_cart_totals(self):
+        self._fill(3)
+        totals = self._queries('/cart/')[1].context['totals']
+        self.assertEqual((totals.items, totals.subtotal, totals.discount, totals.tax, totals.total),
+                         (6, 3000, 600, 300, 2700))
+
+
+class OrderArchiveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='secret123')
+        self.client.force_login(self.user)
+        self.product = Product.objects.create(name='Sneaker', description='Limited drop', price=100)
+
+    def _order(self, status='Pending', days_ago=0):
+        order = place_single_order(self.user, self.product, 1, 'Buyer', 'b@example.com', '9876543210')
+        if status != 'Pending':
+            order.order_status = status
+            order.save()
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+        return order
+
+    def test_stats_follow_orders_and_cancellations(self):
+        kept, cancelled = self._order(), self._order()
+        cancelled.order_status = 'Cancelled'
+        cancelled.save()
+        stats = order_stats(self.user)
+        self.assertEqual((stats.order_count, stats.lifetime_spend), (2, kept.total_amount))
+
+    def test_archive_moves_only_old_finished_orders(self):
+        old = self._order('Delivered', days_ago=800)
+        still_open = self._order(days_ago=800)
+        recent = self._order('Delivered')
+        before = order_stats(self.user)
+
+        out = io.StringIO()
+        call_command('archive_orders', '--batch-size', '1', '--rebuild-stats', stdout=out)
+        self.assertIn('Archived 1 order(s)', out.getvalue())
+        self.assertEqual(set(Order.objects.values_list('pk', flat=True)), {still_open.pk, recent.pk})
+        archived = ArchivedOrder.objects.get()
+        self.assertEqual((archived.pk, archived.lines[0]['name']), (old.pk, 'Sneaker'))
+        after = order_stats(self.user)
+        self.assertEqual((after.order_count, after.lifetime_spend), (before.order_count, before.lifetime_spend))
+        self.assertContains(self.client.get('/orders/archive/'), f'Order #{old.pk}')
+
+    def test_archive_keeps_the_product_of_legacy_orders(self):
+        # Orders from before OrderItem hold their single product themselves
+        legacy = Order.objects.create(user=self.user, product=self.product, customer_name='Buyer',
+                                      email='b@example.com', mobile='9876543210', quantity=2, total_amount=300,
+                                      order_status=Order.DELIVERED)
+        Order.objects.filter(pk=legacy.pk).update(created_at=timezone.now() - timedelta(days=800))
+        call_command('archive_orders', stdout=io.StringIO())
+        self.assertEqual(ArchivedOrder.objects.get(pk=legacy.pk).lines,
+                         [{'product_id': self.product.pk, 'name': 'Sneaker', 'quantity': 2, 'line_total': '300.00'}])
+
+    def test_orders_page_is_paginated(self):
+        for _ in range(ORDERS_PER_PAGE + 1):
+            self._order()
+        first = self.client.get('/orders/')
+        self.assertEqual(len(first.context['orders']), ORDERS_PER_PAGE)
+        rest = self.client.get(first.context['next_url'])
+        self.assertEqual(len(rest.context['orders']), 1)
+        self.assertIsNone(rest.context['next_url'])
+
+
+class FulfilmentTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='secret123')
+        self.product = Product.objects.create(name='Sneaker', description='Limited drop', price=100)
+
+    def _orders(self, count):
+        return [place_single_order(self.user, self.product, 1, 'Buyer', 'b@example.com', '9876543210').pk
+                for _ in range(count)]
+
+    def test_bulk_transition_skips_disallowed_orders(self):
+        processing, pending = self._orders(3), self._orders(1)
+        transition(processing, Order.PROCESSING)
+        result = transition(processing + pending, Order.SHIPPED, actor=self.user)
+        self.assertEqual((result.moved, result.skipped), (3, pending))
+        self.assertEqual(Order.objects.filter(order_status=Order.SHIPPED).count(), 3)
+        self.assertEqual(OrderEvent.objects.filter(to_status=Order.SHIPPED, actor=self.user).count(), 3)
+        self.assertEqual(Task.objects.filter(name='send_order_status', payload__status=Order.SHIPPED).count(), 3)
+        counts = status_counts()
+        self.assertEqual((counts[Order.PENDING], counts[Order.SHIPPED], counts[Order.PROCESSING]), (1, 3, 0))
+        with self.assertRaises(InvalidTransition):
+            transition(processing, 'Lost')
+
+    def test_query_count_does_not_grow_with_batch(self):
+        few, many = self._orders(2), self._orders(6)
+        with CaptureQueriesContext(connection) as small:
+            transition(few, Order.PROCESSING)
+        with CaptureQueriesContext(connection) as large:
+            transition(many, Order.PROCESSING)
+        self.assertEqual(len(large), len(small))
+
+    def test_cancelling_from_the_command_updates_spend(self):
+        self._orders(2)
+        out = io.StringIO()
+        call_command('transition_orders', Order.CANCELLED, '--from', Order.PENDING, stdout=out)
+        self.assertIn('Moved 2 order(s) to Cancelled', out.getvalue())
+        self.assertEqual(order_stats(self.user).lifetime_spend, 0)
+        self.assertEqual(status_counts()[Order.CANCELLED], 2)
+
+
+class SalesAnalyticsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='secret123')
+        shoes = Category.objects.create(name='Shoes')
+        self.sneaker = Product.objects.create(name='Sneaker', description='Limited drop', price=100, category=shoes)
+        self.boot = Product.objects.create(name='Boot', description='Waterproof', price=200, category=shoes)
+
+    def _order(self, product, quantity=1):
+        return place_single_order(self.user, product, quantity, 'Buyer', 'b@example.com', '9876543210')
+
+    def _rollup(self):
+        # Past SETTLE_TIME, so the orders just placed count as settled
+        return rollup_sales(now=timezone.now() + timedelta(hours=1))
+
+    def _units(self):
+        return dict(DailyProductSales.objects.values_list('product__name', 'units'))
+
+    def test_rollups_are_incremental_and_take_out_cancellations(self):
+        first = self._order(self.sneaker, 2)
+        self._order(self.boot)
+        self.assertEqual(self._rollup(), (2, 0))
+        self.assertEqual(self._rollup(), (0, 0))
+        self.assertEqual(self._units(), {'Sneaker': 2, 'Boot': 1})
+
+        self._order(self.sneaker)
+        transition([first.pk], Order.CANCELLED)
+        self.assertEqual(self._rollup(), (1, 1))
+        self.assertEqual(self._units(), {'Sneaker': 1, 'Boot': 1})
+        shoes = DailyCategorySales.objects.get()
+        self.assertEqual((shoes.units, shoes.order_count), (2, 2))
+
+        report = sales_report(days=7)
+        self.assertEqual((report['orders'], report['units']), (2, 2))
+        self.assertEqual(report['revenue'], self.sneaker.effective_price + self.boot.effective_price)
+        self.assertEqual([row['name'] for row in report['top_products']], ['Boot', 'Sneaker'])
+
+    def test_legacy_orders_count_as_one_line(self):
+        legacy = Order.objects.create(user=self.user, product=self.boot, customer_name='Buyer', email='b@example.com',
+                                      mobile='9876543210', quantity=3, total_amount=600)
+        self.assertEqual(self._rollup(), (1, 0))
+        self.assertEqual(self._units(), {'Boot': 3})
+        transition([legacy.pk], Order.CANCELLED)
+        self.assertEqual(self._rollup(), (0, 1))
+        self.assertEqual(self._units(), {'Boot': 0})
+
+    def test_order_cancelled_before_rollup_is_never_added(self):
+        order = self._order(self.boot)
+        transition([order.pk], Order.CANCELLED)
+        self._rollup()
+        self.assertEqual(self._units(), {})
+
+    def test_report_is_staff_only(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/analytics/sales.json').status_code, 302)
+        self.user.is_staff = True
+        self.user.save()
+        data = self.client.get('/analytics/sales.json?days=3').json()
+        self.assertEqual(len(data['days']), 3)
+        self.assertEqual(self.client.get('/analytics/sales/').status_code, 200)
+
+    def test_series_helpers(self):
+        self.assertEqual(moving_average([1, 2, 3, 4], window=2), [1.0, 1.5, 2.5, 3.5])
+        self.assertEqual(rank([5, 9, 5, 1]), [2, 1, 2, 4])
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.sneaker = Product.objects.create(name='Sneaker', description='Limited drop', price=100)
+        self.boot = Product.objects.create(name='Boot', description='Waterproof', price=200)
+        self.sock = Product.objects.create(name='Sock', description='Wool', price=10)
+        self.users = {name: User.objects.create_user(name, password='secret123') for name in ('ann', 'ben', 'cat')}
+        for name, products in (('ann', [self.sneaker, self.boot]), ('ben', [self.sneaker, self.boot]),
+                               ('cat', [self.sneaker, self.sock])):
+            for product in products:
+                self._order(name, product)
+
+    def _order(self, name, product):
+        place_single_order(self.users[name], product, 1, name, f'{name}@example.com', '9876543210')
+
+    def _refresh(self, **kwargs):
+        # Past SETTLE_TIME, so the orders just placed count as settled
+        return refresh_recommendations(now=timezone.now() + timedelta(hours=1), **kwargs)
+
+    def test_neighbors_are_ranked_by_cosine_similarity(self):
+        self.assertEqual(self._refresh(), 3)
+        self.assertEqual(also_bought(self.sneaker.id), [self.boot, self.sock])
+        self.assertEqual(also_bought(self.sock.id), [self.sneaker])
+        # Reordering doesn't count a customer twice, and nothing new means nothing to rebuild
+        self._order('ann', self.boot)
+        self._refresh()
+        self.assertEqual(ProductPair.objects.get(product=self.sneaker, other=self.boot).customers, 2)
+        self.assertEqual(self._refresh(), 0)
+
+    def test_saved_products_count_until_removed(self):
+        self._refresh()
+        dan = User.objects.create_user('dan', password='secret123')
+        Wishlist.objects.create(user=dan, product=self.boot)
+        Cart.objects.create(user=dan, product=self.sock)
+        self._refresh()
+        self.assertEqual(also_bought(self.boot.id), [self.sneaker, self.sock])
+        Wishlist.objects.filter(user=dan).delete()
+        self._refresh()
+        self.assertEqual(also_bought(self.boot.id), [self.sneaker])
+        self.assertFalse(ProductPair.objects.filter(product=self.boot, other=self.sock).exists())
+
+    def test_legacy_orders_are_counted(self):
+        # Orders from before OrderItem hold their single product themselves
+        Order.objects.create(user=self.users['cat'], product=self.boot, customer_name='cat', email='c@example.com',
+                             mobile='9876543210', total_amount=200)
+        self._refresh()
+        self.assertEqual(ProductPair.objects.get(product=self.sneaker, other=self.boot).customers, 3)
+        self.assertEqual(recommended_for(self.users['cat']), [])
+
+    def test_pages_show_recommendations(self):
+        self._refresh()
+        with self.assertNumQueries(1):
+            also_bought(self.sneaker.id)
+        self.assertContains(self.client.get(f'/product/{self.sneaker.id}/'), 'Customers also bought')
+        self.assertEqual(recommended_for(self.users['cat']), [self.boot])
+        self.client.force_login(self.users['cat'])
+        self.assertContains(self.client.get('/'), 'Recommended for You')
+
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='secret123')
+        self.product = Product.objects.create(name='Sneaker', description='Limited drop', price=100)
+
+    def _order(self):
+        return place_single_order(self.user, self.product, 1, 'Buyer', 'b@example.com', '9876543210')
+
+    def _run_due(self):
+        return [run_task(claimed) for claimed in claim('test-worker', 10)]
+
+    def test_order_queues_one_confirmation(self):
+        order = self._order()
+        queued = Task.objects.get()
+        self.assertEqual((queued.name, queued.payload), ('send_order_confirmation', {'order_id': order.pk}))
+        self.assertEqual(enqueue('send_order_confirmation', {'order_id': order.pk},
+                                 key=f'send_order_confirmation:{order.pk}'), queued)
+        self.assertEqual(len(mail.outbox), 0)  # nothing is sent during checkout
+
+    def test_worker_sends_the_confirmation(self):
+        order = self._order()
+        self.assertEqual(self._run_due(), [Task.DONE])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(f"#{order.pk}", mail.outbox[0].subject)
+        self.assertEqual(mail.outbox[0].to, ['b@example.com'])
+        self.assertEqual(self._run_due(), [])
+
+    def test_status_change_queues_one_email(self):
+        order = self._order()
+        Task.objects.all().delete()
+        order = Order.objects.get(pk=order.pk)
+        order.order_status = 'Shipped'
+        order.save()
+        order.save()
+        queued = Task.objects.get()
+        self.assertEqual(queued.payload, {'order_id': order.pk, 'status': 'Shipped'})
+        self._run_due()
+        self.assertEqual(mail.outbox[0].subject, f"Order #{order.pk}: Shipped")
+
+    def test_failures_back_off_then_give_up(self):
+        failing = enqueue('test_always_fails')
+        self.assertEqual(self._run_due(), [Task.QUEUED])
+        failing.refresh_from_db()
+        self.assertGreater(failing.run_at, timezone.now())
+        self.assertIn("boom", failing.last_error)
+        self.assertEqual(self._run_due(), [])  # not due yet
+
+        Task.objects.update(run_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self._run_due(), [Task.FAILED])
+        failing.refresh_from_db()
+        self.assertEqual((failing.status, failing.attempts), (Task.FAILED, 2))
+
+
+class WorkerCommandTests(TransactionTestCase):
+    def test_burst_runs_due_tasks_in_the_pool(self):
+        user = User.objects.create_user('buyer', password='secret123')
+        product = Product.objects.create(name='Sneaker', description='Limited drop', price=100)
+        for _ in range(3):
+            place_single_order(user, product, 1, 'Buyer', 'b@example.com', '9876543210')
+
+        out = io.StringIO()
+        call_command('runworker', burst=True, concurrency=2, stdout=out)
+        self.assertIn("Ran 3 task(s): 3 done", out.getvalue())
+        self.assertEqual(Task.objects.filter(status=Task.DONE).count(), 3)
+        self.assertEqual(len(mail.outbox), 3)
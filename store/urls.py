@@ -1,7 +1,11 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
 from django.views.generic import TemplateView
 
+# The read-heavy catalog pages have async versions for ASGI (see async_views.py)
+catalog = async_views if settings.ASYNC_CATALOG_VIEWS else views
+
 urlpatterns = [
     # Home
     path('', views.home_view, name='home'),
@@ -12,14 +16,20 @@ urlpatterns = [
     path('logout/', views.logout_view, name='logout'),
 
     # Products
-    path('products/', views.product_list, name='product_list'),
-    path('product/<int:product_id>/', views.product_view, name='product_detail'),
+    path('products/', catalog.product_list, name='product_list'),
+    path('products/cards/', views.product_cards, name='product_cards'),
+    path('product/<int:product_id>/', catalog.product_view, name='product_detail'),
+    path('product/<int:product_id>/reviews/', catalog.product_reviews, name='product_reviews'),
+
+    # Per-user parts of the shared catalog pages
+    path('me/fragments/', views.user_fragments, name='user_fragments'),
 
     # Cart
-    path('cart/', views.view_cart, name='view_cart'),
+    path('cart/', catalog.view_cart, name='view_cart'),
     path('cart/add/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
     path('cart/update/<int:cart_id>/', views.update_cart_quantity, name='update_cart_quantity'),
     path('cart/remove/<int:cart_id>/', views.remove_from_cart, name='remove_from_cart'),
+    path('cart/checkout/', views.checkout_view, name='checkout'),
 
     #dashboard
     path('dashboard/', TemplateView.as_view(template_name='store/dashboard.html'), name='dashboard'),
@@ -28,7 +38,7 @@ urlpatterns = [
     path('account/', views.account_view, name='account'),
     
     #category
-    path('category/<str:category_name>/', views.category_view, name='category'),
+    path('category/<str:category_name>/', catalog.category_view, name='category'),
     
     # Wishlist
     path('wishlist/', views.view_wishlist, name='view_wishlist'),
@@ -40,8 +50,22 @@ urlpatterns = [
     
     # Orders
     path('orders/', views.view_orders, name='view_orders'),
+    path('orders/archive/', views.order_archive, name='order_archive'),
     
     # Order Confirmation
     path('order/confirmation/<int:order_id>/', views.order_confirmation_view, name='order_confirmation'),
+
+    # Cache stats (staff only)
+    path('cache/stats/', views.cache_stats, name='cache_stats'),
+
+    # Per-view request metrics (staff only)
+    path('metrics/views/', views.view_metrics_report, name='view_metrics'),
+
+    # Sales analytics (staff only)
+    path('analytics/sales/', views.sales_dashboard, name='sales_dashboard'),
+    path('analytics/sales.json', views.sales_report_json, name='sales_report'),
+
+    # Catalog export (staff only)
+    path('products/export/', views.export_products, name='export_products'),
 ]
 
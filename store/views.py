@@ -1,17 +1,47 @@
+from decimal import Decimal, InvalidOperation
+
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
+from django.utils.http import urlencode
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
+from django.contrib.auth.views import redirect_to_login
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
-from django.db.models import Q, Avg
+from django.db import transaction
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.cache import never_cache
+from . import guest_cart, shopping
+from .analytics import sales_report
+from .cache import stats as cache_stats_snapshot, get_or_set_listing, get_or_set_product, render_product_cards
+from .catalog_io import FORMATS as EXPORT_FORMATS, export_rows
+from .categories import category_nav, find_category
+from .conditional import (LISTING_VERSIONS, PRIVATE, PUBLIC, conditional, home_etag, listing_etag, product_etag,
+                          product_versions, reviews_etag, with_viewer)
+from .checkout import EmptyCartError, cart_lines, place_cart_order, place_single_order, price_cart
+from .counters import adjust_counts, get_counts, reset_counts
+from .fulfilment import status_counts
+from .inventory import OutOfStockError, release, reserve
+from .metrics import collected_report
 from .models import Product, Registerpage, Cart, Wishlist, Order, Feedback
+from .orders import archived_orders, order_stats, recent_orders
+from .pagination import DEFAULT_SORT, SORT_ORDERS, paginate
+from .pricing import cart_totals
+from .recommendations import also_bought, recommended_for
+from .reviews import parse_rating, review_json, review_page
+from .search import search_products
+from .shell import shell_response, user_state
 
 # ---------------- HOME ----------------
-@login_required(login_url='login')
+@conditional(with_viewer(home_etag), PRIVATE)
 def home_view(request):
-    featured_products = Product.objects.filter(is_new=True)[:4]
-    return render(request, 'store/home.html', {'featured_products': featured_products})
+    featured_products = Product.objects.filter(is_new=True).order_by('-id')[:4]
+    return render(request, 'store/home.html', {
+        'featured_products': featured_products,
+        'recommended_products': recommended_for(request.user),
+    })
 
 # ---------------- REGISTER ----------------
 def register_view(request):
@@ -92,7 +122,14 @@ def login_user(request):
         user = authenticate(request, username=username, password=password)
         if user is not None:
             login(request, user)
-            return redirect('dashboard')
+            response = redirect('dashboard')
+            # Whatever was put in the cart before logging in joins the account's cart
+            guest_items = guest_cart.read(request)
+            if guest_items:
+                guest_cart.merge_into_cart(user, guest_items)
+                reset_counts(request)
+                guest_cart.write(response, {})
+            return response
         else:
             return render(request, 'store/login.html', {'error': 'Invalid username or password'})
 
@@ -105,43 +142,197 @@ def logout_view(request):
     return redirect('login')
 
 # ---------------- PRODUCTS ----------------
-@login_required(login_url='login')
-def product_list(request):
-    query = request.GET.get('q', '').strip()
-    category = request.GET.get('category', '').strip()
+PRODUCTS_PER_PAGE = 24
 
-    # Start with all products
-    products = Product.objects.all()
-    
-    # Apply category filter if provided
-    if category and category != 'all':
-        products = products.filter(category__iexact=category)
-    
-    # Apply search filter if provided
-    if query:
-        products = products.filter(
-            Q(name__icontains=query) | Q(description__icontains=query) | Q(category__icontains=query)
-        )
-
-    # Calculate average rating for each product
-    for product in products:
-        product.average_rating = Feedback.objects.filter(product=product).aggregate(Avg('rating'))['rating__avg'] or 0
-
-    return render(request, 'store/product_list.html', {
-        'products': products, 
+
+def _price_param(request, name):
+    try:
+        value = Decimal(request.GET.get(name, ''))
+    except InvalidOperation:
+        return None
+    return value if value.is_finite() and value >= 0 else None
+
+
+def _catalog_filters(request, category=''):
+    """The listing filters from the URL and query string"""
+    query = request.GET.get('q', '').strip()
+    sort = request.GET.get('sort', '')
+    if sort not in SORT_ORDERS or (sort == 'relevance' and not query):
+        sort = 'relevance' if query else DEFAULT_SORT
+    return {
         'query': query,
-        'selected_category': category
-    })
+        'category': category or request.GET.get('category', '').strip(),
+        'sort': sort,
+        'cursor': request.GET.get('cursor'),
+        # Price range on the stored final price (see pricing.py)
+        'min_price': _price_param(request, 'min_price'),
+        'max_price': _price_param(request, 'max_price'),
+    }
+
+
+def _filters_category(filters):
+    """The category to look up in the nav, or '' for all products"""
+    category = filters['category']
+    return '' if category.lower() == 'all' else category
+
+
+def _catalog_products(filters, selected):
+    """The filtered (and searched) products; `selected` is the category's nav entry"""
+    products = Product.objects.select_related('category')
+
+    # Apply category filter if provided; the slug or name is resolved from the cached nav
+    if _filters_category(filters):
+        products = products.filter(category_id=selected['id']) if selected else products.none()
+
+    if filters['min_price'] is not None:
+        products = products.filter(effective_price__gte=filters['min_price'])
+    if filters['max_price'] is not None:
+        products = products.filter(effective_price__lte=filters['max_price'])
+
+    # Apply full-text search if provided (ranked, best matches first)
+    if filters['query']:
+        products = search_products(products, filters['query'])
+    return products
+
+
+def _listing_parts(filters, selected):
+    """Cache key parts for one listing page"""
+    category = selected['slug'] if selected else filters['category'].lower()
+    return ('products', filters['query'], category, filters['sort'], filters['cursor'],
+            filters['min_price'], filters['max_price'])
+
+
+def _catalog_context(page_url, filters, selected, page, cards):
+    next_page_url = next_fragment_url = None
+    if page.has_next:
+        params = {'sort': filters['sort'], 'cursor': page.next_cursor}
+        if filters['query']:
+            params['q'] = filters['query']
+        if filters['category']:
+            params['category'] = filters['category']
+        if filters['min_price'] is not None:
+            params['min_price'] = filters['min_price']
+        if filters['max_price'] is not None:
+            params['max_price'] = filters['max_price']
+        next_page_url = f"{page_url}?{urlencode(params)}"
+        next_fragment_url = f"{reverse('product_cards')}?{urlencode(params)}"
+
+    return {
+        'products': page.items,
+        'cards': cards,
+        'page': page,
+        'next_page_url': next_page_url,
+        'next_fragment_url': next_fragment_url,
+        'query': filters['query'],
+        'selected': selected,
+        'sort': filters['sort'],
+        'min_price': filters['min_price'],
+        'max_price': filters['max_price'],
+    }
+
+
+def _catalog_page(request, page_url, category=''):
+    """Filter, sort and keyset-paginate products for the listing pages and the infinite-scroll fragment"""
+    filters = _catalog_filters(request, category)
+    wanted = _filters_category(filters)
+    selected = find_category(wanted) if wanted else None
+    products = _catalog_products(filters, selected)
+
+    # Ratings are denormalized onto Product (see ratings.py), so no per-product queries here
+    page = get_or_set_listing(
+        _listing_parts(filters, selected),
+        lambda: paginate(products, filters['sort'], filters['cursor'], PRODUCTS_PER_PAGE),
+    )
+    # Listing pages are shells (see shell.py), so the cards' CSRF tokens are filled in by the browser
+    cards = render_product_cards(request, page.items, token=False)
+    return _catalog_context(page_url, filters, selected, page, cards)
 
-@login_required(login_url='login')
+
+@conditional(listing_etag, PUBLIC)
+def product_list(request):
+    return shell_response(request, LISTING_VERSIONS, 'store/product_list.html', lambda: _product_list_context(
+        request, _catalog_page(request, reverse('product_list'))))
+
+
+def _product_list_context(request, context):
+    selected = context['selected']
+    context['selected_category'] = selected['name'] if selected else request.GET.get('category', '').strip()
+    return context
+
+
+@conditional(listing_etag, PUBLIC)
+def product_cards(request):
+    """Next batch of product cards for infinite scroll (HTML fragment)"""
+    return shell_response(request, LISTING_VERSIONS, 'store/partials/product_cards.html',
+                          lambda: _catalog_page(request, reverse('product_list')))
+
+def _load_product_detail(product_id, rating=None, cursor=None):
+    product = get_object_or_404(Product.objects.select_related('category'), id=product_id)
+    return product, review_page(product_id, rating, cursor)
+
+
+def _review_filters(request):
+    return parse_rating(request.GET.get('rating')), request.GET.get('cursor')
+
+
+def _review_parts(rating, cursor):
+    """Cache key parts for a review page; the default first page shares the plain product entry"""
+    return ('reviews', rating, cursor) if rating or cursor else ()
+
+
+def _reviews_context(product_id, rating, reviews):
+    next_reviews_url = next_reviews_fragment_url = None
+    if reviews.has_next:
+        params = {'cursor': reviews.next_cursor}
+        if rating:
+            params['rating'] = rating
+        next_reviews_url = f"{reverse('product_detail', args=[product_id])}?{urlencode(params)}#reviews"
+        next_reviews_fragment_url = f"{reverse('product_reviews', args=[product_id])}?{urlencode(params)}"
+    return {
+        'feedback_list': reviews.items,
+        'reviews': reviews,
+        'review_rating': rating,
+        'next_reviews_url': next_reviews_url,
+        'next_reviews_fragment_url': next_reviews_fragment_url,
+    }
+
+
+def _product_context(product, review_rating, reviews, **extra):
+    return {'product': product, **_reviews_context(product.id, review_rating, reviews), **extra}
+
+
+def _reviews_response(request, product_id, rating, reviews):
+    """The review stream as JSON (?format=json) or as an HTML fragment for the product page"""
+    context = _reviews_context(product_id, rating, reviews)
+    if request.GET.get('format') == 'json':
+        next_url = context['next_reviews_fragment_url']
+        return JsonResponse({
+            'reviews': [review_json(feedback) for feedback in reviews.items],
+            'next_cursor': reviews.next_cursor,
+            'next_url': f'{next_url}&format=json' if next_url else None,
+        })
+    return render(request, 'store/partials/review_list.html', context)
+
+
+@conditional(product_etag, PUBLIC)
 def product_view(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
-    
-    # Get existing feedback for this product
-    feedback_list = Feedback.objects.filter(product=product)
+    # Product and the requested page of its reviews are cached until either of them changes;
+    # only one page of reviews is ever loaded, however many there are
+    review_rating, cursor = _review_filters(request)
+
+    def detail():
+        return get_or_set_product(product_id, lambda: _load_product_detail(product_id, review_rating, cursor),
+                                  parts=_review_parts(review_rating, cursor))
+
+    def page_context():
+        product, reviews = detail()
+        return _product_context(product, review_rating, reviews, also_bought=also_bought(product.id))
     
     if request.method == 'POST':
-        # Handle feedback submission
+        # Handle feedback submission; the catalog is open to guests but feedback needs an account
+        if not request.user.is_authenticated:
+            return redirect_to_login(request.get_full_path(), 'login')
+        product, reviews = detail()
         comment = request.POST.get('comment', '').strip()
         rating = request.POST.get('rating', 5)
         
@@ -165,13 +356,9 @@ def product_view(request, product_id):
             errors.append("You have already submitted feedback for this product.")
         
         if errors:
-            return render(request, 'store/product.html', {
-                'product': product,
-                'feedback_list': feedback_list,
-                'errors': errors,
-                'comment': comment,
-                'rating': rating
-            })
+            return render(request, 'store/product.html', _product_context(
+                product, review_rating, reviews, errors=errors, comment=comment, rating=rating,
+            ))
         
         try:
             # Create new feedback
@@ -186,89 +373,139 @@ def product_view(request, product_id):
             
         except Exception as e:
             errors.append("An error occurred while submitting your feedback. Please try again.")
-            return render(request, 'store/product.html', {
-                'product': product,
-                'feedback_list': feedback_list,
-                'errors': errors,
-                'comment': comment,
-                'rating': rating
-            })
+            return render(request, 'store/product.html', _product_context(
+                product, review_rating, reviews, errors=errors, comment=comment, rating=rating,
+            ))
     
-    return render(request, 'store/product.html', {
-        'product': product,
-        'feedback_list': feedback_list
-    })
+    # The same page for everyone; the browser fills in the per-user parts (see shell.py)
+    return shell_response(request, product_versions(product_id), 'store/product.html', page_context)
+
+
+@conditional(reviews_etag, PUBLIC)
+def product_reviews(request, product_id):
+    """Next page of a product's reviews, optionally of one star rating only"""
+    rating, cursor = _review_filters(request)
+    reviews = get_or_set_product(product_id, lambda: review_page(product_id, rating, cursor),
+                                 parts=('review_page', rating, cursor))
+    return _reviews_response(request, product_id, rating, reviews)
 
 # ---------------- CART ----------------
-@login_required(login_url='login')
 def add_to_cart(request, product_id):
     product = get_object_or_404(Product, id=product_id)
     quantity = int(request.POST.get('quantity', 1))
-    quantity = min(quantity, 10)
+    quantity = max(1, min(quantity, 10))
+    if not request.user.is_authenticated:
+        return _add_to_guest_cart(request, product, quantity)
     
-    cart_item, created = Cart.objects.get_or_create(user=request.user, product=product)
-    if not created:
-        cart_item.quantity = min(cart_item.quantity + 1, 10)
-        cart_item.save()
+    cart_item = Cart.objects.filter(user=request.user, product=product).first()
+    created = cart_item is None
+    if created:
+        cart_item = Cart(user=request.user, product=product)
+
+    # Reserving stock also saves the cart row
+    try:
+        if not created:
+            reserve(cart_item, min(cart_item.quantity + 1, 10))
+            messages.success(request, f"Updated {product.name} quantity in your cart!")
+        else:
+            reserve(cart_item, quantity)
+            adjust_counts(request, cart=1)
+            messages.success(request, f"{product.name} added to your cart!")
+    except OutOfStockError:
+        messages.error(request, f"Sorry, {product.name} is out of stock.")
+    return redirect(request.META.get('HTTP_REFERER', 'product_list'))
+
+
+def _add_to_guest_cart(request, product, quantity):
+    """add_to_cart for guests: only the cookie changes (see guest_cart.py), and no stock is held"""
+    cart = guest_cart.read(request)
+    if not product.in_stock:
+        messages.error(request, f"Sorry, {product.name} is out of stock.")
+    elif product.id in cart:
+        cart[product.id] = min(cart[product.id] + 1, guest_cart.MAX_QUANTITY)
         messages.success(request, f"Updated {product.name} quantity in your cart!")
+    elif len(cart) >= guest_cart.MAX_LINES:
+        messages.error(request, "Your cart is full. Log in to add more products.")
     else:
-        cart_item.quantity = quantity
-        cart_item.save()
+        cart[product.id] = quantity
         messages.success(request, f"{product.name} added to your cart!")
-    return redirect(request.META.get('HTTP_REFERER', 'product_list'))
+    response = redirect(request.META.get('HTTP_REFERER', 'product_list'))
+    guest_cart.write(response, cart)
+    return response
+
+
+def _change_guest_cart(request, product_id, quantity):
+    """Set a guest cart line to `quantity`, or remove it with 0. Guest lines are addressed by product id."""
+    cart = guest_cart.read(request)
+    if quantity > 0:
+        if product_id in cart:
+            cart[product_id] = min(quantity, guest_cart.MAX_QUANTITY)
+    else:
+        cart.pop(product_id, None)
+    response = redirect('view_cart')
+    guest_cart.write(response, cart)
+    return response
+
 
 def cart_count(request):
-    if request.user.is_authenticated:
-        return {'cart_count': Cart.objects.filter(user=request.user).count()}
-    return {'cart_count': 0}
+    # Lazy: the template calls this only if the page actually renders the badge
+    return {'cart_count': lambda: get_counts(request)['cart']}
 
-@login_required(login_url='login')
 def view_cart(request):
-    cart_items = Cart.objects.filter(user=request.user)
-    total_price = sum(item.total_price for item in cart_items)
-    return render(request, 'store/cart.html', {'cart_items': cart_items, 'total_price': total_price})
+    if request.user.is_authenticated:
+        cart_items = shopping.cart_items(request.user)
+    else:
+        cart_items = guest_cart.cart_lines(guest_cart.read(request))
+    totals = cart_totals(cart_items)
+    return render(request, 'store/cart.html', {'cart_items': cart_items, 'totals': totals,
+                                               'total_price': totals.total})
 
-@login_required(login_url='login')
 def update_cart_quantity(request, cart_id):
+    if not request.user.is_authenticated:
+        if request.method == "POST":
+            return _change_guest_cart(request, cart_id, int(request.POST.get("quantity", 1)))
+        return redirect('view_cart')
     cart_item = get_object_or_404(Cart, id=cart_id, user=request.user)
     if request.method == "POST":
         new_quantity = int(request.POST.get("quantity", 1))
         if new_quantity > 0:
             # Limit quantity to maximum 10
             new_quantity = min(new_quantity, 10)
-            cart_item.quantity = new_quantity
-            cart_item.save()
+            try:
+                reserve(cart_item, new_quantity)
+            except OutOfStockError:
+                messages.error(request, f"Sorry, only {cart_item.product.stock_available} more of {cart_item.product.name} available.")
     return redirect('view_cart')
 
-@login_required(login_url='login')
 def remove_from_cart(request, cart_id):
+    if not request.user.is_authenticated:
+        return _change_guest_cart(request, cart_id, 0)
     cart_item = get_object_or_404(Cart, id=cart_id, user=request.user)
-    cart_item.delete()
+    with transaction.atomic():
+        release(cart_item)
+        cart_item.delete()
+    adjust_counts(request, cart=-1)
     return redirect('view_cart')
 
 #------------------- CATEGORY -------------------
-@login_required(login_url='login')
+@conditional(listing_etag, PUBLIC)
 def category_view(request, category_name):
-    print(f"Category requested: {category_name}")  # Debug print
-    
-    # Get all distinct categories for debugging
-    all_categories = Product.objects.values_list('category', flat=True).distinct()
-    print(f"Available categories in DB: {list(all_categories)}")
-    
-    # Handle 'all' category to show all products
+    # 'all' shows every product, anything else is a category slug (or name, any case)
+    return shell_response(request, LISTING_VERSIONS, 'store/category.html', lambda: _category_context(
+        category_name, _catalog_page(request, reverse('category', args=[category_name]), category_name)))
+
+
+def _category_context(category_name, context):
     if category_name.lower() == 'all':
-        products = Product.objects.all()
-        category_name = 'All Products'
+        context['category_name'] = 'All Products'
     else:
-        # Filter products by category (case-insensitive)
-        products = Product.objects.filter(category__iexact=category_name)
-        print(f"Products found: {products.count()}")  # Debug print
-    
-    return render(request, 'store/category.html', {
-        'category_name': category_name, 
-        'products': products,
-        'all_categories': all_categories  # Pass for debugging
-    })
+        context['category_name'] = context['selected']['name'] if context['selected'] else category_name
+    return context
+
+
+def category_menu(request):
+    # Lazy, like cart_count: the nav is cached and only read if the page shows the menu
+    return {'category_nav': category_nav}
 
 
 # ---------------- WISHLIST ----------------
@@ -283,6 +520,7 @@ def add_to_wishlist(request, product_id):
     )
     
     if created:
+        adjust_counts(request, wishlist=1)
         messages.success(request, f"{product.name} added to your wishlist!")
     else:
         messages.info(request, f"{product.name} is already in your wishlist!")
@@ -294,20 +532,41 @@ def remove_from_wishlist(request, product_id):
     product = get_object_or_404(Product, id=product_id)
     wishlist_item = get_object_or_404(Wishlist, user=request.user, product=product)
     wishlist_item.delete()
+    adjust_counts(request, wishlist=-1)
     messages.success(request, f"{product.name} removed from your wishlist!")
     return redirect(request.META.get('HTTP_REFERER', 'view_wishlist'))
 
 @login_required(login_url='login')
 def view_wishlist(request):
-    wishlist_items = Wishlist.objects.filter(user=request.user)
-    return render(request, 'store/wishlist.html', {'wishlist_items': wishlist_items})
+    return render(request, 'store/wishlist.html', {'wishlist_items': shopping.wishlist_items(request.user)})
 
 def wishlist_count(request):
-    if request.user.is_authenticated:
-        return {'wishlist_count': Wishlist.objects.filter(user=request.user).count()}
-    return {'wishlist_count': 0}
+    return {'wishlist_count': lambda: get_counts(request)['wishlist']}
+
+# ---------------- USER FRAGMENTS ----------------
+@never_cache
+def user_fragments(request):
+    """The per-user parts of a shared catalog page (see shell.py) as JSON, for ?products=1,2,3"""
+    product_ids = {int(pk) for pk in request.GET.get('products', '').split(',') if pk.isdecimal()}
+    return JsonResponse(user_state(request, product_ids))
+
 
 # ---------------- BUY NOW ----------------
+def _validate_customer(name, mobile, email):
+    """Validate the customer details shared by Buy Now and cart checkout"""
+    errors = []
+    if not name:
+        errors.append("Name is required.")
+    if not mobile:
+        errors.append("Mobile number is required.")
+    elif not mobile.isdigit():
+        errors.append("Mobile number must contain only numbers.")
+    elif len(mobile) < 10 or len(mobile) > 15:
+        errors.append("Mobile number must be between 10 and 15 digits.")
+    if not email or '@' not in email:
+        errors.append("Valid email is required.")
+    return errors
+
 @login_required(login_url='login')
 def buy_now_view(request, product_id):
     product = get_object_or_404(Product, id=product_id)
@@ -329,17 +588,7 @@ def buy_now_view(request, product_id):
         quantity = int(request.POST.get('quantity', 1))
         
         # Basic validation
-        errors = []
-        if not name:
-            errors.append("Name is required.")
-        if not mobile:
-            errors.append("Mobile number is required.")
-        elif not mobile.isdigit():
-            errors.append("Mobile number must contain only numbers.")
-        elif len(mobile) < 10 or len(mobile) > 15:
-            errors.append("Mobile number must be between 10 and 15 digits.")
-        if not email or '@' not in email:
-            errors.append("Valid email is required.")
+        errors = _validate_customer(name, mobile, email)
         if quantity < 1 or quantity > 10:
             errors.append("Quantity must be between 1 and 10.")
         
@@ -356,20 +605,22 @@ def buy_now_view(request, product_id):
         
         # Create order
         try:
-            order = Order.objects.create(
-                user=request.user,
-                product=product,
-                customer_name=name,
-                email=email,
-                mobile=mobile,
-                address=address if address else None,
-                quantity=quantity,
-                total_amount=product.final_price * quantity,
-                order_status='Pending'
-            )
+            order = place_single_order(request.user, product, quantity, name, email, mobile, address)
             # Redirect to order confirmation page
             return redirect('order_confirmation', order_id=order.id)
-            
+
+        except OutOfStockError:
+            errors.append(f"Sorry, there isn't enough stock of {product.name} for this order.")
+            return render(request, 'store/buy_now.html', {
+                'product': product,
+                'errors': errors,
+                'name': name,
+                'mobile': mobile,
+                'email': email,
+                'address': address,
+                'quantity': quantity
+            })
+
         except Exception as e:
             errors.append("An error occurred while placing your order. Please try again.")
             return render(request, 'store/buy_now.html', {
@@ -388,6 +639,43 @@ def buy_now_view(request, product_id):
     })
 
 
+# ---------------- CHECKOUT ----------------
+@login_required(login_url='login')
+def checkout_view(request):
+    """Place one order for everything in the cart"""
+    context = {}
+    if request.method == 'POST':
+        name = request.POST.get('name', '').strip()
+        mobile = request.POST.get('mobile', '').strip()
+        email = request.POST.get('email', '').strip()
+        address = request.POST.get('address', '').strip()
+        context = {'name': name, 'mobile': mobile, 'email': email, 'address': address}
+
+        errors = _validate_customer(name, mobile, email)
+        if not errors:
+            try:
+                order = place_cart_order(request.user, name, email, mobile, address)
+                reset_counts(request)
+                return redirect('order_confirmation', order_id=order.id)
+            except EmptyCartError:
+                messages.info(request, "Your cart is empty.")
+                return redirect('view_cart')
+            except OutOfStockError as e:
+                names = ', '.join(p.name for p in e.products)
+                errors.append(f"Sorry, these items no longer have enough stock: {names}. Please update your cart.")
+            except Exception as e:
+                errors.append("An error occurred while placing your order. Please try again.")
+        context['errors'] = errors
+
+    cart_items = cart_lines(request.user)
+    if not cart_items:
+        messages.info(request, "Your cart is empty.")
+        return redirect('view_cart')
+    lines, total = price_cart(cart_items)
+    context.update({'lines': lines, 'total_amount': total})
+    return render(request, 'store/checkout.html', context)
+
+
 # ---------------- ACCOUNT ----------------
 @login_required(login_url='login')
 def account_view(request):
@@ -396,18 +684,33 @@ def account_view(request):
     return render(request, 'store/account.html', {'user': user})
 
 # ---------------- ORDERS ----------------
+def _orders_context(request, page, archived):
+    next_url = None
+    if page.has_next:
+        next_url = f"{reverse('order_archive' if archived else 'view_orders')}?{urlencode({'cursor': page.next_cursor})}"
+    return {'orders': page.items, 'next_url': next_url, 'archived': archived, 'stats': order_stats(request.user)}
+
+
 @login_required(login_url='login')
 def view_orders(request):
-    """Display all orders for the current user"""
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, 'store/orders.html', {'orders': orders})
+    """The user's recent orders, a page at a time"""
+    page = recent_orders(request.user, request.GET.get('cursor'))
+    return render(request, 'store/orders.html', _orders_context(request, page, archived=False))
+
+
+@login_required(login_url='login')
+def order_archive(request):
+    """The user's archived orders (see orders.py), a page at a time"""
+    page = archived_orders(request.user, request.GET.get('cursor'))
+    return render(request, 'store/orders.html', _orders_context(request, page, archived=True))
 
 # ---------------- ORDER CONFIRMATION ----------------
 @login_required(login_url='login')
 def order_confirmation_view(request, order_id):
-    order = get_object_or_404(Order, id=order_id, user=request.user)
+    order = get_object_or_404(Order.objects.prefetch_related('items__product'), id=order_id, user=request.user)
     
-    if request.method == 'POST' and 'feedback' in request.POST:
+    # Feedback is per product, so it's only offered on single-product orders
+    if request.method == 'POST' and 'feedback' in request.POST and order.product_id:
         # Handle feedback submission
         feedback_text = request.POST.get('feedback_text', '').strip()
         errors = []
@@ -449,3 +752,48 @@ def order_confirmation_view(request, order_id):
             })
     
     return render(request, 'store/order_confirmation.html', {'order': order})
+
+
+# ---------------- CACHE STATS ----------------
+@staff_member_required
+def cache_stats(request):
+    """Catalog cache hit/miss counters for this worker process"""
+    return JsonResponse(cache_stats_snapshot())
+
+# ---------------- VIEW METRICS ----------------
+@staff_member_required
+def view_metrics_report(request):
+    """Per-view latency, query-count and SQL-time percentiles (see metrics.py)"""
+    return JsonResponse(collected_report())
+
+# ---------------- SALES ANALYTICS ----------------
+def _report_days(request):
+    try:
+        return int(request.GET.get('days', 30))
+    except ValueError:
+        return 30
+
+
+@staff_member_required
+def sales_dashboard(request):
+    """Revenue, units and top sellers from the daily rollups (see analytics.py)"""
+    return render(request, 'store/sales_dashboard.html', {'report': sales_report(_report_days(request)),
+                                                         'status_counts': status_counts()})
+
+
+@staff_member_required
+def sales_report_json(request):
+    """sales_report() as JSON, for ?days=N (at most a year)"""
+    return JsonResponse(sales_report(_report_days(request)))
+
+# ---------------- CATALOG EXPORT ----------------
+@staff_member_required
+def export_products(request):
+    """Stream the whole catalog as CSV or JSONL (?format=jsonl)"""
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        fmt = 'csv'
+    content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(export_rows(fmt), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="products.{fmt}"'
+    return response
@@ -0,0 +1,59 @@
+"""
+Incremental readers of the order tables: how far a cron job has read is a
+Watermark row, holding the last id it has handled.
+
+Order lines are read past one watermark on OrderItem ids, and legacy orders
+without lines (orders.legacy_orders()) past a second one on Order ids. Ids
+are handed out before a checkout commits, so a row with a lower id than one
+already read may still show up. Lines of orders younger than SETTLE_TIME are
+therefore left for the next run: by then every checkout that took a lower id
+has committed or rolled back.
+
+Used by analytics.py (sales rollups) and recommendations.py (pair counts).
+"""
+from datetime import timedelta
+
+from django.db.models import Max, Min
+
+from .models import Order, OrderItem, Watermark
+from .orders import legacy_orders
+
+SETTLE_TIME = timedelta(minutes=5)
+
+
+def lock(*names):
+    """The watermarks called `names`, created at 0 if missing and locked until the end of the transaction"""
+    return [Watermark.objects.select_for_update().get_or_create(name=name)[0] for name in names]
+
+
+def _settled_upto(new, created_at, batch_size, now):
+    """The last pk of the next batch of `new`, stopping short of the first row younger than SETTLE_TIME"""
+    unsettled = new.filter(**{f'{created_at}__gte': now - SETTLE_TIME}).aggregate(first=Min('pk'))['first']
+    if unsettled is not None:
+        new = new.filter(pk__lt=unsettled)
+    upto = new.order_by('pk').values_list('pk', flat=True)[batch_size - 1:batch_size].first()
+    if upto is None:
+        upto = new.aggregate(last=Max('pk'))['last']
+    return upto
+
+
+def next_batch(items, legacy, batch_size, now):
+    """
+    (last OrderItem id, last legacy Order id) of the next batch of settled
+    order lines and legacy orders past the `items` and `legacy` watermarks,
+    each at most `batch_size` rows, or None once both are caught up. A side
+    with nothing new stays at its watermark.
+    """
+    items_upto = _settled_upto(OrderItem.objects.filter(pk__gt=items.last_id), 'order__created_at', batch_size, now)
+    orders_upto = _settled_upto(legacy_orders(Order.objects.filter(pk__gt=legacy.last_id)), 'created_at',
+                                batch_size, now)
+    if items_upto is None and orders_upto is None:
+        return None
+    return items_upto or items.last_id, orders_upto or legacy.last_id
+
+
+def advance(items, legacy, batch):
+    """Move the `items` and `legacy` watermarks to the end of `batch` (from next_batch())"""
+    items.last_id, legacy.last_id = batch
+    items.save()
+    legacy.save()